@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import random
+import torch
+from torch.utils.data import Sampler
+from torch.nn.utils.rnn import pad_sequence
+
+"""
+动态padding与长度分桶
+样本在数据集中不做padding，组batch时只补齐到该batch内最长的样本
+配合分桶采样，让长度相近的样本落在同一个batch，进一步减少pad位置的计算
+"""
+
+
+#生成collate_fn，pad_values按样本中各字段的顺序给出补齐值
+#例如分类任务 [input_id, label] -> (0, 0)，ner任务 [input_id, labels] -> (0, -1)
+def pad_collate(pad_values):
+    def collate_fn(batch):
+        fields = []
+        for index, items in enumerate(zip(*batch)):
+            fields.append(pad_sequence(list(items), batch_first=True, padding_value=pad_values[index]))
+        return fields
+    return collate_fn
+
+
+#按长度分桶的batch采样
+#先打乱，再在每个大小为 batch_size * bucket_multiplier 的池子内按长度排序切分batch，最后打乱batch顺序
+#这样既保留随机性，又让同一batch内的样本长度接近
+class BucketBatchSampler(Sampler):
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_multiplier=50, drop_last=False):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_multiplier = bucket_multiplier
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            random.shuffle(indices)
+        pool_size = self.batch_size * self.bucket_multiplier
+        batches = []
+        for start in range(0, len(indices), pool_size):
+            pool = sorted(indices[start:start + pool_size], key=lambda i: self.lengths[i])
+            for batch_start in range(0, len(pool), self.batch_size):
+                batch = pool[batch_start:batch_start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch)
+        if self.shuffle:
+            random.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+if __name__ == "__main__":
+    batch = [[torch.LongTensor([1, 2, 3]), torch.LongTensor([0, 1, 1])],
+             [torch.LongTensor([4, 5]), torch.LongTensor([1, 1])]]
+    x, y = pad_collate((0, -1))(batch)
+    print(x, y)
+    sampler = BucketBatchSampler([5, 1, 3, 2, 4, 6], batch_size=2, bucket_multiplier=3)
+    print(list(sampler))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import io
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+"""
+int8动态量化
+对模型中的Linear层做动态量化，并对比量化前后的效果、延迟和模型大小
+week7/9/13的export_int8.py共用
+"""
+
+
+def quantize_linear(model):
+    model = model.cpu().eval()
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+#序列化后的权重大小，量化后的Linear权重以int8打包存储
+def state_dict_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 / 1024
+
+
+def measure_latency(model, input_ids, repeat=20, warmup=3):
+    model.eval()
+    costs = []
+    with torch.no_grad():
+        for i in range(warmup + repeat):
+            start = time.perf_counter()
+            model(input_ids)
+            if i >= warmup:
+                costs.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(costs, 50)), float(np.percentile(costs, 99))
+
+
+#evaluator.eval的返回值：分类为准确率，ner为f1字典，统一成字典
+def as_metrics(result):
+    if isinstance(result, dict):
+        return result
+    return {"acc": result}
+
+
+#分别用evaluator测试fp32和int8模型，输出效果差异和延迟、大小对比
+def compare_models(fp32_model, int8_model, evaluator, sample_input, logger):
+    report = {}
+    for name, model in [("fp32", fp32_model), ("int8", int8_model)]:
+        evaluator.model = model
+        metrics = as_metrics(evaluator.eval(0))
+        p50, p99 = measure_latency(model, sample_input)
+        report[name] = {"metrics": metrics, "latency_p50_ms": p50, "latency_p99_ms": p99,
+                        "size_mb": state_dict_size_mb(model)}
+    fp32, int8 = report["fp32"], report["int8"]
+    logger.info("%-10s %12s %12s %12s" % ("", "fp32", "int8", "delta"))
+    for key in fp32["metrics"]:
+        logger.info("%-10s %12.4f %12.4f %+12.4f" % (key, fp32["metrics"][key], int8["metrics"][key],
+                                                    int8["metrics"][key] - fp32["metrics"][key]))
+    for key in ["latency_p50_ms", "latency_p99_ms", "size_mb"]:
+        logger.info("%-10s %12.2f %12.2f %11.2fx" % (key.replace("latency_", ""), fp32[key], int8[key],
+                                                   fp32[key] / max(int8[key], 1e-9)))
+    return report
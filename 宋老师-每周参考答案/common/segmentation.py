@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from multiprocessing import Pool
+import jieba
+
+"""
+分词缓存
+使用词表时，同一个句子每次编码都要重新分词，jieba的词典也要等到第一次分词时才加载
+这里在启动时直接加载词典；整个文件可以多进程批量分词，结果按文本哈希持久化；线上请求使用有上限的LRU缓存
+"""
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+
+def _init_worker():
+    jieba.initialize()
+
+
+def _cut_chunk(texts):
+    return [jieba.lcut(text) for text in texts]
+
+
+class Segmenter:
+    def __init__(self, cache_path=None, lru_size=100000):
+        #启动时加载jieba词典，避免第一条请求承担加载耗时
+        jieba.initialize()
+        self.cache_path = cache_path
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.persistent = {}
+        if cache_path is not None and os.path.isfile(cache_path):
+            with open(cache_path, encoding="utf8") as f:
+                for line in f:
+                    line = line.strip()
+                    #写到一半中断的最后一行直接跳过
+                    try:
+                        key, words = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.persistent[key] = words
+
+    def cut(self, text):
+        key = text_key(text)
+        with self.lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                return self.lru[key]
+        words = self.persistent.get(key)
+        if words is None:
+            words = jieba.lcut(text)
+        with self.lock:
+            self.lru[key] = words
+            if len(self.lru) > self.lru_size:
+                self.lru.popitem(last=False)
+        return words
+
+    #对一批文本分词，只处理持久化缓存中没有的文本，新结果追加写入缓存文件
+    def segment_all(self, texts, num_workers=None, chunk_size=1000):
+        missing = {}
+        for text in texts:
+            key = text_key(text)
+            if key not in self.persistent:
+                missing[key] = text
+        if not missing:
+            return
+        keys, missing_texts = list(missing.keys()), list(missing.values())
+        num_workers = num_workers or os.cpu_count() or 1
+        if num_workers == 1 or len(missing_texts) < chunk_size:
+            results = _cut_chunk(missing_texts)
+        else:
+            chunks = [missing_texts[i:i + chunk_size] for i in range(0, len(missing_texts), chunk_size)]
+            with Pool(num_workers, initializer=_init_worker) as pool:
+                results = [words for chunk in pool.map(_cut_chunk, chunks) for words in chunk]
+        self.persistent.update(zip(keys, results))
+        if self.cache_path is not None:
+            with open(self.cache_path, "a", encoding="utf8") as f:
+                for key, words in zip(keys, results):
+                    f.write(json.dumps([key, words], ensure_ascii=False) + "\n")
+        return
+
+    def segment_file(self, path, num_workers=None):
+        with open(path, encoding="utf8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        self.segment_all(texts, num_workers)
+        return texts
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import torch
+
+"""
+BIO实体片段抽取
+根据schema中的 B-X / I-X 标签，对整个batch的标签矩阵一次性找出所有实体片段，
+结果为 (句子序号, 起始位置, 结束位置(不含), 实体类型序号) 组成的 (实体数, 4) 矩阵
+一个片段由 B-X 开始，后接连续的 I-X；没有 B-X 开头的 I-X 不算实体
+"""
+
+
+class SpanExtractor:
+    def __init__(self, schema):
+        index_to_label = dict((index, label) for label, index in schema.items())
+        self.types = []
+        for index in sorted(index_to_label):
+            label = index_to_label[index]
+            if label[:2] in ("B-", "I-") and label[2:] not in self.types:
+                self.types.append(label[2:])
+        #标签值+1作为下标，使padding的-1也能查表
+        self.begin_type = torch.full((len(schema) + 1,), -1, dtype=torch.long)
+        self.entity_type = torch.full((len(schema) + 1,), -1, dtype=torch.long)
+        self.is_inside = torch.zeros(len(schema) + 1, dtype=torch.bool)
+        for index, label in index_to_label.items():
+            if label[:2] in ("B-", "I-"):
+                self.entity_type[index + 1] = self.types.index(label[2:])
+            if label[:2] == "B-":
+                self.begin_type[index + 1] = self.types.index(label[2:])
+            if label[:2] == "I-":
+                self.is_inside[index + 1] = True
+
+    #labels: (batch_size, sen_len)，lengths: 每句参与抽取的长度，超出部分视为padding
+    #min_length: 片段最短长度，原先正则 "B(I+)" 的写法相当于 min_length=2
+    def extract(self, labels, lengths=None, min_length=1):
+        labels = torch.as_tensor(labels, dtype=torch.long).cpu()
+        if labels.dim() == 1:
+            labels = labels.unsqueeze(0)
+        batch_size, sen_len = labels.shape
+        if lengths is not None:
+            lengths = torch.as_tensor(lengths, dtype=torch.long).cpu()
+            labels = labels.masked_fill(torch.arange(sen_len).unsqueeze(0) >= lengths.unsqueeze(1), -1)
+        index = labels + 1
+        entity_type = self.entity_type[index]
+        #与前一位置同类型的I-X延续当前片段，其余位置都开始一个新的分组
+        previous_type = torch.cat([torch.full((batch_size, 1), -1, dtype=torch.long), entity_type[:, :-1]], dim=1)
+        group_start = ~(self.is_inside[index] & (entity_type == previous_type))
+        group_start[:, 0] = True
+        starts = torch.nonzero(group_start.view(-1)).view(-1)
+        ends = torch.cat([starts[1:], torch.LongTensor([batch_size * sen_len])])
+        begin_type = self.begin_type[index].view(-1)[starts]
+        #只保留以B-X开头的分组
+        keep = (begin_type >= 0) & (ends - starts >= min_length)
+        starts, ends, begin_type = starts[keep], ends[keep], begin_type[keep]
+        sentence_index = starts // sen_len
+        return torch.stack([sentence_index, starts % sen_len, ends - sentence_index * sen_len, begin_type], dim=1)
+
+    #单句的实体文本，offset为标签相对句子的偏移，如标签第0位是[CLS]时offset=1
+    def decode(self, sentence, labels, offset=0, min_length=1):
+        spans = self.extract(labels, [len(sentence) + offset], min_length)
+        results = dict((entity, []) for entity in self.types)
+        for _, start, end, entity in spans.tolist():
+            results[self.types[entity]].append(sentence[start - offset:end - offset])
+        return results
+
+
+#按实体类型统计 正确识别数、样本实体数、识别出实体数
+#片段以 (句子, 起始, 结束, 类型) 判断是否相同
+#同一组片段内不会重复，两组拼接后出现两次的行即为正确识别的片段
+def span_counts(true_spans, pred_spans, type_num):
+    spans, counts = torch.unique(torch.cat([true_spans, pred_spans]).view(-1, 4), dim=0, return_counts=True)
+    correct = torch.bincount(spans[counts == 2][:, 3], minlength=type_num)
+    return correct, torch.bincount(true_spans[:, 3], minlength=type_num), torch.bincount(pred_spans[:, 3], minlength=type_num)
+
+
+if __name__ == "__main__":
+    schema = {"B-LOCATION": 0, "B-ORGANIZATION": 1, "B-PERSON": 2, "B-TIME": 3, "I-LOCATION": 4,
+              "I-ORGANIZATION": 5, "I-PERSON": 6, "I-TIME": 7, "O": 8}
+    extractor = SpanExtractor(schema)
+    labels = torch.LongTensor([[8, 0, 4, 4, 8, 2, 6, 6, 4, 8],
+                               [3, 7, 2, 1, 5, 4, 6, 0, -1, -1]])
+    print(extractor.extract(labels))
+    print(extractor.decode("上海市在北京", [0, 4, 4, 8, 0, 4]))
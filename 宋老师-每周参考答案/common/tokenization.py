@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from multiprocessing import Pool
+from transformers import BertTokenizer
+
+"""
+批量编码
+输入一批文本，优先使用rust实现的fast tokenizer按大batch编码；
+没有fast tokenizer时，把文本切块交给多进程，每个进程各自加载一份BertTokenizer
+结果与逐条调用 BertTokenizer.encode 相同，可以用 check_equivalence 验证
+"""
+
+
+def load_fast_tokenizer(tokenizer_path):
+    try:
+        from transformers import BertTokenizerFast
+        return BertTokenizerFast.from_pretrained(tokenizer_path)
+    except Exception:
+        #没有安装tokenizers，或者该目录无法转换成fast tokenizer
+        return None
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+#多进程编码时，每个worker持有一份tokenizer
+_worker_tokenizer = None
+_worker_kwargs = None
+
+
+#tokenizer为路径时在worker中加载，为实例时随进程参数传入，不再读盘
+def _init_worker(tokenizer, kwargs):
+    global _worker_tokenizer, _worker_kwargs
+    if isinstance(tokenizer, str):
+        tokenizer = BertTokenizer.from_pretrained(tokenizer)
+    _worker_tokenizer = tokenizer
+    _worker_kwargs = kwargs
+
+
+def _encode_chunk(texts):
+    return [_worker_tokenizer.encode(text, **_worker_kwargs) for text in texts]
+
+
+#tokenizer可以是tokenizer目录，也可以是已经加载好的tokenizer实例
+#kwargs与BertTokenizer.encode的参数一致，如 max_length、truncation、padding、add_special_tokens
+def bulk_encode(tokenizer, texts, batch_size=10000, num_workers=None, use_fast=True, **kwargs):
+    texts = list(texts)
+    if len(texts) == 0:
+        return []
+    if not isinstance(tokenizer, str):
+        #已加载的实例直接使用，本身是fast tokenizer时走批量编码
+        fast_tokenizer = tokenizer if use_fast and getattr(tokenizer, "is_fast", False) else None
+    else:
+        fast_tokenizer = load_fast_tokenizer(tokenizer) if use_fast else None
+    if fast_tokenizer is not None:
+        input_ids = []
+        for batch in chunks(texts, batch_size):
+            input_ids.extend(fast_tokenizer(batch, **kwargs)["input_ids"])
+        return input_ids
+    num_workers = num_workers or os.cpu_count() or 1
+    #文本太少时多进程的启动开销不划算，直接在当前进程编码
+    if num_workers == 1 or len(texts) < batch_size:
+        _init_worker(tokenizer, kwargs)
+        return _encode_chunk(texts)
+    chunk_size = max(1, min(batch_size, len(texts) // num_workers))
+    with Pool(num_workers, initializer=_init_worker, initargs=(tokenizer, kwargs)) as pool:
+        input_ids = []
+        for chunk_ids in pool.imap(_encode_chunk, chunks(texts, chunk_size)):
+            input_ids.extend(chunk_ids)
+    return input_ids
+
+
+#已经切分好的token序列(如ner中逐字的输入)，等价于 BertTokenizer.encode(tokens, max_length, truncation, padding)
+#slow tokenizer对列表输入直接按词表查id，这里省去逐条调用encode的开销
+def bulk_convert_tokens(tokenizer, token_lists, max_length, padding=True):
+    vocab = tokenizer.vocab
+    unk_id = vocab[tokenizer.unk_token]
+    cls_id, sep_id, pad_id = tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id
+    input_ids = []
+    for tokens in token_lists:
+        input_id = [cls_id] + [vocab.get(token, unk_id) for token in tokens[:max_length - 2]] + [sep_id]
+        if padding:
+            input_id += [pad_id] * (max_length - len(input_id))
+        input_ids.append(input_id)
+    return input_ids
+
+
+#与逐条调用slow tokenizer的结果对比，返回不一致的样本下标
+def check_equivalence(tokenizer_path, texts, **kwargs):
+    texts = list(texts)
+    tokenizer = BertTokenizer.from_pretrained(tokenizer_path)
+    expected = [tokenizer.encode(text, **kwargs) for text in texts]
+    mismatch = []
+    for use_fast in [True, False]:
+        actual = bulk_encode(tokenizer_path, texts, use_fast=use_fast, num_workers=2, batch_size=64, **kwargs)
+        mismatch += [index for index, (a, b) in enumerate(zip(expected, actual)) if a != b]
+        assert len(actual) == len(expected)
+    return sorted(set(mismatch))
+
+
+if __name__ == "__main__":
+    #用法：python tokenization.py bert路径 文本文件
+    tokenizer_path, text_path = sys.argv[1], sys.argv[2]
+    with open(text_path, encoding="utf8") as f:
+        texts = [line.strip() for line in f][:5000]
+    for kwargs in [{}, {"max_length": 30, "truncation": True},
+                   {"max_length": 30, "truncation": True, "padding": "max_length"},
+                   {"add_special_tokens": False}]:
+        mismatch = check_equivalence(tokenizer_path, texts, **kwargs)
+        print(kwargs, "不一致条数：", len(mismatch), [texts[i] for i in mismatch[:5]])
+    tokenizer = BertTokenizer.from_pretrained(tokenizer_path)
+    token_lists = [list(text) for text in texts if text]
+    expected = [tokenizer.encode(tokens, padding="max_length", max_length=30, truncation=True) for tokens in token_lists]
+    actual = bulk_convert_tokens(tokenizer, token_lists, 30)
+    print("逐字输入不一致条数：", sum(a != b for a, b in zip(expected, actual)))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import os
+import math
+import random
+import threading
+import numpy as np
+import torch
+
+"""
+通用训练流程
+week7/9/13的main.py共用，支持梯度累积、cpu上的bf16 autocast、线程数控制，
+以及包含优化器和随机数状态的断点，保存在后台线程中进行，可以从断点精确续跑
+模型需要满足 model(*batch_data) 返回loss，evaluator需要提供 eval(epoch)
+"""
+
+
+def get_rng_state():
+    state = {"python": random.getstate(),
+             "numpy": np.random.get_state(),
+             "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+#把state_dict拷贝到cpu上，之后在后台线程中写盘，不影响训练继续更新参数
+def cpu_copy(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().cpu().clone()
+    if isinstance(obj, dict):
+        return dict((k, cpu_copy(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_copy(v) for v in obj)
+    return obj
+
+
+class Trainer:
+    def __init__(self, config, model, optimizer, evaluator, logger):
+        self.config = config
+        self.model = model
+        self.optimizer = optimizer
+        self.evaluator = evaluator
+        self.logger = logger
+        self.cuda_flag = torch.cuda.is_available()
+        self.accum_steps = config.get("grad_accum_steps", 1)
+        #"bf16"时在cpu/gpu上开启bfloat16 autocast
+        self.autocast = config.get("autocast") == "bf16"
+        #每隔多少个更新步保存一次断点，None时不在轮内保存
+        self.checkpoint_steps = config.get("checkpoint_steps")
+        #网格搜索等场景每个实验都有自己的model_path，默认不在每轮结束写完整断点
+        self.checkpoint_every_epoch = bool(config.get("checkpoint_every_epoch") or config.get("resume")
+                                           or self.checkpoint_steps)
+        #最近一轮evaluator的结果，随断点保存，从最后一轮之后的断点续跑时直接返回
+        self.result = None
+        self.checkpoint_path = os.path.join(config["model_path"], "checkpoint.pt")
+        if config.get("num_threads"):
+            torch.set_num_threads(config["num_threads"])
+        self.save_thread = None
+
+    def save_checkpoint(self, epoch, step, epoch_rng_state):
+        state = {"model": cpu_copy(self.model.state_dict()),
+                 "optimizer": cpu_copy(self.optimizer.state_dict()),
+                 "epoch": epoch,
+                 "step": step,
+                 "epoch_rng_state": epoch_rng_state,
+                 "rng_state": get_rng_state(),
+                 "result": self.result}
+        #上一次保存还没写完时先等待，保证断点文件顺序写入
+        self.wait_for_save()
+        self.save_thread = threading.Thread(target=self.write_checkpoint, args=(state,))
+        self.save_thread.start()
+
+    def write_checkpoint(self, state):
+        tmp_path = self.checkpoint_path + ".tmp"
+        torch.save(state, tmp_path)
+        #先写临时文件再替换，写到一半崩溃不会破坏旧断点
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def wait_for_save(self):
+        if self.save_thread is not None:
+            self.save_thread.join()
+            self.save_thread = None
+
+    def load_checkpoint(self):
+        #断点中有numpy和python的随机数状态，weights_only=True无法加载；文件由trainer自己写出，可以信任
+        state = torch.load(self.checkpoint_path, map_location="cpu", weights_only=False)
+        self.model.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.logger.info("从断点恢复：第%d轮，第%d步" % (state["epoch"], state["step"]))
+        return state
+
+    def train(self, train_data):
+        start_epoch, skip_steps, resume_state = 1, 0, None
+        if self.config.get("resume") and os.path.isfile(self.checkpoint_path):
+            resume_state = self.load_checkpoint()
+            start_epoch, skip_steps = resume_state["epoch"], resume_state["step"]
+            self.result = resume_state.get("result")
+        try:
+            for epoch in range(start_epoch, self.config["epoch"] + 1):
+                if resume_state is not None:
+                    #恢复本轮开始时的随机数状态，使数据打乱顺序与中断前一致
+                    set_rng_state(resume_state["epoch_rng_state"])
+                epoch_rng_state = get_rng_state()
+                self.train_epoch(epoch, train_data, epoch_rng_state, skip_steps, resume_state)
+                skip_steps, resume_state = 0, None
+                self.result = self.evaluator.eval(epoch)
+                #每轮结束保存一次，记录的是下一轮开始时的状态
+                if self.checkpoint_every_epoch:
+                    self.save_checkpoint(epoch + 1, 0, get_rng_state())
+        finally:
+            #训练或评估出错时也要等后台保存写完，保证已生成的断点可用
+            self.wait_for_save()
+        return self.result
+
+    def train_epoch(self, epoch, train_data, epoch_rng_state, skip_steps=0, resume_state=None):
+        self.model.train()
+        self.logger.info("epoch %d begin" % epoch)
+        train_loss = []
+        self.optimizer.zero_grad()
+        device_type = "cuda" if self.cuda_flag else "cpu"
+        #第step步更新覆盖前 step * accum_steps 个batch，本轮最后一次累积不满时也算一步
+        skip_batches = min(skip_steps * self.accum_steps, len(train_data))
+        for index, batch_data in enumerate(train_data):
+            #断点续跑时跳过已经训练过的batch，之后恢复中断时的随机数状态
+            if index < skip_batches:
+                if index == skip_batches - 1 and resume_state is not None:
+                    set_rng_state(resume_state["rng_state"])
+                continue
+            if self.cuda_flag:
+                batch_data = [d.cuda() for d in batch_data]
+            with torch.autocast(device_type=device_type, dtype=torch.bfloat16, enabled=self.autocast):
+                loss = self.model(*batch_data)   #输入变化时这里需要修改，比如多输入，多输出的情况
+            #梯度累积：loss按累积步数缩放，累积够之后再更新一次参数
+            (loss / self.accum_steps).backward()
+            train_loss.append(loss.item())
+            if (index + 1) % self.accum_steps == 0 or index + 1 == len(train_data):
+                self.optimizer.step()
+                self.optimizer.zero_grad()
+                step = math.ceil((index + 1) / self.accum_steps)
+                if self.checkpoint_steps and step % self.checkpoint_steps == 0:
+                    self.save_checkpoint(epoch, step, epoch_rng_state)
+            if index % max(1, int(len(train_data) / 2)) == 0:
+                self.logger.info("batch loss %f" % loss)
+        #从本轮最后一步的断点续跑时，本轮没有需要训练的batch
+        if train_loss:
+            self.logger.info("epoch average loss: %f" % np.mean(train_loss))
+        return
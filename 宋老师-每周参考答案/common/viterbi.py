@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import torch
+
+"""
+批量viterbi解码
+torchcrf的decode逐句返回python列表，且不区分padding位置
+这里整个batch一起在tensor上解码，padding位置输出-1；
+可以传入BIO约束(I-X只能跟在B-X或I-X之后，句首不能是I-X)，也可以返回分数最高的k条路径
+week9/13的模型共用
+"""
+
+
+#根据schema生成合法转移矩阵 allowed[i, j] 表示标签i后面能否接标签j，以及句首允许的标签
+def bio_allowed_transitions(schema):
+    class_num = len(schema)
+    index_to_label = dict((index, label) for label, index in schema.items())
+    allowed = torch.ones(class_num, class_num, dtype=torch.bool)
+    allowed_start = torch.ones(class_num, dtype=torch.bool)
+    for j in range(class_num):
+        label = index_to_label[j]
+        if not label.startswith("I-"):
+            continue
+        entity = label[2:]
+        allowed_start[j] = False
+        for i in range(class_num):
+            allowed[i, j] = index_to_label[i] in ("B-" + entity, "I-" + entity)
+    return allowed, allowed_start
+
+
+#emissions: (batch_size, sen_len, class_num)，mask: (batch_size, sen_len)，要求有效位置从句首连续
+#topk=1时返回 tags (batch_size, sen_len) 和 scores (batch_size,)
+#topk>1时返回 tags (batch_size, topk, sen_len) 和 scores (batch_size, topk)，合法路径不足k条时多出的路径分数为-inf
+def viterbi_decode(emissions, mask, transitions, start_transitions, end_transitions,
+                   allowed=None, allowed_start=None, topk=1):
+    batch_size, sen_len, class_num = emissions.shape
+    emissions = emissions.float()
+    mask = mask.bool()
+    transitions = transitions.float()
+    start_transitions = start_transitions.float()
+    if allowed is not None:
+        transitions = transitions.masked_fill(~allowed.to(transitions.device), float("-inf"))
+    if allowed_start is not None:
+        start_transitions = start_transitions.masked_fill(~allowed_start.to(transitions.device), float("-inf"))
+    k = topk
+    #score[b, c, r]：以标签c结尾的第r好路径的分数
+    score = emissions.new_full((batch_size, class_num, k), float("-inf"))
+    score[:, :, 0] = start_transitions + emissions[:, 0]
+    history = []
+    for t in range(1, sen_len):
+        #(batch, 前一标签, 当前标签, 前一标签的第r条路径)
+        candidates = score.unsqueeze(2) + transitions.view(1, class_num, class_num, 1) \
+                     + emissions[:, t].view(batch_size, 1, class_num, 1)
+        candidates = candidates.transpose(1, 2).reshape(batch_size, class_num, class_num * k)
+        best, index = candidates.topk(k, dim=-1)
+        #padding位置不更新分数，句末之后的状态保持不变
+        score = torch.where(mask[:, t].view(batch_size, 1, 1), best, score)
+        history.append(index)
+    score = score + end_transitions.float().view(1, class_num, 1)
+    best_scores, best_index = score.reshape(batch_size, class_num * k).topk(k, dim=-1)
+    current_tag, current_rank = best_index // k, best_index % k
+    seq_ends = mask.long().sum(dim=1) - 1
+    tags = emissions.new_full((batch_size, k, sen_len), -1, dtype=torch.long)
+    for t in range(sen_len - 1, -1, -1):
+        if t < sen_len - 1:
+            #history[t]记录的是第t+1步每条路径来自第t步的哪个 (标签, 路径)
+            previous = history[t].view(batch_size, class_num * k).gather(1, current_tag * k + current_rank)
+            update = (t < seq_ends).unsqueeze(1)
+            current_tag = torch.where(update, previous // k, current_tag)
+            current_rank = torch.where(update, previous % k, current_rank)
+        tags[:, :, t] = torch.where((t <= seq_ends).unsqueeze(1), current_tag, torch.full_like(current_tag, -1))
+    if topk == 1:
+        return tags[:, 0], best_scores[:, 0]
+    return tags, best_scores
+
+
+#使用torchcrf.CRF的转移参数解码
+def crf_decode(crf_layer, emissions, mask, allowed=None, allowed_start=None, topk=1):
+    return viterbi_decode(emissions, mask, crf_layer.transitions, crf_layer.start_transitions,
+                          crf_layer.end_transitions, allowed, allowed_start, topk)
+
+
+if __name__ == "__main__":
+    #与逐句暴力枚举的结果对比
+    import itertools
+    torch.manual_seed(0)
+    schema = {"B-LOCATION": 0, "I-LOCATION": 1, "O": 2}
+    allowed, allowed_start = bio_allowed_transitions(schema)
+    emissions = torch.randn(3, 4, 3)
+    mask = torch.BoolTensor([[1, 1, 1, 1], [1, 1, 0, 0], [1, 0, 0, 0]])
+    transitions, start, end = torch.randn(3, 3), torch.randn(3), torch.randn(3)
+    tags, scores = viterbi_decode(emissions, mask, transitions, start, end, allowed, allowed_start, topk=3)
+    for b in range(3):
+        length = int(mask[b].sum())
+        paths = []
+        for path in itertools.product(range(3), repeat=length):
+            if not allowed_start[path[0]] or any(not allowed[i, j] for i, j in zip(path, path[1:])):
+                continue
+            s = start[path[0]] + emissions[b, 0, path[0]] + end[path[-1]]
+            s += sum(transitions[i, j] + emissions[b, t + 1, j] for t, (i, j) in enumerate(zip(path, path[1:])))
+            paths.append((float(s), list(path)))
+        paths.sort(reverse=True)
+        print([p for _, p in paths[:3]], tags[b, :, :length].tolist())
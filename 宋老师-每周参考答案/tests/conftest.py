@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+"""
+测试公共配置
+把参考答案根目录加入路径，测试中可以直接 from common.xxx import ...
+各周目录下的模块(如week7/token_cache.py)在对应测试文件中按需加入路径
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
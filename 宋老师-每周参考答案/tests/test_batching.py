@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import random
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from common.batching import pad_collate, BucketBatchSampler
+
+
+def test_pad_collate():
+    batch = [[torch.LongTensor([1, 2, 3]), torch.LongTensor([0, 1, 1])],
+             [torch.LongTensor([4, 5]), torch.LongTensor([1, 1])]]
+    x, y = pad_collate((0, -1))(batch)
+    assert x.tolist() == [[1, 2, 3], [4, 5, 0]]
+    assert y.tolist() == [[0, 1, 1], [1, 1, -1]]
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+def test_every_index_once(shuffle):
+    random.seed(0)
+    lengths = [random.randint(1, 50) for _ in range(103)]
+    sampler = BucketBatchSampler(lengths, batch_size=8, shuffle=shuffle, bucket_multiplier=4)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 13
+    assert sorted(index for batch in batches for index in batch) == list(range(len(lengths)))
+    assert all(len(batch) <= 8 for batch in batches)
+
+
+def test_drop_last():
+    lengths = list(range(21))
+    sampler = BucketBatchSampler(lengths, batch_size=4, shuffle=False, drop_last=True, bucket_multiplier=100)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 5
+    assert all(len(batch) == 4 for batch in batches)
+
+
+def test_batches_are_length_sorted_within_pool():
+    random.seed(1)
+    lengths = [random.randint(1, 100) for _ in range(200)]
+    sampler = BucketBatchSampler(lengths, batch_size=10, shuffle=False, bucket_multiplier=5)
+    batches = list(sampler)
+    pool_batches = 5
+    for start in range(0, len(batches), pool_batches):
+        pool = [lengths[index] for batch in batches[start:start + pool_batches] for index in batch]
+        assert pool == sorted(pool)
+
+
+def test_bucketing_reduces_padding():
+    random.seed(2)
+    lengths = [random.randint(1, 100) for _ in range(1000)]
+    padded = lambda batches: sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    random_batches = [list(range(start, start + 10)) for start in range(0, 1000, 10)]
+    bucket_batches = list(BucketBatchSampler(lengths, batch_size=10, bucket_multiplier=50))
+    assert padded(bucket_batches) < padded(random_batches)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from conftest import ROOT
+sys.path.append(os.path.join(ROOT, "week8"))
+from embedding_store import EmbeddingStore, question_key
+
+
+#每个问题的"向量"由其id序列确定，记录每次被编码的问题
+class FakeEncoder:
+    def __init__(self, questions, dim=4):
+        self.questions = questions
+        self.dim = dim
+        self.encoded = []
+
+    def vector(self, question):
+        rng = np.random.RandomState(sum(question))
+        vector = rng.randn(self.dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def __call__(self, positions):
+        self.encoded += [self.questions[position] for position in positions]
+        return np.stack([self.vector(self.questions[position]) for position in positions])
+
+
+def sync(store, questions, standard_indices):
+    encoder = FakeEncoder(questions)
+    vectors, encoded_num = store.sync([question_key(q) for q in questions], standard_indices, encoder)
+    expected = np.stack([encoder.vector(q) for q in questions])
+    assert np.allclose(np.asarray(vectors), expected)
+    assert encoded_num == len(encoder.encoded)
+    return encoder.encoded
+
+
+def test_incremental_sync(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "f" * 40, "vocab", "schema")
+    questions = [[1, 2], [3, 4, 5], [6]]
+    assert sync(store, questions, [0, 0, 1]) == questions
+    #知识库不变时不需要重新编码
+    assert sync(store, questions, [0, 0, 1]) == []
+    #追加问题、调整顺序时只编码新问题
+    questions = [[6], [7, 8], [1, 2], [3, 4, 5]]
+    assert sync(store, questions, [1, 2, 0, 0]) == [[7, 8]]
+    loaded = store.load()
+    assert loaded["standard_indices"].tolist() == [1, 2, 0, 0]
+    assert loaded["keys"] == [question_key(q) for q in questions]
+
+
+def test_version_mismatch_reencodes(tmp_path):
+    questions = [[1, 2], [3]]
+    sync(EmbeddingStore(str(tmp_path), "f" * 40, "vocab", "schema"), questions, [0, 1])
+    assert EmbeddingStore(str(tmp_path), "f" * 40, "vocab2", "schema").load() is None
+    assert sync(EmbeddingStore(str(tmp_path), "f" * 40, "vocab", "schema2"), questions, [0, 1]) == questions
+    #模型指纹不同时使用不同的目录
+    assert EmbeddingStore(str(tmp_path), "e" * 40, "vocab", "schema").load() is None
+
+
+def test_missing_meta_invalidates(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "f" * 40, "vocab", "schema")
+    sync(store, [[1], [2]], [0, 0])
+    os.remove(store.path("meta.json"))
+    assert store.load() is None
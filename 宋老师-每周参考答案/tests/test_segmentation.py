@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+
+jieba = pytest.importorskip("jieba")
+
+from common.segmentation import Segmenter, text_key
+
+TEXTS = ["话费是否包月超了", "固定宽带服务密码修改", "话费是否包月超了"]
+
+
+def test_cut_matches_jieba(tmp_path):
+    segmenter = Segmenter(str(tmp_path / "cache.jsonl"), lru_size=2)
+    for text in TEXTS:
+        assert segmenter.cut(text) == jieba.lcut(text)
+
+
+def test_lru_is_bounded(tmp_path):
+    segmenter = Segmenter(str(tmp_path / "cache.jsonl"), lru_size=2)
+    for text in ["你好", "今天天气不错", "我想查话费", "你好"]:
+        segmenter.cut(text)
+    assert len(segmenter.lru) == 2
+    assert list(segmenter.lru) == [text_key("我想查话费"), text_key("你好")]
+
+
+def test_segment_all_persists_and_reloads(tmp_path):
+    cache_path = str(tmp_path / "cache.jsonl")
+    segmenter = Segmenter(cache_path)
+    segmenter.segment_all(TEXTS, num_workers=1)
+    #重复文本只分词、写入一次
+    with open(cache_path, encoding="utf8") as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 2
+    segmenter.segment_all(TEXTS, num_workers=1)
+    with open(cache_path, encoding="utf8") as f:
+        assert len(f.readlines()) == 2
+    reloaded = Segmenter(cache_path)
+    assert reloaded.persistent == segmenter.persistent
+    assert reloaded.cut(TEXTS[1]) == jieba.lcut(TEXTS[1])
+
+
+def test_truncated_cache_line_is_skipped(tmp_path):
+    cache_path = tmp_path / "cache.jsonl"
+    cache_path.write_text(json.dumps([text_key("你好"), ["你好"]], ensure_ascii=False) + "\n[\"abc", encoding="utf8")
+    segmenter = Segmenter(str(cache_path))
+    assert segmenter.persistent == {text_key("你好"): ["你好"]}
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import re
+import random
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from common.spans import SpanExtractor, span_counts
+
+SCHEMA = {"B-LOCATION": 0, "B-ORGANIZATION": 1, "B-PERSON": 2, "B-TIME": 3, "I-LOCATION": 4,
+          "I-ORGANIZATION": 5, "I-PERSON": 6, "I-TIME": 7, "O": 8}
+
+
+#week9 evaluate中原来的正则解码
+def regex_decode(sentence, labels):
+    labels = "".join([str(x) for x in labels[:len(sentence)]])
+    results = dict((entity, []) for entity in ["LOCATION", "ORGANIZATION", "PERSON", "TIME"])
+    for pattern, entity in [("(04+)", "LOCATION"), ("(15+)", "ORGANIZATION"), ("(26+)", "PERSON"), ("(37+)", "TIME")]:
+        for location in re.finditer(pattern, labels):
+            s, e = location.span()
+            results[entity].append(sentence[s:e])
+    return results
+
+
+def random_case(rng, length):
+    sentence = "".join(chr(0x4e00 + rng.randint(0, 100)) for _ in range(length))
+    #多放一些O和I，让片段长短不一
+    labels = [rng.choice([0, 1, 2, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 8]) for _ in range(length)]
+    return sentence, labels
+
+
+def test_types_follow_schema():
+    assert SpanExtractor(SCHEMA).types == ["LOCATION", "ORGANIZATION", "PERSON", "TIME"]
+
+
+def test_decode_matches_regex():
+    rng = random.Random(0)
+    extractor = SpanExtractor(SCHEMA)
+    for _ in range(500):
+        sentence, labels = random_case(rng, rng.randint(1, 30))
+        #标签可能比句子长(padding)，只看句子范围内
+        padded = labels + [8] * rng.randint(0, 5)
+        assert extractor.decode(sentence, padded, min_length=2) == regex_decode(sentence, padded)
+
+
+def test_decode_with_cls_offset():
+    rng = random.Random(1)
+    extractor = SpanExtractor(SCHEMA)
+    for _ in range(200):
+        sentence, labels = random_case(rng, rng.randint(1, 30))
+        #week13的标签第0位是[CLS]，原先在句首补"$"后再按正则解码
+        expected = regex_decode("$" + sentence, [8] + labels)
+        assert extractor.decode(sentence, [8] + labels, offset=1, min_length=2) == expected
+
+
+def test_batch_extract_with_padding():
+    rng = random.Random(2)
+    extractor = SpanExtractor(SCHEMA)
+    cases = [random_case(rng, rng.randint(1, 20)) for _ in range(50)]
+    max_len = max(len(labels) for _, labels in cases)
+    batch = torch.LongTensor([labels + [-1] * (max_len - len(labels)) for _, labels in cases])
+    spans = extractor.extract(batch, min_length=1).tolist()
+    for row, (sentence, labels) in enumerate(cases):
+        single = [[row] + span[1:] for span in extractor.extract(labels, min_length=1).tolist()]
+        assert [span for span in spans if span[0] == row] == single
+
+
+def test_single_char_entities():
+    extractor = SpanExtractor(SCHEMA)
+    spans = extractor.extract([0, 8, 2, 6, 4, 3]).tolist()
+    #I-LOCATION跟在I-PERSON后不属于同一实体，也不能单独成为实体
+    assert spans == [[0, 0, 1, 0], [0, 2, 4, 2], [0, 5, 6, 3]]
+    assert extractor.extract([0, 8, 2, 6, 4, 3], min_length=2).tolist() == [[0, 2, 4, 2]]
+
+
+def test_span_counts_matches_set_intersection():
+    rng = random.Random(3)
+    extractor = SpanExtractor(SCHEMA)
+    cases = [random_case(rng, 20)[1] for _ in range(30)]
+    true_spans = extractor.extract(torch.LongTensor(cases))
+    pred_spans = extractor.extract(torch.LongTensor([[label if rng.random() < 0.8 else 8 for label in labels]
+                                                     for labels in cases]))
+    correct, true_num, pred_num = span_counts(true_spans, pred_spans, 4)
+    common = set(map(tuple, true_spans.tolist())) & set(map(tuple, pred_spans.tolist()))
+    assert correct.tolist() == [sum(span[3] == t for span in common) for t in range(4)]
+    assert true_num.tolist() == [sum(span[3] == t for span in true_spans.tolist()) for t in range(4)]
+    assert pred_num.tolist() == [sum(span[3] == t for span in pred_spans.tolist()) for t in range(4)]
+
+
+def test_span_counts_empty():
+    empty = torch.zeros(0, 4, dtype=torch.long)
+    correct, true_num, pred_num = span_counts(empty, empty, 4)
+    assert correct.tolist() == true_num.tolist() == pred_num.tolist() == [0, 0, 0, 0]
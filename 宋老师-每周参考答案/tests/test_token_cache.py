@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from conftest import ROOT
+sys.path.append(os.path.join(ROOT, "week7"))
+from token_cache import TokenCache, CachedSentences, cache_key
+
+SAMPLES = [("质量很好", [101, 6574, 7030, 102], 1),
+           ("", [101, 102], 0),
+           ("送货太慢了，差评", [101, 6843, 6573, 1922, 2714, 749, 102], 0)]
+
+
+def build(tmp_path, samples=SAMPLES, key="k"):
+    cache = TokenCache(str(tmp_path / "cache"), key)
+    assert not cache.exists()
+    cache.build(iter(samples))
+    assert cache.exists()
+    return TokenCache(str(tmp_path / "cache"), key).load()
+
+
+def test_round_trip(tmp_path):
+    cache = build(tmp_path)
+    assert len(cache) == len(SAMPLES)
+    for index, (sentence, input_id, label) in enumerate(SAMPLES):
+        ids, cached_label = cache.get(index)
+        assert ids.tolist() == input_id and ids.dtype == np.int64
+        assert cached_label == label
+        assert cache.sentences[index] == sentence
+    #ids和句子都以mmap方式打开，不整体读入内存
+    assert isinstance(cache.ids, np.memmap)
+    assert isinstance(cache.sentences, CachedSentences)
+    assert cache.sentences[1:3] == [sentence for sentence, _, _ in SAMPLES[1:3]]
+
+
+def test_empty_corpus(tmp_path):
+    cache = build(tmp_path, samples=[])
+    assert len(cache) == 0
+    assert cache.sentences[:] == []
+
+
+def test_incomplete_build_is_not_reused(tmp_path):
+    cache = build(tmp_path)
+    os.remove(cache.prefix + ".done")
+    assert not TokenCache(str(tmp_path / "cache"), "k").exists()
+
+
+def test_key_changes_with_content_and_settings(tmp_path):
+    data_path = tmp_path / "data.txt"
+    data_path.write_text("1,质量很好\n", encoding="utf8")
+    key = cache_key(str(data_path), "vocab:a", 30)
+    assert key == cache_key(str(data_path), "vocab:a", 30)
+    assert key != cache_key(str(data_path), "vocab:b", 30)
+    assert key != cache_key(str(data_path), "vocab:a", 20)
+    data_path.write_text("1,质量很好\n0,太慢\n", encoding="utf8")
+    assert key != cache_key(str(data_path), "vocab:a", 30)
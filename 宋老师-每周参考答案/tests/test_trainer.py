@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from common.trainer import Trainer
+
+logger = logging.getLogger(__name__)
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self):
+        super(TinyModel, self).__init__()
+        self.layer = torch.nn.Linear(3, 1)
+
+    def forward(self, x, y):
+        return torch.nn.functional.mse_loss(self.layer(x), y)
+
+
+#每轮返回模型参数之和，用来比较两次训练的结果；crash_epoch模拟在该轮评估时崩溃
+class SumEvaluator:
+    def __init__(self, model, crash_epoch=None):
+        self.model = model
+        self.crash_epoch = crash_epoch
+
+    def eval(self, epoch):
+        if epoch == self.crash_epoch:
+            raise RuntimeError("crash")
+        return float(sum(p.sum() for p in self.model.parameters()))
+
+
+def make_data(num=20, batch_size=2):
+    generator = torch.Generator().manual_seed(0)
+    x, y = torch.randn(num, 3, generator=generator), torch.randn(num, 1, generator=generator)
+    return torch.utils.data.DataLoader(list(zip(x, y)), batch_size=batch_size, shuffle=True)
+
+
+def run(config, crash_epoch=None):
+    torch.manual_seed(0)
+    model = TinyModel()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    trainer = Trainer(config, model, optimizer, SumEvaluator(model, crash_epoch), logger)
+    return trainer, trainer.train(make_data())
+
+
+def config(path, **kwargs):
+    os.makedirs(str(path), exist_ok=True)
+    return dict({"model_path": str(path), "epoch": 2, "grad_accum_steps": 4}, **kwargs)
+
+
+def test_no_checkpoint_by_default(tmp_path):
+    _, result = run(config(tmp_path))
+    assert result is not None
+    assert not os.path.exists(os.path.join(str(tmp_path), "checkpoint.pt"))
+
+
+def test_resume_after_last_epoch_returns_result(tmp_path):
+    _, result = run(config(tmp_path, checkpoint_every_epoch=True))
+    assert os.path.isfile(os.path.join(str(tmp_path), "checkpoint.pt"))
+    _, resumed = run(config(tmp_path, resume=True))
+    assert resumed == result
+
+
+def test_resume_from_partial_step_is_exact(tmp_path):
+    #10个batch、累积4步：每轮的更新步为1、2、3，第3步只累积了2个batch
+    _, expected = run(config(tmp_path / "full"))
+    with pytest.raises(RuntimeError):
+        run(config(tmp_path / "part", checkpoint_steps=3), crash_epoch=1)
+    state = torch.load(os.path.join(str(tmp_path / "part"), "checkpoint.pt"), weights_only=False)
+    assert (state["epoch"], state["step"]) == (1, 3)
+    _, resumed = run(config(tmp_path / "part", checkpoint_steps=3, resume=True))
+    assert resumed == pytest.approx(expected, abs=1e-6)
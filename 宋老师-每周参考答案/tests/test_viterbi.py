@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from common.viterbi import bio_allowed_transitions, viterbi_decode, crf_decode
+
+SCHEMA = {"B-LOCATION": 0, "I-LOCATION": 1, "B-PERSON": 2, "I-PERSON": 3, "O": 4}
+
+
+#逐句枚举所有路径，返回按分数从高到低排列的 (分数, 路径)
+def brute_force(emissions, length, transitions, start, end, allowed=None, allowed_start=None):
+    paths = []
+    for path in itertools.product(range(emissions.shape[-1]), repeat=length):
+        if allowed_start is not None and not allowed_start[path[0]]:
+            continue
+        if allowed is not None and any(not allowed[i, j] for i, j in zip(path, path[1:])):
+            continue
+        score = start[path[0]] + emissions[0, path[0]] + end[path[-1]]
+        score += sum(transitions[i, j] + emissions[t + 1, j] for t, (i, j) in enumerate(zip(path, path[1:])))
+        paths.append((float(score), list(path)))
+    paths.sort(key=lambda x: -x[0])
+    return paths
+
+
+def random_inputs(seed, batch_size=4, sen_len=5, class_num=5):
+    torch.manual_seed(seed)
+    emissions = torch.randn(batch_size, sen_len, class_num)
+    lengths = torch.randint(1, sen_len + 1, (batch_size,))
+    lengths[0] = sen_len
+    mask = torch.arange(sen_len).unsqueeze(0) < lengths.unsqueeze(1)
+    return emissions, mask, lengths, torch.randn(class_num, class_num), torch.randn(class_num), torch.randn(class_num)
+
+
+def test_bio_allowed_transitions():
+    allowed, allowed_start = bio_allowed_transitions(SCHEMA)
+    assert allowed_start.tolist() == [True, False, True, False, True]
+    #I-LOCATION只能跟在B-LOCATION或I-LOCATION之后
+    assert allowed[:, 1].tolist() == [True, True, False, False, False]
+    assert allowed[:, 3].tolist() == [False, False, True, True, False]
+    assert allowed[:, [0, 2, 4]].all()
+
+
+@pytest.mark.parametrize("constrained", [False, True])
+def test_best_path_matches_brute_force(constrained):
+    allowed, allowed_start = bio_allowed_transitions(SCHEMA) if constrained else (None, None)
+    for seed in range(5):
+        emissions, mask, lengths, transitions, start, end = random_inputs(seed)
+        tags, scores = viterbi_decode(emissions, mask, transitions, start, end, allowed, allowed_start)
+        for b in range(len(lengths)):
+            length = int(lengths[b])
+            best_score, best_path = brute_force(emissions[b], length, transitions, start, end, allowed, allowed_start)[0]
+            assert tags[b, :length].tolist() == best_path
+            assert tags[b, length:].eq(-1).all()
+            assert abs(float(scores[b]) - best_score) < 1e-4
+
+
+def test_topk_matches_brute_force():
+    allowed, allowed_start = bio_allowed_transitions(SCHEMA)
+    emissions, mask, lengths, transitions, start, end = random_inputs(7)
+    tags, scores = viterbi_decode(emissions, mask, transitions, start, end, allowed, allowed_start, topk=3)
+    assert tags.shape == (len(lengths), 3, emissions.shape[1])
+    for b in range(len(lengths)):
+        length = int(lengths[b])
+        expected = brute_force(emissions[b], length, transitions, start, end, allowed, allowed_start)[:3]
+        for rank, (score, path) in enumerate(expected):
+            assert abs(float(scores[b, rank]) - score) < 1e-4
+            assert tags[b, rank, :length].tolist() == path
+        #合法路径不足k条时多出的路径分数为-inf
+        for rank in range(len(expected), 3):
+            assert scores[b, rank] == float("-inf")
+
+
+def test_matches_torchcrf_decode():
+    torchcrf = pytest.importorskip("torchcrf")
+    emissions, mask, lengths, _, _, _ = random_inputs(11, batch_size=8, sen_len=12)
+    crf = torchcrf.CRF(emissions.shape[-1], batch_first=True)
+    expected = crf.decode(emissions, mask)
+    tags, _ = crf_decode(crf, emissions, mask)
+    for b, path in enumerate(expected):
+        assert tags[b, :len(path)].tolist() == path
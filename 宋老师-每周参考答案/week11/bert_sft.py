@@ -8,9 +8,13 @@ import math
 import random
 import os
 import re
+import sys
 from transformers import BertTokenizer, BertModel
 from torch.utils.data import Dataset, DataLoader
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.tokenization import bulk_encode
+
 """
 基于Bert结构，进行sft形式的训练
 """
@@ -56,9 +60,11 @@ def load_corpus(path):
 #label中使用-1，表示不参与训练
 def build_dataset(tokenizer, corpus, max_length, batch_size):
     dataset = []
-    for i, (prompt, answer) in enumerate(corpus):
-        prompt_encode = tokenizer.encode(prompt, add_special_tokens=False)
-        answer_encode = tokenizer.encode(answer, add_special_tokens=False)
+    #prompt和answer拼在一起一次批量编码，直接使用已加载的tokenizer，结果与逐条调用tokenizer.encode相同
+    encoded = bulk_encode(tokenizer, [prompt for prompt, _ in corpus] + [answer for _, answer in corpus],
+                          add_special_tokens=False)
+    prompts, answers = encoded[:len(corpus)], encoded[len(corpus):]
+    for prompt_encode, answer_encode in zip(prompts, answers):
         x = [tokenizer.cls_token_id] + prompt_encode + [tokenizer.sep_token_id] + answer_encode + [tokenizer.sep_token_id]
         y = len(prompt_encode) * [-1] + [-1] + answer_encode + [tokenizer.sep_token_id] + [-1]
         #构建一个的mask矩阵，让prompt内可以交互，answer中上下文之间没有交互
@@ -17,7 +17,14 @@ Config = {
     "batch_size": 16,
     "optimizer": "adam",
     "learning_rate": 1e-3,
+    "grad_accum_steps": 1,  #梯度累积步数，等效batch_size = batch_size * grad_accum_steps
+    "autocast": None,  #设为"bf16"开启bfloat16 autocast
+    "num_threads": None,  #torch使用的cpu线程数，None为默认
+    "checkpoint_steps": None,  #每隔多少个更新步保存断点，None时不在轮内保存
+    "checkpoint_every_epoch": False,  #每轮结束是否保存断点，checkpoint_steps或resume开启时也会保存
+    "resume": False,  #是否从model_path下的checkpoint.pt续跑
     "use_crf": False,
+    "dynamic_padding": True,  #组batch时只补齐到batch内最长样本，并按长度分桶
     "class_num": 9,
     "bert_path": r"E:\pretrain_models\bert-base-chinese"
 }
\ No newline at end of file
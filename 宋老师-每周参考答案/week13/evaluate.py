@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
+import sys
 import torch
-import re
 import numpy as np
 from collections import defaultdict
 from loader import load_data
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.spans import SpanExtractor, span_counts
 
 """
 模型效果测试
@@ -15,14 +18,14 @@ class Evaluator:
         self.model = model
         self.logger = logger
         self.valid_data = load_data(config["valid_data_path"], config, shuffle=False)
+        #实体类型由schema中的B-X / I-X标签决定
+        self.span_extractor = SpanExtractor(self.valid_data.dataset.schema)
+        self.entity_types = self.span_extractor.types
 
 
     def eval(self, epoch):
         self.logger.info("开始测试第%d轮模型效果：" % epoch)
-        self.stats_dict = {"LOCATION": defaultdict(int),
-                           "TIME": defaultdict(int),
-                           "PERSON": defaultdict(int),
-                           "ORGANIZATION": defaultdict(int)}
+        self.stats_dict = dict((key, defaultdict(int)) for key in self.entity_types)
         self.model.eval()
         for index, batch_data in enumerate(self.valid_data):
             sentences = self.valid_data.dataset.sentences[index * self.config["batch_size"]: (index+1) * self.config["batch_size"]]
@@ -32,31 +35,29 @@ class Evaluator:
             with torch.no_grad():
                 pred_results = self.model(input_id) #不输入labels，使用模型当前参数进行预测
             self.write_stats(labels, pred_results, sentences)
-        self.show_stats()
-        return
+        return self.show_stats()
 
     def write_stats(self, labels, pred_results, sentences):
         assert len(labels) == len(pred_results) == len(sentences)
         if not self.config["use_crf"]:
             pred_results = torch.argmax(pred_results, dim=-1)
-        for true_label, pred_label, sentence in zip(labels, pred_results, sentences):
-            if not self.config["use_crf"]:
-                pred_label = pred_label.cpu().detach().tolist()
-            true_label = true_label.cpu().detach().tolist()
-            true_entities = self.decode(sentence, true_label)
-            pred_entities = self.decode(sentence, pred_label)
-
-            # 正确率 = 识别出的正确实体数 / 识别出的实体数
-            # 召回率 = 识别出的正确实体数 / 样本的实体数
-            for key in ["PERSON", "LOCATION", "TIME", "ORGANIZATION"]:
-                self.stats_dict[key]["正确识别"] += len([ent for ent in pred_entities[key] if ent in true_entities[key]])
-                self.stats_dict[key]["样本实体数"] += len(true_entities[key])
-                self.stats_dict[key]["识别出实体数"] += len(pred_entities[key])
+        #整个batch一次抽取出所有实体片段，只看句子长度范围内的标签
+        #min_length=2与原先正则 "B(I+)" 的统计口径一致，单字实体不计入
+        lengths = [len(sentence) + 1 for sentence in sentences]
+        true_spans = self.span_extractor.extract(labels, lengths, min_length=2)
+        pred_spans = self.span_extractor.extract(pred_results, lengths, min_length=2)
+        # 正确率 = 识别出的正确实体数 / 识别出的实体数
+        # 召回率 = 识别出的正确实体数 / 样本的实体数
+        correct, true_num, pred_num = span_counts(true_spans, pred_spans, len(self.entity_types))
+        for index, key in enumerate(self.entity_types):
+            self.stats_dict[key]["正确识别"] += int(correct[index])
+            self.stats_dict[key]["样本实体数"] += int(true_num[index])
+            self.stats_dict[key]["识别出实体数"] += int(pred_num[index])
         return
 
     def show_stats(self):
         F1_scores = []
-        for key in ["PERSON", "LOCATION", "TIME", "ORGANIZATION"]:
+        for key in self.entity_types:
             # 正确率 = 识别出的正确实体数 / 识别出的实体数
             # 召回率 = 识别出的正确实体数 / 样本的实体数
             precision = self.stats_dict[key]["正确识别"] / (1e-5 + self.stats_dict[key]["识别出实体数"])
@@ -65,45 +66,16 @@ class Evaluator:
             F1_scores.append(F1)
             self.logger.info("%s类实体，准确率：%f, 召回率: %f, F1: %f" % (key, precision, recall, F1))
         self.logger.info("Macro-F1: %f" % np.mean(F1_scores))
-        correct_pred = sum([self.stats_dict[key]["正确识别"] for key in ["PERSON", "LOCATION", "TIME", "ORGANIZATION"]])
-        total_pred = sum([self.stats_dict[key]["识别出实体数"] for key in ["PERSON", "LOCATION", "TIME", "ORGANIZATION"]])
-        true_enti = sum([self.stats_dict[key]["样本实体数"] for key in ["PERSON", "LOCATION", "TIME", "ORGANIZATION"]])
+        correct_pred = sum([self.stats_dict[key]["正确识别"] for key in self.entity_types])
+        total_pred = sum([self.stats_dict[key]["识别出实体数"] for key in self.entity_types])
+        true_enti = sum([self.stats_dict[key]["样本实体数"] for key in self.entity_types])
         micro_precision = correct_pred / (total_pred + 1e-5)
         micro_recall = correct_pred / (true_enti + 1e-5)
         micro_f1 = (2 * micro_precision * micro_recall) / (micro_precision + micro_recall + 1e-5)
         self.logger.info("Micro-F1 %f" % micro_f1)
         self.logger.info("--------------------")
-        return
+        return {"macro_f1": float(np.mean(F1_scores)), "micro_f1": micro_f1}
 
-    '''
-    {
-      "B-LOCATION": 0,
-      "B-ORGANIZATION": 1,
-      "B-PERSON": 2,
-      "B-TIME": 3,
-      "I-LOCATION": 4,
-      "I-ORGANIZATION": 5,
-      "I-PERSON": 6,
-      "I-TIME": 7,
-      "O": 8
-    }
-    '''
+    #标签第0位是[CLS]时offset=1
     def decode(self, sentence, labels):
-        sentence = "$" + sentence
-        labels = "".join([str(x) for x in labels[:len(sentence)+1]])
-        results = defaultdict(list)
-        for location in re.finditer("(04+)", labels):
-            s, e = location.span()
-            results["LOCATION"].append(sentence[s:e])
-        for location in re.finditer("(15+)", labels):
-            s, e = location.span()
-            results["ORGANIZATION"].append(sentence[s:e])
-        for location in re.finditer("(26+)", labels):
-            s, e = location.span()
-            results["PERSON"].append(sentence[s:e])
-        for location in re.finditer("(37+)", labels):
-            s, e = location.span()
-            results["TIME"].append(sentence[s:e])
-        return results
-
-
+        return self.span_extractor.decode(sentence, labels, offset=1, min_length=2)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import copy
+import argparse
+import logging
+import torch
+from config import Config
+from model import TorchModel
+from evaluate import Evaluator
+from main import peft_wrapper
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.quantize import measure_latency, state_dict_size_mb
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""
+导出合并lora后的模型
+训练保存的是peft模型的state_dict，预测时每次都要重新包装peft模型，前向中lora分支还要额外做两次矩阵乘
+这里把 W + B·A·alpha/r 直接合并进bert的query/value权重，保存普通TorchModel的state_dict，
+加载时 TorchModel(config).load_state_dict(torch.load(path)) 即可，不再依赖peft
+同时在验证集上检查合并前后输出是否一致，并对比延迟
+"""
+
+
+def load_peft_model(config, model_path):
+    model = peft_wrapper(TorchModel(config))
+    state_dict = model.state_dict()
+    state_dict.update(torch.load(model_path, map_location="cpu"))
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+
+#逐batch对比两个模型的输出，logits看最大误差和argmax一致率，使用crf时直接对比解码路径
+def check_equivalence(peft_model, merged_model, valid_data, atol=1e-4):
+    max_diff, same, total = 0.0, 0, 0
+    with torch.no_grad():
+        for input_id, _ in valid_data:
+            expected, actual = peft_model(input_id), merged_model(input_id)
+            if expected.is_floating_point():
+                max_diff = max(max_diff, float((expected - actual).abs().max()))
+                expected, actual = expected.argmax(dim=-1), actual.argmax(dim=-1)
+            mask = input_id.gt(0)
+            same += int((expected == actual)[mask].sum())
+            total += int(mask.sum())
+    logger.info("合并前后logits最大误差：%e，逐字预测一致率：%f" % (max_diff, same / max(total, 1)))
+    return max_diff <= atol and same == total
+
+
+def export(config, model_path, output_path):
+    evaluator = Evaluator(config, None, logger)
+    peft_model = load_peft_model(config, model_path)
+    #merge_and_unload会改写原模型的权重，在副本上合并，保留原模型做对比
+    merged_model = copy.deepcopy(peft_model).merge_and_unload()
+    merged_model.eval()
+    assert isinstance(merged_model, TorchModel)
+    equivalent = check_equivalence(peft_model, merged_model, evaluator.valid_data)
+    sample_input = next(iter(evaluator.valid_data))[0]
+    logger.info("%-10s %12s %12s %12s" % ("", "peft", "merged", "speedup"))
+    peft_latency, merged_latency = measure_latency(peft_model, sample_input), measure_latency(merged_model, sample_input)
+    for name, peft_value, merged_value in zip(["p50_ms", "p99_ms"], peft_latency, merged_latency):
+        logger.info("%-10s %12.2f %12.2f %11.2fx" % (name, peft_value, merged_value, peft_value / max(merged_value, 1e-9)))
+    if not equivalent:
+        logger.warning("合并前后输出不一致，请检查lora配置与checkpoint是否匹配")
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    torch.save(merged_model.state_dict(), output_path)
+    logger.info("合并后的模型已保存至%s，大小%.1fMB" % (output_path, state_dict_size_mb(merged_model)))
+    return equivalent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True)
+    parser.add_argument("--output_path", default="output/model_merged.pth")
+    args = parser.parse_args()
+    export(Config, args.model_path, args.output_path)
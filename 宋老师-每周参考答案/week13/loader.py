@@ -3,6 +3,7 @@
 import json
 import re
 import os
+import sys
 import torch
 import random
 import jieba
@@ -10,6 +11,10 @@ import numpy as np
 from torch.utils.data import Dataset, DataLoader
 from collections import defaultdict
 from transformers import BertTokenizer
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.batching import pad_collate, BucketBatchSampler
+from common.tokenization import bulk_convert_tokens
+from common.spans import SpanExtractor
 """
 数据加载
 """
@@ -22,10 +27,12 @@ class DataGenerator:
         self.tokenizer = load_vocab(config["bert_path"])
         self.sentences = []
         self.schema = self.load_schema(config["schema_path"])
+        self.span_extractor = SpanExtractor(self.schema)
         self.load()
 
     def load(self):
         self.data = []
+        chars_list, labels_list = [], []
         with open(self.path, encoding="utf8") as f:
             segments = f.read().split("\n\n")
             for segment in segments:
@@ -39,48 +46,46 @@ class DataGenerator:
                     labels.append(self.schema[label])
                 sentence = "".join(sentenece)
                 self.sentences.append(sentence)
-                input_ids = self.encode_sentence(sentenece)
-                labels = self.padding(labels, -1)
-                # print(self.decode(sentence, labels))
-                # input()
-                self.data.append([torch.LongTensor(input_ids), torch.LongTensor(labels)])
+                chars_list.append(sentenece)
+                labels_list.append(labels)
+        #所有句子读完后批量转换成id，结果与逐句调用encode_sentence相同
+        input_ids_list = bulk_convert_tokens(self.tokenizer, chars_list, self.config["max_length"],
+                                             padding=not self.config.get("dynamic_padding"))
+        for input_ids, labels in zip(input_ids_list, labels_list):
+            labels = self.padding(labels, -1)
+            if self.config.get("dynamic_padding"):
+                #输入末尾还有[SEP]，标签用-1补到与输入等长
+                labels += [-1] * (len(input_ids) - len(labels))
+            # print(self.decode(sentence, labels))
+            # input()
+            self.data.append([torch.LongTensor(input_ids), torch.LongTensor(labels)])
         return
 
     def encode_sentence(self, text, padding=True):
+        if self.config.get("dynamic_padding"):
+            padding = False
         return self.tokenizer.encode(text, 
-                                     padding="max_length",
+                                     padding="max_length" if padding else False,
                                      max_length=self.config["max_length"],
                                      truncation=True)
 
+    #标签第0位是[CLS]
     def decode(self, sentence, labels):
-        sentence = "$" + sentence
-        labels = "".join([str(x) for x in labels[:len(sentence)+2]])
-        results = defaultdict(list)
-        for location in re.finditer("(04+)", labels):
-            s, e = location.span()
-            print("location", s,e)
-            results["LOCATION"].append(sentence[s:e])
-        for location in re.finditer("(15+)", labels):
-            s, e = location.span()
-            print("org", s,e)
-            results["ORGANIZATION"].append(sentence[s:e])
-        for location in re.finditer("(26+)", labels):
-            s, e = location.span()
-            print("per", s,e)
-            results["PERSON"].append(sentence[s:e])
-        for location in re.finditer("(37+)", labels):
-            s, e = location.span()
-            print("time", s,e)
-            results["TIME"].append(sentence[s:e])
-        return results
+        return self.span_extractor.decode(sentence, labels, offset=1, min_length=2)
     
 
     #补齐或截断输入的序列，使其可以在一个batch内运算
     def padding(self, input_id, pad_token=0):
         input_id = input_id[:self.config["max_length"]]
+        #动态padding时只截断，补齐留到组batch时进行
+        if self.config.get("dynamic_padding"):
+            return input_id
         input_id += [pad_token] * (self.config["max_length"] - len(input_id))
         return input_id
 
+    def pad_token_id(self):
+        return self.tokenizer.vocab["[PAD]"]
+
     def __len__(self):
         return len(self.data)
 
@@ -98,8 +103,17 @@ def load_vocab(vocab_path):
 #用torch自带的DataLoader类封装数据
 def load_data(data_path, config, shuffle=True):
     dg = DataGenerator(data_path, config)
-    dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle)
-    return dl
+    if not config.get("dynamic_padding"):
+        dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle)
+        return dl
+    #输入用pad位补齐，标签用-1补齐，-1不参与loss计算
+    collate_fn = pad_collate((dg.pad_token_id(), -1))
+    if shuffle:
+        lengths = [len(input_ids) for input_ids, _ in dg.data]
+        batch_sampler = BucketBatchSampler(lengths, config["batch_size"])
+        return DataLoader(dg, batch_sampler=batch_sampler, collate_fn=collate_fn)
+    #不打乱时保持原顺序，evaluator依赖顺序对齐sentences
+    return DataLoader(dg, batch_size=config["batch_size"], shuffle=False, collate_fn=collate_fn)
 
 
 
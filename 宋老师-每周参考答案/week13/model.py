@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import os
+import sys
+import json
 import torch
 import torch.nn as nn
 from torch.optim import Adam, SGD
 from torchcrf import CRF
 from transformers import BertModel
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.viterbi import bio_allowed_transitions, crf_decode
 """
 建立网络模型结构
 """
@@ -28,13 +33,21 @@ class TorchModel(nn.Module):
         self.classify = nn.Linear(self.bert.config.hidden_size, class_num)
         self.crf_layer = CRF(class_num, batch_first=True)
         self.use_crf = config["use_crf"]
+        #解码时的BIO约束，不作为模型参数保存
+        self.allowed_transitions, self.allowed_start = None, None
+        if self.use_crf and config.get("schema_path") and os.path.isfile(config["schema_path"]):
+            with open(config["schema_path"], encoding="utf8") as f:
+                self.allowed_transitions, self.allowed_start = bio_allowed_transitions(json.load(f))
         self.loss = torch.nn.CrossEntropyLoss(ignore_index=-1)  #loss采用交叉熵损失
 
     #当输入真实标签，返回loss值；无真实标签，返回预测值
-    def forward(self, x, target=None):
+    #mask为attention mask，不传入时按0为padding位置自动生成
+    def forward(self, x, target=None, mask=None):
+        if mask is None:
+            mask = x.gt(0)
         # x = self.embedding(x)  #input shape:(batch_size, sen_len)
         # x, _ = self.layer(x)      #input shape:(batch_size, sen_len, input_dim)
-        x, _ = self.bert(x)
+        x, _ = self.bert(x, attention_mask=mask)
         predict = self.classify(x) #ouput:(batch_size, sen_len, num_tags) -> (batch_size * sen_len, num_tags)
 
         if target is not None:
@@ -46,10 +59,14 @@ class TorchModel(nn.Module):
                 return self.loss(predict.view(-1, predict.shape[-1]), target.view(-1))
         else:
             if self.use_crf:
-                return self.crf_layer.decode(predict)
+                return self.crf_decode(predict, mask)[0]
             else:
                 return predict
 
+    #整个batch在tensor上做viterbi解码，padding位置为-1；topk>1时返回前k条路径
+    def crf_decode(self, predict, mask, topk=1):
+        return crf_decode(self.crf_layer, predict, mask, self.allowed_transitions, self.allowed_start, topk)
+
 
 def choose_optimizer(config, model):
     optimizer = config["optimizer"]
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import json
+import argparse
+import threading
+from collections import OrderedDict
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pad_sequence
+from transformers import BertModel, BertTokenizer
+from config import Config
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.spans import SpanExtractor
+from common.tokenization import bulk_convert_tokens
+
+"""
+多lora共用一个bert的ner服务
+每个客户单独训练一份lora(main.py中的peft_wrapper，r=8，作用于query/value)和classify层，
+这里bert只加载一次，所有已加载的lora与classify按槽位堆叠存放；
+一个batch中的句子可以属于不同的客户，前向时每一行按自己的槽位取lora和classify参数
+槽位数固定，超出时按LRU淘汰最久未使用的adapter，adapter可以在运行时加载和卸载
+输出为argmax解码结果，不使用crf
+"""
+
+
+#一次前向中每一行使用的槽位，由所有MultiLoraLinear共享
+class AdapterContext:
+    def __init__(self):
+        self.rows = None
+
+
+#替换bert中的query/value：基础权重共享，lora按槽位堆叠，forward时按context.rows逐行选择
+class MultiLoraLinear(nn.Module):
+    def __init__(self, base_layer, context, capacity, r):
+        super(MultiLoraLinear, self).__init__()
+        self.base_layer = base_layer
+        self.context = context
+        self.lora_A = nn.Parameter(torch.zeros(capacity, r, base_layer.in_features), requires_grad=False)
+        self.lora_B = nn.Parameter(torch.zeros(capacity, base_layer.out_features, r), requires_grad=False)
+        self.scaling = nn.Parameter(torch.zeros(capacity), requires_grad=False)
+
+    def forward(self, x):
+        output = self.base_layer(x)
+        rows = self.context.rows
+        #x: (batch_size, sen_len, in_features)
+        hidden = torch.einsum("bsi,bri->bsr", x, self.lora_A[rows])
+        delta = torch.einsum("bsr,bor->bso", hidden, self.lora_B[rows])
+        return output + delta * self.scaling[rows].view(-1, 1, 1)
+
+
+class AdapterServer:
+    def __init__(self, config, capacity=8, r=8, lora_alpha=32, target_modules=("query", "value")):
+        self.config = config
+        self.capacity = capacity
+        self.r = r
+        self.lora_alpha = lora_alpha
+        self.tokenizer = BertTokenizer.from_pretrained(config["bert_path"])
+        with open(config["schema_path"], encoding="utf8") as f:
+            self.span_extractor = SpanExtractor(json.load(f))
+        self.context = AdapterContext()
+        self.bert = BertModel.from_pretrained(config["bert_path"], return_dict=False)
+        self.lora_layers = {}
+        for index, layer in enumerate(self.bert.encoder.layer):
+            for name in target_modules:
+                lora_layer = MultiLoraLinear(getattr(layer.attention.self, name), self.context, capacity, r)
+                setattr(layer.attention.self, name, lora_layer)
+                self.lora_layers[(index, name)] = lora_layer
+        hidden_size, class_num = self.bert.config.hidden_size, config["class_num"]
+        self.classify_weight = torch.zeros(capacity, class_num, hidden_size)
+        self.classify_bias = torch.zeros(capacity, class_num)
+        self.bert.eval()
+        self.registry = {}             #adapter名称 -> checkpoint路径，请求到来时按需加载
+        self.slots = OrderedDict()     #已加载的adapter名称 -> 槽位，顺序即LRU顺序
+        self.free_slots = list(range(capacity))
+        self.lock = threading.Lock()
+
+    def register(self, name, path):
+        self.registry[name] = path
+
+    #从main.py保存的checkpoint中取出lora和classify参数
+    def read_adapter(self, path):
+        state_dict = torch.load(path, map_location="cpu")
+        pattern = re.compile(r"layer\.(\d+)\.attention\.self\.(\w+)\.lora_([AB])\.")
+        lora, classify = {}, {}
+        for key, value in state_dict.items():
+            match = pattern.search(key)
+            if match:
+                lora[(int(match.group(1)), match.group(2), match.group(3))] = value
+            elif key.endswith("classify.weight") or key.endswith("classify.bias"):
+                classify[key.split(".")[-1]] = value
+        missing = [key for key in self.lora_layers if (key[0], key[1], "A") not in lora or (key[0], key[1], "B") not in lora]
+        if missing or len(classify) != 2:
+            raise ValueError("%s 中缺少lora或classify参数：%s" % (path, missing[:3]))
+        #在占用槽位之前检查所有形状，不合法的checkpoint不会淘汰已加载的adapter
+        for (index, module), layer in self.lora_layers.items():
+            for name, expected in [("A", layer.lora_A.shape[1:]), ("B", layer.lora_B.shape[1:])]:
+                if lora[(index, module, name)].shape != expected:
+                    raise ValueError("%s 中第%d层%s的lora_%s形状为%s，服务配置为%s" % (
+                        path, index, module, name, tuple(lora[(index, module, name)].shape), tuple(expected)))
+        for name, expected in [("weight", self.classify_weight.shape[1:]), ("bias", self.classify_bias.shape[1:])]:
+            if classify[name].shape != expected:
+                raise ValueError("%s 中classify.%s形状为%s，服务配置为%s" % (
+                    path, name, tuple(classify[name].shape), tuple(expected)))
+        return lora, classify
+
+    def load_adapter(self, name, path=None):
+        with self.lock:
+            return self._load(name, path)
+
+    def _load(self, name, path=None):
+        if name in self.slots:
+            self.slots.move_to_end(name)
+            return self.slots[name]
+        path = path or self.registry[name]
+        self.registry[name] = path
+        lora, classify = self.read_adapter(path)
+        if not self.free_slots:
+            self._unload(next(iter(self.slots)))
+        slot = self.free_slots.pop()
+        try:
+            with torch.no_grad():
+                for (index, module), layer in self.lora_layers.items():
+                    layer.lora_A[slot].copy_(lora[(index, module, "A")])
+                    layer.lora_B[slot].copy_(lora[(index, module, "B")])
+                    layer.scaling[slot] = self.lora_alpha / self.r
+                self.classify_weight[slot].copy_(classify["weight"])
+                self.classify_bias[slot].copy_(classify["bias"])
+        except Exception:
+            #复制失败时归还槽位，已写入部分的scaling置0
+            for layer in self.lora_layers.values():
+                layer.scaling.data[slot] = 0
+            self.free_slots.append(slot)
+            raise
+        self.slots[name] = slot
+        return slot
+
+    def unload_adapter(self, name):
+        with self.lock:
+            self._unload(name)
+
+    def _unload(self, name):
+        slot = self.slots.pop(name)
+        for layer in self.lora_layers.values():
+            layer.scaling.data[slot] = 0
+        self.free_slots.append(slot)
+
+    #input_ids: (batch_size, sen_len)，rows: 每行使用的槽位
+    def forward(self, input_ids, rows):
+        self.context.rows = rows
+        with torch.no_grad():
+            x, _ = self.bert(input_ids, attention_mask=input_ids.gt(0))
+            return torch.einsum("bsh,bch->bsc", x, self.classify_weight[rows]) + self.classify_bias[rows].unsqueeze(1)
+
+    #requests: [(adapter名称, 句子), ...]，返回与输入顺序一致的结果，格式与predict.py中NER.predict相同
+    #按句子长度排序组batch，每个batch中不同adapter的数量不超过槽位数
+    def predict(self, requests, batch_size=64):
+        order = sorted(range(len(requests)), key=lambda index: len(requests[index][1]))
+        batches, batch, names = [], [], set()
+        for index in order:
+            name = requests[index][0]
+            if len(batch) == batch_size or (name not in names and len(names) == self.capacity):
+                batches.append(batch)
+                batch, names = [], set()
+            batch.append(index)
+            names.add(name)
+        if batch:
+            batches.append(batch)
+        results = [None] * len(requests)
+        with self.lock:
+            for batch in batches:
+                for index, result in zip(batch, self.predict_batch([requests[index] for index in batch])):
+                    results[index] = result
+        return results
+
+    def predict_batch(self, requests):
+        names = set(name for name, _ in requests)
+        #先刷新本batch已加载adapter的LRU位置，再加载缺少的，保证淘汰的不是本batch要用的
+        for name in names:
+            if name in self.slots:
+                self.slots.move_to_end(name)
+        slots = dict((name, self._load(name)) for name in names)
+        sentences = [sentence for _, sentence in requests]
+        rows = torch.LongTensor([slots[name] for name, _ in requests])
+        input_ids = bulk_convert_tokens(self.tokenizer, [list(sentence) for sentence in sentences],
+                                        self.config["max_length"], padding=False)
+        input_ids = pad_sequence([torch.LongTensor(input_id) for input_id in input_ids], batch_first=True)
+        labels = torch.argmax(self.forward(input_ids, rows), dim=-1)
+        #标签第0位是[CLS]
+        spans = self.span_extractor.extract(labels, [len(sentence) + 1 for sentence in sentences], min_length=2)
+        types = self.span_extractor.types
+        results = [dict((entity, []) for entity in types) for _ in sentences]
+        for row, start, end, entity in spans.tolist():
+            results[row][types[entity]].append(sentences[row][start - 1:end - 1])
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    #格式 名称=checkpoint路径，可以传多个，如 --adapter a=model_output/a/epoch_5.pth --adapter b=...
+    parser.add_argument("--adapter", action="append", required=True)
+    parser.add_argument("--capacity", type=int, default=8)
+    args = parser.parse_args()
+    server = AdapterServer(Config, capacity=args.capacity)
+    for item in args.adapter:
+        name, path = item.split("=", 1)
+        server.register(name, path)
+    sentence = "本报记者安洋贺广华留学人员档案库建立本报讯中国质量体系认证机构国家认可委员会日前正式签署了协议"
+    requests = [(name, sentence) for name in server.registry]
+    for (name, _), result in zip(requests, server.predict(requests)):
+        print(name, result)
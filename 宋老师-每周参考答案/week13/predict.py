@@ -1,29 +1,65 @@
 # -*- coding: utf-8 -*-
+import os
+import sys
 import torch
-import re
 import json
+import time
 import numpy as np
 from collections import defaultdict
 from config import Config
 from model import TorchModel
 from transformers import BertTokenizer, BertModel
 from peft import get_peft_model, LoraConfig
+from torch.nn.utils.rnn import pad_sequence
 from main import peft_wrapper
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.spans import SpanExtractor
+from common.tokenization import bulk_convert_tokens
 
 """
 模型效果测试
+超过max_length的长文本使用 predict_long / predict_stream：
+按字切成相互重叠的窗口成批预测，重叠部分以中点为界，前半取前一个窗口的标签、后半取后一个窗口的标签，
+拼接后的标签序列再统一抽取实体；输入为文本片段的生成器，内存占用与文本总长度无关
+大量短句使用 predict_batch / predict_file：按长度排序后组batch，每个batch只补齐到其中最长的句子
 """
 
+
+#逐块读取大文件，供predict_stream使用
+def read_chunks(path, chunk_size=65536):
+    with open(path, encoding="utf8") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+#读取ner_data格式的文件(每行 字 标签，句子间空行分隔)，只取句子文本
+def load_sentences(path):
+    sentences = []
+    with open(path, encoding="utf8") as f:
+        for segment in f.read().split("\n\n"):
+            sentence = "".join(line.split()[0] for line in segment.split("\n") if line.strip())
+            if sentence:
+                sentences.append(sentence)
+    return sentences
+
 class NER:
-    def __init__(self, config, model_path):
+    #merged=True时model_path为export_merged.py导出的模型，lora已合并进bert，不需要再包装peft
+    def __init__(self, config, model_path, merged=False):
         self.config = config
         self.tokenizer = self.load_vocab(config["bert_path"])
         self.schema = self.load_schema(config["schema_path"])
+        self.span_extractor = SpanExtractor(self.schema)
         model = TorchModel(config)
-        model = peft_wrapper(model)
-        state_dict = model.state_dict()
-        state_dict.update(torch.load(model_path))
-        model.load_state_dict(state_dict)
+        if merged:
+            model.load_state_dict(torch.load(model_path, map_location="cpu"))
+        else:
+            model = peft_wrapper(model)
+            state_dict = model.state_dict()
+            state_dict.update(torch.load(model_path))
+            model.load_state_dict(state_dict)
         model.eval()
         self.model = model
         print("模型加载完毕!")
@@ -42,24 +78,9 @@ class NER:
                                      max_length=self.config["max_length"],
                                      truncation=True)
 
+    #标签第0位是[CLS]
     def decode(self, sentence, labels):
-        sentence = "$" + sentence
-        labels = "".join([str(int(x)) for x in labels[:len(sentence)+1]])
-        results = defaultdict(list)
-        
-        for location in re.finditer("(04+)", labels):
-            s, e = location.span()
-            results["LOCATION"].append(sentence[s:e])
-        for location in re.finditer("(15+)", labels):
-            s, e = location.span()
-            results["ORGANIZATION"].append(sentence[s:e])
-        for location in re.finditer("(26+)", labels):
-            s, e = location.span()
-            results["PERSON"].append(sentence[s:e])
-        for location in re.finditer("(37+)", labels):
-            s, e = location.span()
-            results["TIME"].append(sentence[s:e])
-        return results
+        return self.span_extractor.decode(sentence, labels, offset=1, min_length=2)
 
 
     def predict(self, sentence):
@@ -70,8 +91,169 @@ class NER:
         results = self.decode(sentence, labels)
         return results
 
+    #一批句子的预测，返回与输入顺序一致的结果列表，格式与predict相同
+    #句子按长度排序后切分batch，输入按字转换成id，与训练时loader的处理一致
+    def predict_batch(self, sentences, batch_size=64, num_threads=None):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        order = sorted(range(len(sentences)), key=lambda index: len(sentences[index]))
+        results = [None] * len(sentences)
+        for batch_start in range(0, len(order), batch_size):
+            batch_index = order[batch_start:batch_start + batch_size]
+            batch_sentences = [sentences[index] for index in batch_index]
+            input_ids = bulk_convert_tokens(self.tokenizer, [list(sentence) for sentence in batch_sentences],
+                                            self.config["max_length"], padding=False)
+            input_ids = pad_sequence([torch.LongTensor(input_id) for input_id in input_ids], batch_first=True)
+            with torch.no_grad():
+                res = self.model(input_ids)
+                if not self.config["use_crf"]:
+                    res = torch.argmax(res, dim=-1)
+            #标签第0位是[CLS]，整个batch一次抽取实体
+            spans = self.span_extractor.extract(res, [len(sentence) + 1 for sentence in batch_sentences], min_length=2)
+            batch_results = [dict((entity, []) for entity in self.span_extractor.types) for _ in batch_sentences]
+            for row, start, end, entity in spans.tolist():
+                batch_results[row][self.span_extractor.types[entity]].append(batch_sentences[row][start - 1:end - 1])
+            for index, result in zip(batch_index, batch_results):
+                results[index] = result
+        return results
+
+    #每行一句，结果以jsonl格式逐批写出；每次只读入buffer_size句，在其中排序组batch，内存占用不随文件增长
+    def predict_file(self, input_path, output_path, batch_size=64, buffer_size=10000, num_threads=None):
+        total = 0
+        with open(input_path, encoding="utf8") as f, open(output_path, "w", encoding="utf8") as writer:
+            buffer = []
+            for line in f:
+                buffer.append(line.rstrip("\n"))
+                if len(buffer) == buffer_size:
+                    total += self.write_results(writer, buffer, self.predict_batch(buffer, batch_size, num_threads))
+                    buffer = []
+            if buffer:
+                total += self.write_results(writer, buffer, self.predict_batch(buffer, batch_size, num_threads))
+        return total
+
+    def write_results(self, writer, sentences, results):
+        for sentence, result in zip(sentences, results):
+            writer.write(json.dumps({"sentence": sentence, "entities": result}, ensure_ascii=False) + "\n")
+        writer.flush()
+        return len(sentences)
+
+    #窗口长度要留出[CLS]和[SEP]的位置；重叠长度取偶数，保证中点两侧各占一半
+    def window_size(self):
+        return self.config["max_length"] - 2
+
+    def window_overlap(self):
+        size = self.window_size()
+        overlap = min(self.config.get("window_overlap", size // 4), size - 2)
+        return overlap - overlap % 2
+
+    #一批窗口文本 -> 每个窗口逐字的标签，已去掉[CLS]位置
+    def predict_windows(self, windows):
+        input_ids = bulk_convert_tokens(self.tokenizer, [list(window) for window in windows], self.config["max_length"])
+        with torch.no_grad():
+            res = self.model(torch.LongTensor(input_ids))
+            if not self.config["use_crf"]:
+                res = torch.argmax(res, dim=-1)
+        return [labels[1:len(window) + 1] for window, labels in zip(windows, res.tolist())]
+
+    #chunks为任意切分的文本片段，依次产出 (全局起始位置, 文本, 逐字标签)，所有产出片段首尾相接覆盖整个输入
+    #窗口起点间隔 stride = size - overlap，起点为s的窗口负责到 s + stride + overlap // 2 为止，最后一个窗口负责到文本末尾
+    def stream_labels(self, chunks, batch_size=16):
+        size, overlap = self.window_size(), self.window_overlap()
+        stride = size - overlap
+        buffer, buffer_start, emitted = "", 0, 0
+        chunks = iter(chunks)
+        finished = False
+        while not finished:
+            chunk = next(chunks, None)
+            if chunk is None:
+                finished = True
+            else:
+                buffer += chunk
+            #凑够一整批完整窗口才预测；后面还有文本时，最后一个窗口之后必须有内容，以免误判为文本末尾
+            while len(buffer) > (batch_size - 1) * stride + size:
+                starts = [i * stride for i in range(batch_size)]
+                window_labels = self.predict_windows([buffer[s:s + size] for s in starts])
+                for s, labels in zip(starts, window_labels):
+                    end = buffer_start + s + stride + overlap // 2
+                    yield emitted, buffer[emitted - buffer_start:end - buffer_start], \
+                          labels[emitted - buffer_start - s:end - buffer_start - s]
+                    emitted = end
+                buffer = buffer[batch_size * stride:]
+                buffer_start += batch_size * stride
+        if not buffer:
+            return
+        starts = [0]
+        while starts[-1] + size < len(buffer):
+            starts.append(starts[-1] + stride)
+        #最后一个窗口与文本末尾对齐，保证其上下文完整
+        starts[-1] = max(0, len(buffer) - size)
+        for batch_start in range(0, len(starts), batch_size):
+            batch_starts = starts[batch_start:batch_start + batch_size]
+            window_labels = self.predict_windows([buffer[s:s + size] for s in batch_starts])
+            for s, labels in zip(batch_starts, window_labels):
+                if s == starts[-1]:
+                    end = buffer_start + len(buffer)
+                else:
+                    end = buffer_start + s + stride + overlap // 2
+                yield emitted, buffer[emitted - buffer_start:end - buffer_start], \
+                      labels[emitted - buffer_start - s:end - buffer_start - s]
+                emitted = end
+
+    #逐个产出实体 {"type", "start", "end", "text"}，start/end为在整个输入中的位置(end不含)
+    #延伸到已预测部分末尾的实体可能在后面继续，暂不输出，等下一段标签到来再判断
+    def predict_stream(self, chunks, batch_size=16, min_length=2):
+        pending_start, pending_text, pending_labels = 0, "", []
+        for _, text, labels in self.stream_labels(chunks, batch_size):
+            pending_text += text
+            pending_labels += labels
+            spans = self.span_extractor.extract(pending_labels).tolist() if pending_labels else []
+            keep_from = len(pending_labels)
+            if spans and spans[-1][2] == len(pending_labels):
+                keep_from = spans.pop()[1]
+            for entity in self.span_entities(spans, pending_start, pending_text, min_length):
+                yield entity
+            pending_start += keep_from
+            pending_text, pending_labels = pending_text[keep_from:], pending_labels[keep_from:]
+        spans = self.span_extractor.extract(pending_labels).tolist() if pending_labels else []
+        for entity in self.span_entities(spans, pending_start, pending_text, min_length):
+            yield entity
+
+    def span_entities(self, spans, offset, text, min_length):
+        for _, start, end, entity in spans:
+            if end - start >= min_length:
+                yield {"type": self.span_extractor.types[entity], "start": offset + start, "end": offset + end, "text": text[start:end]}
+
+    #长文本预测，返回格式与predict相同
+    def predict_long(self, text, batch_size=16):
+        results = dict((entity, []) for entity in self.span_extractor.types)
+        for entity in self.predict_stream([text], batch_size):
+            results[entity["type"]].append(entity["text"])
+        return results
+
+#逐句predict与predict_batch的吞吐对比，同时统计两者结果不一致的句子数
+#逐句predict用tokenizer.encode整句编码，含英文数字时与逐字编码的切分不同，结果可能有差异
+def benchmark(ner, sentences, batch_sizes=(16, 64, 256), num_threads=None):
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    start = time.perf_counter()
+    expected = [ner.predict(sentence) for sentence in sentences]
+    cost = time.perf_counter() - start
+    print("逐句预测：%d句，耗时%.2fs，%.1f句/s" % (len(sentences), cost, len(sentences) / cost))
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        results = ner.predict_batch(sentences, batch_size)
+        cost = time.perf_counter() - start
+        mismatch = sum(a != b for a, b in zip(expected, results))
+        print("batch_size=%d：耗时%.2fs，%.1f句/s，结果不一致%d句" % (batch_size, cost, len(sentences) / cost, mismatch))
+
+
 if __name__ == "__main__":
     sl = NER(Config, "model_output/epoch_5.pth")
     sentence = "(本报约翰内斯堡电)本报记者安洋贺广华留学人员档案库建立本报讯中国质量体系认证机构国家认可委员会日前正式签署了国际上第一个质量认证的多边互认协议,表明中国质量体系认证达到了国际水平。"
     res = sl.predict(sentence)
     print(res)
+    #超过max_length的部分predict会直接截断
+    res = sl.predict_long(sentence * 5)
+    print(res)
+    benchmark(sl, load_sentences(Config["valid_data_path"]), num_threads=Config["num_threads"])
+    #大文件逐块读取：for entity in sl.predict_stream(read_chunks("news.txt")): ...
@@ -17,9 +17,20 @@ Config = {
     "epoch": 5,
     "batch_size": 16,
     "pooling_style":"avg",
+    "length_aware": True,  #rnn类模型按真实长度pack，pooling时屏蔽padding位置
     "optimizer": "adam",
     "learning_rate": 1e-5,
+    "grad_accum_steps": 1,  #梯度累积步数，等效batch_size = batch_size * grad_accum_steps
+    "autocast": None,  #设为"bf16"开启bfloat16 autocast
+    "num_threads": None,  #torch使用的cpu线程数，None为默认
+    "checkpoint_steps": None,  #每隔多少个更新步保存断点，None时不在轮内保存
+    "checkpoint_every_epoch": False,  #每轮结束是否保存断点，checkpoint_steps或resume开启时也会保存
+    "resume": False,  #是否从model_path下的checkpoint.pt续跑
     "pretrain_model_path":r"E:\pretrain_models\bert-base-chinese",
-    "seed": 987
+    "seed": 987,
+    "token_cache_dir": "token_cache",  #预分词缓存目录，设为None则每次重新编码
+    "feature_cache_dir": "feature_cache",  #冻结bert时backbone输出的缓存目录，见feature_cache.py
+    "dynamic_padding": True,  #组batch时只补齐到batch内最长样本，并按长度分桶
+    "valid_result_path": "valid_result.csv",  #逐条预测结果，支持.csv/.parquet，设为None不输出
 }
 
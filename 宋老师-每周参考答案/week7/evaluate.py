@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
+import csv
 import torch
-import openpyxl
 from loader import load_data
 
 """
 模型效果测试
+预测结果和混淆矩阵都按整个batch做张量运算，逐条结果流式写入csv/parquet，不在内存中堆积
 """
 
 class Evaluator:
@@ -14,43 +15,94 @@ class Evaluator:
         self.logger = logger
         self.valid_data = load_data(config["valid_data_path"], config, shuffle=False)
         self.sentences = self.valid_data.dataset.sentences
+        self.class_num = config["class_num"]
         self.stats_dict = {"correct":0, "wrong":0}  #用于存储测试结果
 
     def eval(self, epoch):
         self.logger.info("开始测试第%d轮模型效果：" % epoch)
         self.model.eval()
         self.stats_dict = {"correct": 0, "wrong": 0}  # 清空上一轮结果
-        #输出一下测试集效果
-        self.writer = openpyxl.Workbook()
-        self.sheet = self.writer.active
-        self.sheet.append(["sentence", "true_label", "pred_label", "is_correct"])
+        #混淆矩阵，行为真实标签，列为预测标签，直接在模型所在设备上累加
+        self.confusion = None
+        #输出一下测试集效果，valid_result_path为None时不写逐条结果
+        self.writer = open_result_writer(self.config.get("valid_result_path"))
+        offset = 0
         for index, batch_data in enumerate(self.valid_data):
             if torch.cuda.is_available():
                 batch_data = [d.cuda() for d in batch_data]
             input_ids, labels = batch_data   #输入变化时这里需要修改，比如多输入，多输出的情况
             with torch.no_grad():
                 pred_results = self.model(input_ids) #不输入labels，使用模型当前参数进行预测
-            self.write_stats(labels, pred_results, self.sentences[index*self.config["batch_size"]:(index+1)*self.config["batch_size"]])
+            self.write_stats(labels, pred_results, self.sentences[offset:offset + len(labels)])
+            offset += len(labels)
+        if self.writer is not None:
+            self.writer.close()
         acc = self.show_stats()
-        self.writer.save("valid_result.xlsx")
         return acc
 
     def write_stats(self, labels, pred_results, sentences):
         assert len(labels) == len(pred_results)
-        for true_label, pred_label, sentence in zip(labels, pred_results, sentences):
-            pred_label = torch.argmax(pred_label)
-            self.sheet.append([sentence, int(true_label), int(pred_label), int(true_label) == int(pred_label)])
-            if int(true_label) == int(pred_label):
-                self.stats_dict["correct"] += 1
-            else:
-                self.stats_dict["wrong"] += 1
+        labels = labels.view(-1)
+        #batch_size为1时模型输出会被squeeze成一维，这里统一还原成(batch_size, class_num)
+        pred_labels = torch.argmax(pred_results.view(len(labels), -1), dim=-1)
+        confusion = torch.bincount(labels * self.class_num + pred_labels, minlength=self.class_num ** 2)
+        confusion = confusion.view(self.class_num, self.class_num)
+        self.confusion = confusion if self.confusion is None else self.confusion + confusion
+        if self.writer is not None:
+            self.writer.write(sentences, labels.cpu().tolist(), pred_labels.cpu().tolist())
         return
 
     def show_stats(self):
-        correct = self.stats_dict["correct"]
-        wrong = self.stats_dict["wrong"]
+        confusion = self.confusion.cpu()
+        correct = int(torch.trace(confusion))
+        wrong = int(confusion.sum()) - correct
+        self.stats_dict = {"correct": correct, "wrong": wrong}
         self.logger.info("预测集合条目总量：%d" % (correct +wrong))
         self.logger.info("预测正确条目：%d，预测错误条目：%d" % (correct, wrong))
         self.logger.info("预测准确率：%f" % (correct / (correct + wrong)))
+        self.logger.info("混淆矩阵(行为真实标签，列为预测标签)：%s" % confusion.tolist())
         self.logger.info("--------------------")
         return correct / (correct + wrong)
+
+
+#逐条结果写入csv，每个batch写一次，内存占用与测试集大小无关
+class CsvResultWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["sentence", "true_label", "pred_label", "is_correct"])
+
+    def write(self, sentences, true_labels, pred_labels):
+        self.writer.writerows([sentence, t, p, t == p] for sentence, t, p in zip(sentences, true_labels, pred_labels))
+
+    def close(self):
+        self.file.close()
+
+
+#parquet格式，需要安装pyarrow
+class ParquetResultWriter:
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([("sentence", pa.string()), ("true_label", pa.int64()),
+                                 ("pred_label", pa.int64()), ("is_correct", pa.bool_())])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, sentences, true_labels, pred_labels):
+        is_correct = [t == p for t, p in zip(true_labels, pred_labels)]
+        table = self.pa.Table.from_arrays([self.pa.array(list(sentences)), self.pa.array(true_labels),
+                                           self.pa.array(pred_labels), self.pa.array(is_correct)],
+                                          schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+def open_result_writer(path):
+    if path is None:
+        return None
+    if path.endswith(".parquet"):
+        return ParquetResultWriter(path)
+    return CsvResultWriter(path)
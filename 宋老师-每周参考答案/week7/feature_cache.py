@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+from config import Config
+from loader import load_data, DataGenerator
+from token_cache import file_hash
+from model import TorchModel, choose_optimizer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""
+冻结bert时的特征缓存
+bert / bert_lstm / bert_cnn / bert_mid_layer 在冻结bert后，bert部分的输出每轮都一样
+先用bert对整个数据集跑一遍，把backbone输出以fp16存成memmap文件，之后只训练head，直接从缓存读取特征
+"""
+
+
+#bert、bert_lstm、bert_cnn的backbone都是bert最后一层输出，可以共用一份缓存；bert_mid_layer单独一份
+def backbone_name(config):
+    if config["model_type"] == "bert_mid_layer":
+        return "mid_layer"
+    return "sequence_output"
+
+
+def feature_cache_key(data_path, config):
+    #loader只在model_type为bert时使用bert的tokenizer，其余类型使用字表
+    tokenizer_name = "bert_tokenizer" if config["model_type"] == "bert" else config["vocab_path"]
+    raw = "|".join([file_hash(data_path), backbone_name(config), config["pretrain_model_path"],
+                    tokenizer_name, str(config["max_length"])])
+    return hashlib.sha1(raw.encode("utf8")).hexdigest()[:16]
+
+
+class FeatureCache:
+    def __init__(self, cache_dir, key):
+        self.cache_dir = cache_dir
+        self.prefix = os.path.join(cache_dir, key)
+
+    def exists(self):
+        return os.path.isfile(self.prefix + ".meta.json")
+
+    #用冻结的backbone对数据集跑一遍，逐batch写入memmap
+    def build(self, model, data_loader, max_length):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        sample_num = len(data_loader.dataset)
+        hidden_size = model.bert_module().config.hidden_size
+        features = np.lib.format.open_memmap(self.prefix + ".features.npy", mode="w+", dtype=np.float16,
+                                             shape=(sample_num, max_length, hidden_size))
+        lengths = np.zeros(sample_num, dtype=np.int32)
+        labels = np.zeros(sample_num, dtype=np.int64)
+        model.eval()
+        offset = 0
+        with torch.no_grad():
+            for input_ids, batch_labels in data_loader:
+                if torch.cuda.is_available():
+                    input_ids = input_ids.cuda()
+                mask = input_ids.gt(0)
+                output = model.backbone(input_ids, mask)
+                batch_size, width = input_ids.shape
+                features[offset:offset + batch_size, :width] = output.cpu().to(torch.float16).numpy()
+                lengths[offset:offset + batch_size] = mask.sum(dim=-1).cpu().numpy()
+                labels[offset:offset + batch_size] = batch_labels.view(-1).numpy()
+                offset += batch_size
+        features.flush()
+        del features
+        np.save(self.prefix + ".lengths.npy", lengths)
+        np.save(self.prefix + ".labels.npy", labels)
+        #最后写meta，中途崩溃不会留下半成品缓存
+        with open(self.prefix + ".meta.json", "w", encoding="utf8") as f:
+            json.dump({"sample_num": sample_num, "max_length": max_length, "hidden_size": hidden_size}, f)
+
+    def load(self):
+        self.features = np.load(self.prefix + ".features.npy", mmap_mode="r")
+        self.lengths = np.load(self.prefix + ".lengths.npy")
+        self.labels = np.load(self.prefix + ".labels.npy")
+        return self
+
+
+class FeatureDataset(Dataset):
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __len__(self):
+        return len(self.cache.labels)
+
+    def __getitem__(self, index):
+        length = max(int(self.cache.lengths[index]), 1)
+        features = torch.from_numpy(np.asarray(self.cache.features[index, :length], dtype=np.float32))
+        return features, torch.LongTensor([self.cache.labels[index]])
+
+
+#组batch时补齐到batch内最长样本，同时生成mask
+def feature_collate(batch):
+    features = torch.nn.utils.rnn.pad_sequence([item[0] for item in batch], batch_first=True)
+    lengths = torch.LongTensor([item[0].shape[0] for item in batch])
+    mask = torch.arange(features.shape[1]).unsqueeze(0) < lengths.unsqueeze(1)
+    labels = torch.cat([item[1] for item in batch])
+    return features, mask, labels
+
+
+def load_feature_data(data_path, config, model, shuffle=True):
+    cache = FeatureCache(config["feature_cache_dir"], feature_cache_key(data_path, config))
+    if not cache.exists():
+        logger.info("特征缓存不存在，开始用bert编码：%s" % data_path)
+        cache.build(model, load_data(data_path, config, shuffle=False), config["max_length"])
+    dataset = FeatureDataset(cache.load())
+    return DataLoader(dataset, batch_size=config["batch_size"], shuffle=shuffle, collate_fn=feature_collate)
+
+
+def evaluate_head(model, valid_data):
+    model.eval()
+    correct, total = 0, 0
+    with torch.no_grad():
+        for features, mask, labels in valid_data:
+            if torch.cuda.is_available():
+                features, mask, labels = features.cuda(), mask.cuda(), labels.cuda()
+            pred = model.forward_features(features, mask)
+            correct += int((torch.argmax(pred.view(len(labels), -1), dim=-1) == labels).sum())
+            total += len(labels)
+    return correct / total
+
+
+#冻结bert，只训练head
+def train_head(config):
+    #模型需要的vocab_size、class_num由DataGenerator写入config
+    DataGenerator(config["valid_data_path"], config)
+    model = TorchModel(config)
+    assert model.use_bert, "只有bert类模型需要特征缓存"
+    for param in model.bert_module().parameters():
+        param.requires_grad = False
+    if torch.cuda.is_available():
+        model = model.cuda()
+    train_data = load_feature_data(config["train_data_path"], config, model)
+    valid_data = load_feature_data(config["valid_data_path"], config, model, shuffle=False)
+    optimizer = choose_optimizer(config, model)
+    acc = 0
+    for epoch in range(config["epoch"]):
+        epoch += 1
+        model.train()
+        #bert冻结且特征已缓存，train模式只影响head中的dropout等
+        train_loss = []
+        for features, mask, labels in train_data:
+            if torch.cuda.is_available():
+                features, mask, labels = features.cuda(), mask.cuda(), labels.cuda()
+            optimizer.zero_grad()
+            loss = model.forward_features(features, mask, labels)
+            loss.backward()
+            optimizer.step()
+            train_loss.append(loss.item())
+        acc = evaluate_head(model, valid_data)
+        logger.info("epoch %d average loss: %f, 预测准确率：%f" % (epoch, np.mean(train_loss), acc))
+    return acc
+
+
+if __name__ == "__main__":
+    #对比不同head时bert只需要跑一次
+    for model_type in ["bert", "bert_lstm", "bert_cnn"]:
+        Config["model_type"] = model_type
+        print("最后一轮准确率：", train_head(Config), "当前配置：", Config["model_type"])
@@ -3,20 +3,28 @@
 import json
 import re
 import os
+import sys
 import torch
 import numpy as np
 from torch.utils.data import Dataset, DataLoader
 from transformers import BertTokenizer
+from token_cache import TokenCache, cache_key, file_hash
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.batching import pad_collate, BucketBatchSampler
+from common.tokenization import bulk_encode
 """
 数据加载
 """
 
 
+index_to_label = {0: '差评', 1: '好评'}
+
+
 class DataGenerator:
     def __init__(self, data_path, config):
         self.config = config
         self.path = data_path
-        self.index_to_label = {0: '差评', 1: '好评'}
+        self.index_to_label = dict(index_to_label)
         self.label_to_index = dict((y, x) for x, y in self.index_to_label.items())
         self.config["class_num"] = len(self.index_to_label)
         if self.config["model_type"] == "bert":
@@ -29,6 +37,21 @@ class DataGenerator:
 
     def load(self):
         self.data = []
+        self.cache = None
+        #配置了缓存目录时，编码结果落盘复用，后续启动直接mmap打开
+        if self.config.get("token_cache_dir"):
+            self.load_from_cache(self.config["token_cache_dir"])
+            return
+        for title, input_id, label in self.read_samples():
+            self.sentences.append(title)
+            input_id = torch.LongTensor(self.padding(input_id))
+            label_index = torch.LongTensor([label])
+            self.data.append([input_id, label_index])
+        return
+
+    #读取全部文本后批量编码，返回未padding的(文本, input_id, 标签)
+    def read_samples(self):
+        titles, labels = [], []
         with open(self.path, encoding="utf8") as f:
             for line in f:
                 if line.startswith("0,"):
@@ -37,34 +60,67 @@ class DataGenerator:
                     label = 1
                 else:
                     continue
-                title = line[2:].strip()
-                if self.config["model_type"] == "bert":
-                    input_id = self.tokenizer.encode(title, max_length=self.config["max_length"], pad_to_max_length=True)
-                else:
-                    input_id = self.encode_sentence(title)
-                self.sentences.append(title)
-                input_id = torch.LongTensor(input_id)
-                label_index = torch.LongTensor([label])
-                self.data.append([input_id, label_index])
+                titles.append(line[2:].strip())
+                labels.append(label)
+        if self.config["model_type"] == "bert":
+            input_ids = bulk_encode(self.config["pretrain_model_path"], titles,
+                                    max_length=self.config["max_length"], truncation=True)
+        else:
+            input_ids = [self.encode_sentence(title, padding=False) for title in titles]
+        return zip(titles, input_ids, labels)
+
+    def load_from_cache(self, cache_dir):
+        key = cache_key(self.path, self.tokenizer_name(), self.config["max_length"])
+        cache = TokenCache(cache_dir, key)
+        if not cache.exists():
+            cache.build(self.read_samples())
+        self.cache = cache.load()
+        self.sentences = self.cache.sentences
         return
 
-    def encode_sentence(self, text):
+    #用于区分不同的分词方式，词表变化时缓存随之失效
+    def tokenizer_name(self):
+        if self.config["model_type"] == "bert":
+            vocab_file = os.path.join(self.config["pretrain_model_path"], "vocab.txt")
+            if os.path.isfile(vocab_file):
+                return "bert:" + file_hash(vocab_file)
+            return "bert:" + self.config["pretrain_model_path"]
+        return "vocab:" + file_hash(self.config["vocab_path"])
+
+    def encode_sentence(self, text, padding=True):
         input_id = []
         for char in text:
             input_id.append(self.vocab.get(char, self.vocab["[UNK]"]))
-        input_id = self.padding(input_id)
+        if padding:
+            input_id = self.padding(input_id)
+        else:
+            input_id = input_id[:self.config["max_length"]]
         return input_id
 
     #补齐或截断输入的序列，使其可以在一个batch内运算
     def padding(self, input_id):
         input_id = input_id[:self.config["max_length"]]
+        #动态padding时只截断，补齐留到组batch时进行
+        if self.config.get("dynamic_padding"):
+            return input_id
         input_id += [0] * (self.config["max_length"] - len(input_id))
         return input_id
 
     def __len__(self):
+        if self.cache is not None:
+            return len(self.cache)
         return len(self.data)
 
+    #每条样本的长度，用于分桶采样
+    def lengths(self):
+        if self.cache is not None:
+            return np.diff(self.cache.offsets).tolist()
+        return [len(input_id) for input_id, _ in self.data]
+
     def __getitem__(self, index):
+        if self.cache is not None:
+            input_id, label = self.cache.get(index)
+            return [torch.LongTensor(self.padding(input_id.tolist())), torch.LongTensor([label])]
         return self.data[index]
 
 def load_vocab(vocab_path):
@@ -79,8 +135,15 @@ def load_vocab(vocab_path):
 #用torch自带的DataLoader类封装数据
 def load_data(data_path, config, shuffle=True):
     dg = DataGenerator(data_path, config)
-    dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle)
-    return dl
+    if not config.get("dynamic_padding"):
+        dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle)
+        return dl
+    collate_fn = pad_collate((0, 0))
+    if shuffle:
+        batch_sampler = BucketBatchSampler(dg.lengths(), config["batch_size"])
+        return DataLoader(dg, batch_sampler=batch_sampler, collate_fn=collate_fn)
+    #不打乱时保持原顺序，evaluator依赖顺序对齐sentences
+    return DataLoader(dg, batch_size=config["batch_size"], shuffle=False, collate_fn=collate_fn)
 
 if __name__ == "__main__":
     from config import Config
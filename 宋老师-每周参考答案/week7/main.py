@@ -2,6 +2,7 @@
 
 import torch
 import os
+import sys
 import random
 import os
 import numpy as np
@@ -10,6 +11,8 @@ from config import Config
 from model import TorchModel, choose_optimizer
 from evaluate import Evaluator
 from loader import load_data
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.trainer import Trainer
 #[DEBUG, INFO, WARNING, ERROR, CRITICAL]
 logging.basicConfig(level=logging.INFO, format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -42,28 +45,10 @@ def main(config):
     optimizer = choose_optimizer(config, model)
     #加载效果测试类
     evaluator = Evaluator(config, model, logger)
-    #训练
-    for epoch in range(config["epoch"]):
-        epoch += 1
-        model.train()
-        logger.info("epoch %d begin" % epoch)
-        train_loss = []
-        for index, batch_data in enumerate(train_data):
-            if cuda_flag:
-                batch_data = [d.cuda() for d in batch_data]
+    #训练，梯度累积、autocast、断点续跑等见common/trainer.py
+    trainer = Trainer(config, model, optimizer, evaluator, logger)
+    acc = trainer.train(train_data)
 
-            optimizer.zero_grad()
-            input_ids, labels = batch_data   #输入变化时这里需要修改，比如多输入，多输出的情况
-            loss = model(input_ids, labels)
-            loss.backward()
-            optimizer.step()
-
-            train_loss.append(loss.item())
-            if index % int(len(train_data) / 2) == 0:
-                logger.info("batch loss %f" % loss)
-        logger.info("epoch average loss: %f" % np.mean(train_loss))
-        acc = evaluator.eval(epoch)
-        
     # model_path = os.path.join(config["model_path"], "epoch_%d.pth" % epoch)
     # torch.save(model.state_dict(), model_path)  #保存模型权重
     return acc
@@ -77,21 +62,7 @@ if __name__ == "__main__":
     input()
     #对比所有模型
     #中间日志可以关掉，避免输出过多信息
-    # 超参数的网格搜索,结果写入excel
-    import pandas as pd
-    df = pd.DataFrame(columns=["model_type", "learning_rate", "hidden_size", "batch_size", "pooling_style", "acc"])
-    for model in ["gated_cnn", 'fast_text', 'lstm']:
-        Config["model_type"] = model
-        for lr in [1e-3, 1e-4]:
-            Config["learning_rate"] = lr
-            for hidden_size in [128, 256]:
-                Config["hidden_size"] = hidden_size
-                for batch_size in [64, 256]:
-                    Config["batch_size"] = batch_size
-                    for pooling_style in ["avg", 'max']:
-                        Config["pooling_style"] = pooling_style
-                        acc = main(Config)
-                        df = df._append({"model_type": model, "learning_rate": lr, "hidden_size": hidden_size, "batch_size": batch_size, "pooling_style": pooling_style, "acc": acc}, ignore_index=True)
-    df.to_excel("result.xlsx", index=False)
-
-
+    # 超参数的网格搜索，多进程并行，结果逐条写入search_results.jsonl，最后汇总到excel
+    # 中断后重新运行会跳过已完成的配置
+    from search import grid_search, search_space
+    grid_search(search_space)
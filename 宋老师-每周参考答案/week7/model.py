@@ -3,6 +3,7 @@
 import torch
 import torch.nn as nn
 from torch.optim import Adam, SGD
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from transformers import BertModel
 """
 建立网络模型结构
@@ -17,6 +18,7 @@ class TorchModel(nn.Module):
         model_type = config["model_type"]
         num_layers = config["num_layers"]
         self.use_bert = False
+        self.use_rnn = model_type in ["lstm", "gru", "rnn", "rcnn"]
         self.embedding = nn.Embedding(vocab_size, hidden_size, padding_idx=0)
         if model_type == "fast_text":
             self.encoder = lambda x: x
@@ -53,36 +55,99 @@ class TorchModel(nn.Module):
 
         self.classify = nn.Linear(hidden_size, class_num)
         self.pooling_style = config["pooling_style"]
+        #按真实长度计算：rnn类用pack跳过padding位置，pooling时屏蔽padding位置
+        self.length_aware = config.get("length_aware", False)
+        self.pooling_layer = MaskedPooling(self.pooling_style)
         self.loss = nn.functional.cross_entropy  #loss采用交叉熵损失
 
     #当输入真实标签，返回loss值；无真实标签，返回预测值
-    def forward(self, x, target=None):
+    #mask为attention mask，不传入时按0为padding位置自动生成
+    def forward(self, x, target=None, mask=None):
+        if mask is None:
+            mask = x.gt(0)
         if self.use_bert:  # bert返回的结果是 (sequence_output, pooler_output)
             #sequence_output:batch_size, max_len, hidden_size
             #pooler_output:batch_size, hidden_size
-            x = self.encoder(x)
+            x = self.backbone(x, mask)
+            return self.forward_features(x, mask, target)
+        elif self.use_rnn and self.length_aware:
+            x = self.embedding(x)
+            lengths = mask.sum(dim=-1)
+            if isinstance(self.encoder, RCNN):
+                x = self.encoder(x, lengths)
+            else:
+                x = run_packed(self.encoder, x, lengths)
         else:
             x = self.embedding(x)  # input shape:(batch_size, sen_len)
             x = self.encoder(x)  # input shape:(batch_size, sen_len, input_dim)
+        return self.pool_and_classify(x, mask, target)
 
+    #bert类模型拆成 backbone(bert本体) + head(bert之后的lstm/cnn等)
+    #冻结bert时backbone的输出可以提前缓存，head直接从缓存训练
+    def bert_module(self):
+        if isinstance(self.encoder, BertModel):
+            return self.encoder
+        return self.encoder.bert
+
+    def backbone(self, x, mask=None):
+        if isinstance(self.encoder, BertModel):
+            return self.encoder(x, attention_mask=mask)[0]
+        return self.encoder.backbone(x, attention_mask=mask)
+
+    #features为backbone的输出 (batch_size, sen_len, hidden_size)
+    def forward_features(self, features, mask, target=None):
+        if isinstance(self.encoder, BertModel):
+            x = features
+        else:
+            x = self.encoder.head(features)
+        return self.pool_and_classify(x, mask, target)
+
+    def pool_and_classify(self, x, mask, target=None):
         if isinstance(x, tuple):  #RNN类的模型会同时返回隐单元向量，我们只取序列结果
             x = x[0]
         #可以采用pooling的方式得到句向量
-        if self.pooling_style == "max":
-            self.pooling_layer = nn.MaxPool1d(x.shape[1])
+        if self.length_aware:
+            x = self.pooling_layer(x, mask)
+        elif self.pooling_style == "max":
+            x = nn.functional.max_pool1d(x.transpose(1, 2), x.shape[1]).squeeze(-1) #input shape:(batch_size, sen_len, input_dim)
         else:
-            self.pooling_layer = nn.AvgPool1d(x.shape[1])
-        x = self.pooling_layer(x.transpose(1, 2)).squeeze() #input shape:(batch_size, sen_len, input_dim)
+            x = nn.functional.avg_pool1d(x.transpose(1, 2), x.shape[1]).squeeze(-1)
 
         #也可以直接使用序列最后一个位置的向量
         # x = x[:, -1, :]
         predict = self.classify(x)   #input shape:(batch_size, input_dim)
         if target is not None:
-            return self.loss(predict, target.squeeze())
+            return self.loss(predict, target.view(-1))
         else:
             return predict
 
 
+#只在mask为True的位置上做pooling
+class MaskedPooling(nn.Module):
+    def __init__(self, pooling_style):
+        super(MaskedPooling, self).__init__()
+        self.pooling_style = pooling_style
+
+    def forward(self, x, mask):  #x: (batch_size, sen_len, input_dim)  mask: (batch_size, sen_len)
+        mask = mask[:, :x.shape[1]].unsqueeze(-1)
+        if self.pooling_style == "max":
+            return x.masked_fill(~mask, -1e4).max(dim=1)[0]
+        else:
+            x = torch.sum(x * mask, dim=1)
+            return x / mask.sum(dim=1).clamp(min=1)
+
+
+#用pack_padded_sequence跑rnn，padding位置不参与计算，输出再补齐回原长度
+def run_packed(rnn, x, lengths):
+    total_length = x.shape[1]
+    #长度为0的样本(空文本)按1处理，pack不接受长度0
+    lengths = lengths.clamp(min=1).cpu()
+    packed = pack_padded_sequence(x, lengths, batch_first=True, enforce_sorted=False)
+    x, _ = rnn(packed)
+    x, _ = pad_packed_sequence(x, batch_first=True, total_length=total_length)
+    return x
+
+
 class CNN(nn.Module):
     def __init__(self, config):
         super(CNN, self).__init__()
@@ -147,11 +212,16 @@ class RCNN(nn.Module):
     def __init__(self, config):
         super(RCNN, self).__init__()
         hidden_size = config["hidden_size"]
-        self.rnn = nn.RNN(hidden_size, hidden_size)
+        #输入一直是(batch_size, sen_len, hidden_size)，原先没有batch_first，会把batch维当作时间步
+        #改为batch_first后结果与旧版本不同，旧的rcnn/bert_rcnn模型需要重新训练
+        self.rnn = nn.RNN(hidden_size, hidden_size, batch_first=True)
         self.cnn = GatedCNN(config)
 
-    def forward(self, x):
-        x, _ = self.rnn(x)
+    def forward(self, x, lengths=None):
+        if lengths is None:
+            x, _ = self.rnn(x)
+        else:
+            x = run_packed(self.rnn, x, lengths)
         x = self.cnn(x)
         return x
 
@@ -161,8 +231,13 @@ class BertLSTM(nn.Module):
         self.bert = BertModel.from_pretrained(config["pretrain_model_path"], return_dict=False)
         self.rnn = nn.LSTM(self.bert.config.hidden_size, self.bert.config.hidden_size, batch_first=True)
 
-    def forward(self, x):
-        x = self.bert(x)[0]
+    def forward(self, x, attention_mask=None):
+        return self.head(self.backbone(x, attention_mask))
+
+    def backbone(self, x, attention_mask=None):
+        return self.bert(x, attention_mask=attention_mask)[0]
+
+    def head(self, x):
         x, _ = self.rnn(x)
         return x
 
@@ -173,10 +248,14 @@ class BertCNN(nn.Module):
         config["hidden_size"] = self.bert.config.hidden_size
         self.cnn = CNN(config)
 
-    def forward(self, x):
-        x = self.bert(x)[0]
-        x = self.cnn(x)
-        return x
+    def forward(self, x, attention_mask=None):
+        return self.head(self.backbone(x, attention_mask))
+
+    def backbone(self, x, attention_mask=None):
+        return self.bert(x, attention_mask=attention_mask)[0]
+
+    def head(self, x):
+        return self.cnn(x)
 
 class BertMidLayer(nn.Module):
     def __init__(self, config):
@@ -184,11 +263,17 @@ class BertMidLayer(nn.Module):
         self.bert = BertModel.from_pretrained(config["pretrain_model_path"], return_dict=False)
         self.bert.config.output_hidden_states = True
 
-    def forward(self, x):
-        layer_states = self.bert(x)[2]#(13, batch, len, hidden)
+    def forward(self, x, attention_mask=None):
+        return self.head(self.backbone(x, attention_mask))
+
+    def backbone(self, x, attention_mask=None):
+        layer_states = self.bert(x, attention_mask=attention_mask)[2]#(13, batch, len, hidden)
         layer_states = torch.add(layer_states[-2], layer_states[-1])
         return layer_states
 
+    def head(self, x):
+        return x
+
 
 #优化器的选择
 def choose_optimizer(config, model):
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import json
+import hashlib
+import time
+import random
+import logging
+import itertools
+import multiprocessing
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import Config
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""
+超参数网格搜索
+每组配置放到进程池中并行训练，每个worker限制torch线程数，避免多进程之间抢占cpu
+训练数据先在主进程中编码进预分词缓存，各worker通过mmap打开同一份缓存，不再重复编码
+每跑完一组就追加写入结果文件，中断后重新运行会跳过已经完成的配置
+"""
+
+search_space = {
+    "model_type": ["gated_cnn", "fast_text", "lstm"],
+    "learning_rate": [1e-3, 1e-4],
+    "hidden_size": [128, 256],
+    "batch_size": [64, 256],
+    "pooling_style": ["avg", "max"],
+}
+
+
+#展开成所有配置组合
+def expand_grid(space):
+    keys = list(space.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[space[key] for key in keys])]
+
+
+def trial_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+#读取已完成的配置，用于断点续跑
+def load_finished(result_path):
+    finished = {}
+    if not os.path.isfile(result_path):
+        return finished
+    with open(result_path, encoding="utf8") as f:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                #进程被杀时最后一行可能只写了一半，忽略
+                continue
+            finished[trial_key(record["params"])] = record
+    return finished
+
+
+def append_result(result_path, record):
+    with open(result_path, "a", encoding="utf8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+#在主进程中提前建好所有配置会用到的预分词缓存
+def prepare_token_cache(base_config, trials):
+    from loader import DataGenerator
+    prepared = set()
+    for params in trials:
+        config = copy.deepcopy(base_config)
+        config.update(params)
+        #bert和字表两种编码方式，以及不同max_length，各自对应一份缓存
+        key = (config["model_type"] == "bert", config["max_length"])
+        if key in prepared:
+            continue
+        DataGenerator(config["train_data_path"], config)
+        DataGenerator(config["valid_data_path"], config)
+        prepared.add(key)
+
+
+def init_worker(num_threads):
+    #worker中只保留警告以上的日志，避免多个进程的训练日志混在一起
+    logging.getLogger().setLevel(logging.WARNING)
+    torch.set_num_threads(num_threads)
+
+
+def run_trial(base_config, params):
+    from main import main
+    config = copy.deepcopy(base_config)
+    config.update(params)
+    #多个worker同时运行，不输出逐条预测结果，断点也各自保存到单独的目录，避免写同一个文件
+    config["valid_result_path"] = None
+    config["model_path"] = os.path.join(base_config["model_path"], "trial_" + hashlib.sha1(trial_key(params).encode("utf8")).hexdigest()[:8])
+    #每组配置单独设定随机种子，结果与在哪个worker上运行无关
+    random.seed(config["seed"])
+    np.random.seed(config["seed"])
+    torch.manual_seed(config["seed"])
+    start = time.time()
+    acc = main(config)
+    return {"params": params, "acc": float(acc), "seconds": time.time() - start}
+
+
+def grid_search(space, result_path="search_results.jsonl", excel_path="result.xlsx",
+                num_workers=None, threads_per_worker=1, base_config=None):
+    base_config = copy.deepcopy(Config if base_config is None else base_config)
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    trials = expand_grid(space)
+    finished = load_finished(result_path)
+    pending = [params for params in trials if trial_key(params) not in finished]
+    logger.info("共%d组配置，已完成%d组，待运行%d组" % (len(trials), len(trials) - len(pending), len(pending)))
+    if not os.path.isdir(base_config["model_path"]):
+        os.makedirs(base_config["model_path"], exist_ok=True)
+    if base_config.get("token_cache_dir"):
+        prepare_token_cache(base_config, pending)
+    #使用spawn启动worker，避免fork继承主进程中torch的线程池状态
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                             initializer=init_worker, initargs=(threads_per_worker,)) as pool:
+        futures = dict((pool.submit(run_trial, base_config, params), params) for params in pending)
+        for future in as_completed(futures):
+            params = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                #失败的配置不写入结果，下次运行会重新尝试
+                logger.error("配置%s运行失败：%s" % (trial_key(params), e))
+                continue
+            append_result(result_path, record)
+            finished[trial_key(params)] = record
+            logger.info("完成配置%s，准确率：%f，耗时%.1fs" % (trial_key(params), record["acc"], record["seconds"]))
+    write_excel(finished.values(), excel_path)
+    return finished
+
+
+#汇总成与之前相同格式的excel
+def write_excel(records, excel_path):
+    import pandas as pd
+    rows = []
+    for record in records:
+        row = dict(record["params"])
+        row["acc"] = record["acc"]
+        rows.append(row)
+    pd.DataFrame(rows).to_excel(excel_path, index=False)
+
+
+if __name__ == "__main__":
+    grid_search(search_space)
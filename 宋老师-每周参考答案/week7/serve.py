@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import logging
+import socketserver
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import torch
+from transformers import BertTokenizer
+from config import Config
+from loader import load_vocab, index_to_label
+from model import TorchModel
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""
+文本分类预测服务
+请求进入队列后按 最大batch大小 / 最长等待时间 攒成一个micro-batch，补齐到batch内最长样本后只做一次前向
+支持http端口或unix socket，/stats 返回p50/p99延迟和吞吐
+"""
+
+
+class Predictor:
+    def __init__(self, config, model_path):
+        self.config = config
+        self.vocab = load_vocab(config["vocab_path"])
+        self.config["vocab_size"] = len(self.vocab)
+        self.config["class_num"] = len(index_to_label)
+        if config["model_type"] == "bert":
+            self.tokenizer = BertTokenizer.from_pretrained(config["pretrain_model_path"])
+        model = TorchModel(config)
+        model.load_state_dict(torch.load(model_path, map_location="cpu"))
+        model.eval()
+        self.model = model
+
+    #与loader中的编码方式保持一致，只截断不补齐
+    def encode_sentence(self, text):
+        if self.config["model_type"] == "bert":
+            return self.tokenizer.encode(text, max_length=self.config["max_length"], truncation=True)
+        input_id = [self.vocab.get(char, self.vocab["[UNK]"]) for char in text]
+        return input_id[:self.config["max_length"]]
+
+    #一个batch只做一次前向，补齐到batch内最长样本
+    def predict_batch(self, texts):
+        input_ids = [self.encode_sentence(text) for text in texts]
+        max_len = max(1, max(len(input_id) for input_id in input_ids))
+        input_ids = torch.LongTensor([input_id + [0] * (max_len - len(input_id)) for input_id in input_ids])
+        with torch.no_grad():
+            pred = self.model(input_ids).view(len(texts), -1)
+            probs = torch.softmax(pred, dim=-1)
+        scores, labels = torch.max(probs, dim=-1)
+        return [{"label": index_to_label[int(label)], "score": float(score)} for label, score in zip(labels, scores)]
+
+
+#延迟和吞吐统计，只保留最近window条请求的延迟
+class LatencyStats:
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.request_count = 0
+        self.batch_count = 0
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+    def record_batch(self, latencies):
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.batch_sizes.append(len(latencies))
+            self.request_count += len(latencies)
+            self.batch_count += 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+            elapsed = time.time() - self.start_time
+            return {"requests": self.request_count,
+                    "batches": self.batch_count,
+                    "avg_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p99_ms": float(np.percentile(latencies, 99)),
+                    "throughput_qps": self.request_count / elapsed if elapsed > 0 else 0.0}
+
+
+class MicroBatcher:
+    def __init__(self, predictor, max_batch_size=32, max_wait_ms=5):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.stats = LatencyStats()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, text):
+        future = Future()
+        self.queue.put((text, future, time.time()))
+        return future
+
+    #第一条请求到达后开始计时，攒满max_batch_size或等到max_wait就执行
+    def loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            texts = [text for text, _, _ in batch]
+            try:
+                results = self.predictor.predict_batch(texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            now = time.time()
+            for (_, future, enqueue_time), result in zip(batch, results):
+                future.set_result(result)
+            self.stats.record_batch([now - enqueue_time for _, _, enqueue_time in batch])
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    batcher = None
+    request_timeout = 30  #等待预测结果的最长秒数，超时返回503
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.batcher.stats.snapshot())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    #请求体：{"text": "..."} 或 {"texts": ["...", "..."]}
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf8"))
+        except ValueError:
+            self.send_json(400, {"error": "invalid json"})
+            return
+        texts = self.parse_texts(request)
+        if texts is None:
+            self.send_json(400, {"error": "expected {\"text\": str} or {\"texts\": [str, ...]}"})
+            return
+        #同一请求中的多条文本分别入队，可以和其他请求的文本拼进同一个batch
+        futures = [self.batcher.submit(text) for text in texts]
+        deadline = time.time() + self.request_timeout
+        try:
+            results = [future.result(timeout=max(0, deadline - time.time())) for future in futures]
+        except FutureTimeoutError:
+            self.send_json(503, {"error": "prediction timed out"})
+            return
+        except Exception as e:
+            logger.exception("预测失败")
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, {"results": results})
+
+    #校验请求体，不合法时返回None
+    def parse_texts(self, request):
+        if not isinstance(request, dict):
+            return None
+        texts = request["texts"] if "texts" in request else [request.get("text", "")]
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return None
+        return texts
+
+    def address_string(self):
+        #unix socket没有客户端地址
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(config, model_path, host="127.0.0.1", port=8000, unix_socket=None,
+          max_batch_size=32, max_wait_ms=5, num_threads=None, request_timeout=30):
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    predictor = Predictor(config, model_path)
+    RequestHandler.batcher = MicroBatcher(predictor, max_batch_size, max_wait_ms)
+    RequestHandler.request_timeout = request_timeout
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, RequestHandler)
+        logger.info("服务启动，unix socket: %s" % unix_socket)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+        logger.info("服务启动，http://%s:%d" % (host, port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix_socket", default=None)
+    parser.add_argument("--max_batch_size", type=int, default=32)
+    parser.add_argument("--max_wait_ms", type=float, default=5)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--request_timeout", type=float, default=30)
+    args = parser.parse_args()
+    serve(Config, args.model_path, args.host, args.port, args.unix_socket,
+          args.max_batch_size, args.max_wait_ms, args.num_threads, args.request_timeout)
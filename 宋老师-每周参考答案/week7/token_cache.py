@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import numpy as np
+
+"""
+预分词缓存
+把整份语料编码一次，存成磁盘上的int32数组 + 偏移量，之后用mmap直接打开
+原文同样按utf8字节拼接存放，只在evaluator写出预测结果时才解码对应的句子
+缓存的key由 文件内容hash + 分词方式 + max_length 组成，任何一项变化都会重新编码
+"""
+
+
+#对文件内容做hash，按块读取，避免大文件一次性读入内存
+def file_hash(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def cache_key(data_path, tokenizer_name, max_length):
+    raw = "%s|%s|%d" % (file_hash(data_path), tokenizer_name, max_length)
+    return hashlib.sha1(raw.encode("utf8")).hexdigest()[:16]
+
+
+#按需解码的句子列表，支持 len、下标和切片
+class CachedSentences:
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self.blob[start:end]).decode("utf8")
+
+
+#空文件无法mmap，语料为空时返回空数组
+def open_memmap(path, dtype, size):
+    if size == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(size,))
+
+
+class TokenCache:
+    def __init__(self, cache_dir, key):
+        self.cache_dir = cache_dir
+        self.key = key
+        self.prefix = os.path.join(cache_dir, key)
+
+    def exists(self):
+        #旧版本的缓存没有.ids.bin，视为不存在，重新编码
+        return os.path.isfile(self.prefix + ".done") and os.path.isfile(self.prefix + ".ids.bin")
+
+    #samples: 可迭代的 (sentence, input_id, label)，input_id不做padding
+    def build(self, samples):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        labels, offsets, sentence_offsets = [], [0], [0]
+        #token和原文都流式写入裸二进制文件，加载时用np.memmap打开，不在内存中拼接整份语料
+        with open(self.prefix + ".ids.bin", "wb") as ids_file, open(self.prefix + ".sentences.bin", "wb") as text_file:
+            for sentence, input_id, label in samples:
+                ids_file.write(np.asarray(input_id, dtype=np.int32).tobytes())
+                offsets.append(offsets[-1] + len(input_id))
+                sentence = sentence.encode("utf8")
+                text_file.write(sentence)
+                sentence_offsets.append(sentence_offsets[-1] + len(sentence))
+                labels.append(label)
+        np.save(self.prefix + ".offsets.npy", np.asarray(offsets, dtype=np.int64))
+        np.save(self.prefix + ".sentence_offsets.npy", np.asarray(sentence_offsets, dtype=np.int64))
+        np.save(self.prefix + ".labels.npy", np.asarray(labels, dtype=np.int64))
+        #最后写标记文件，中途崩溃不会留下半成品缓存
+        open(self.prefix + ".done", "w").close()
+
+    def load(self):
+        self.offsets = np.load(self.prefix + ".offsets.npy", mmap_mode="r")
+        self.ids = open_memmap(self.prefix + ".ids.bin", np.int32, int(self.offsets[-1]))
+        self.labels = np.load(self.prefix + ".labels.npy", mmap_mode="r")
+        sentence_offsets = np.load(self.prefix + ".sentence_offsets.npy", mmap_mode="r")
+        blob = open_memmap(self.prefix + ".sentences.bin", np.uint8, int(sentence_offsets[-1]))
+        self.sentences = CachedSentences(blob, sentence_offsets)
+        return self
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    #返回未padding的input_id和label
+    def get(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return np.asarray(self.ids[start:end], dtype=np.int64), int(self.labels[index])
+
+
+if __name__ == "__main__":
+    from config import Config
+    key = cache_key(Config["valid_data_path"], "chars.txt", Config["max_length"])
+    print(key)
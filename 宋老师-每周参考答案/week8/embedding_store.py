@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import numpy as np
+
+"""
+知识库向量持久化
+按模型参数指纹分目录保存归一化后的知识库向量(memmap)、问题到标准问的映射，以及字表、schema的哈希
+模型和知识库都没变时直接打开文件；知识库追加问题时只对新问题做向量化
+"""
+
+
+def model_fingerprint(model):
+    sha1 = hashlib.sha1()
+    for name, tensor in sorted(model.state_dict().items()):
+        sha1.update(name.encode("utf8"))
+        sha1.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return sha1.hexdigest()
+
+
+def dict_hash(obj):
+    return hashlib.sha1(json.dumps(obj, ensure_ascii=False, sort_keys=True).encode("utf8")).hexdigest()
+
+
+#问题以编码后的id序列作为key，字表不变时同一问题的key不变
+def question_key(input_id):
+    return hashlib.sha1(np.asarray(input_id, dtype=np.int64).tobytes()).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self, store_dir, fingerprint, vocab_hash, schema_hash):
+        self.store_dir = os.path.join(store_dir, fingerprint[:16])
+        self.meta = {"fingerprint": fingerprint, "vocab_hash": vocab_hash, "schema_hash": schema_hash}
+
+    def path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    #返回已保存的向量、key和标准问编号；不存在或版本不一致时返回None
+    def load(self):
+        if not os.path.isfile(self.path("meta.json")):
+            return None
+        with open(self.path("meta.json"), encoding="utf8") as f:
+            meta = json.load(f)
+        if any(meta.get(key) != value for key, value in self.meta.items()):
+            return None
+        #copy-on-write映射，转成tensor时不需要拷贝整个文件
+        vectors = np.load(self.path("vectors.npy"), mmap_mode="c")
+        keys = [key.decode("ascii") for key in np.load(self.path("keys.npy")).tolist()]
+        standard_indices = np.load(self.path("standard_indices.npy"))
+        if len(vectors) != meta["count"] or len(keys) != meta["count"]:
+            return None
+        return {"vectors": vectors, "keys": keys, "standard_indices": standard_indices}
+
+    #keys与standard_indices描述当前知识库；encode_fn(positions)返回这些位置上问题的归一化向量(numpy)
+    def sync(self, keys, standard_indices, encode_fn, chunk_size=65536):
+        standard_indices = np.asarray(standard_indices, dtype=np.int64)
+        cached = self.load()
+        if cached is not None and cached["keys"] == keys and np.array_equal(cached["standard_indices"], standard_indices):
+            return cached["vectors"], 0
+        row_of = {} if cached is None else dict((key, row) for row, key in enumerate(cached["keys"]))
+        reuse = [(position, row_of[key]) for position, key in enumerate(keys) if key in row_of]
+        missing = [position for position, key in enumerate(keys) if key not in row_of]
+        new_vectors = encode_fn(missing) if missing else None
+        dim = new_vectors.shape[1] if new_vectors is not None else cached["vectors"].shape[1]
+        os.makedirs(self.store_dir, exist_ok=True)
+        #先删除meta使旧版本失效，写完全部数据后再写meta
+        if os.path.isfile(self.path("meta.json")):
+            os.remove(self.path("meta.json"))
+        vectors = np.lib.format.open_memmap(self.path("vectors.npy.tmp"), mode="w+", dtype=np.float32,
+                                            shape=(len(keys), dim))
+        for start in range(0, len(reuse), chunk_size):
+            positions, rows = zip(*reuse[start:start + chunk_size])
+            vectors[list(positions)] = cached["vectors"][list(rows)]
+        if missing:
+            vectors[missing] = new_vectors
+        vectors.flush()
+        del vectors, cached
+        os.replace(self.path("vectors.npy.tmp"), self.path("vectors.npy"))
+        np.save(self.path("keys.npy"), np.array(keys, dtype="S40"))
+        np.save(self.path("standard_indices.npy"), standard_indices)
+        with open(self.path("meta.json"), "w", encoding="utf8") as f:
+            json.dump(dict(self.meta, count=len(keys), dim=int(dim)), f)
+        return self.load()["vectors"], len(missing)
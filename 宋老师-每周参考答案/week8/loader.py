@@ -3,12 +3,18 @@
 import json
 import re
 import os
+import sys
 import torch
 import random
 import jieba
 import numpy as np
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler
+from torch.nn.utils.rnn import pad_sequence
 from collections import defaultdict
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.batching import pad_collate
+from common.segmentation import Segmenter
+from vector_index import FlatIndex
 """
 数据加载
 """
@@ -21,6 +27,10 @@ class DataGenerator:
         self.vocab = load_vocab(config["vocab_path"])
         self.config["vocab_size"] = len(self.vocab)
         self.schema = load_schema(config["schema_path"])
+        #使用词表时需要分词，分词结果按文本缓存
+        self.segmenter = None
+        if self.config["vocab_path"] == "words.txt":
+            self.segmenter = Segmenter(config.get("segment_cache_path"))
         self.train_data_size = config["epoch_data_size"] #由于采取随机采样，所以需要设定一个采样数量，否则可以一直采
         self.data_type = None  #用来标识加载的是训练集还是测试集 "train" or "test"
         self.load()
@@ -29,32 +39,37 @@ class DataGenerator:
         self.data = []
         self.knwb = defaultdict(list)
         with open(self.path, encoding="utf8") as f:
-            for line in f:
-                line = json.loads(line)
-                #加载训练集
-                if isinstance(line, dict):
-                    self.data_type = "train"
-                    questions = line["questions"]
-                    label = line["target"]
-                    for question in questions:
-                        input_id = self.encode_sentence(question)
-                        input_id = torch.LongTensor(input_id)
-                        self.knwb[self.schema[label]].append(input_id)
-                #加载测试集
-                else:
-                    self.data_type = "test"
-                    assert isinstance(line, list)
-                    question, label = line
+            lines = [json.loads(line) for line in f]
+        if self.segmenter is not None:
+            #整个文件先批量分词，之后编码时直接读缓存
+            texts = [question for line in lines
+                     for question in (line["questions"] if isinstance(line, dict) else line[:1])]
+            self.segmenter.segment_all(texts)
+        for line in lines:
+            #加载训练集
+            if isinstance(line, dict):
+                self.data_type = "train"
+                questions = line["questions"]
+                label = line["target"]
+                for question in questions:
                     input_id = self.encode_sentence(question)
                     input_id = torch.LongTensor(input_id)
-                    label_index = torch.LongTensor([self.schema[label]])
-                    self.data.append([input_id, label_index])
+                    self.knwb[self.schema[label]].append(input_id)
+            #加载测试集
+            else:
+                self.data_type = "test"
+                assert isinstance(line, list)
+                question, label = line
+                input_id = self.encode_sentence(question)
+                input_id = torch.LongTensor(input_id)
+                label_index = torch.LongTensor([self.schema[label]])
+                self.data.append([input_id, label_index])
         return
 
     def encode_sentence(self, text):
         input_id = []
         if self.config["vocab_path"] == "words.txt":
-            for word in jieba.cut(text):
+            for word in self.segmenter.cut(text):
                 input_id.append(self.vocab.get(word, self.vocab["[UNK]"]))
         else:
             for char in text:
@@ -65,6 +80,9 @@ class DataGenerator:
     #补齐或截断输入的序列，使其可以在一个batch内运算
     def padding(self, input_id):
         input_id = input_id[:self.config["max_length"]]
+        #动态padding时只截断，补齐留到组batch时进行
+        if self.config.get("dynamic_padding"):
+            return input_id
         input_id += [0] * (self.config["max_length"] - len(input_id))
         return input_id
 
@@ -99,6 +117,123 @@ class DataGenerator:
         return [s1, s2, s3]
 
 
+#把知识库展开成 [问题, 标准问编号] 的列表，配合PKBatchSampler按batch采样
+class KnwbDataset(Dataset):
+    def __init__(self, knwb):
+        self.data = []
+        self.labels = []
+        for standard_question_index, question_ids in knwb.items():
+            for question_id in question_ids:
+                self.data.append([question_id, torch.LongTensor([standard_question_index])])
+                self.labels.append(standard_question_index)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+
+#每个batch选P个标准问，每个标准问下取K个问题
+#batch内每个句子只编码一次，由模型在batch内组出所有三元组
+#传入miner时，一部分标准问选为与已选标准问最容易混淆的标准问，使batch内的负样本更难
+class PKBatchSampler(Sampler):
+    def __init__(self, labels, p, k, batch_num, miner=None, refresh_steps=100, hard_rate=0.5):
+        self.index_by_label = defaultdict(list)
+        for index, label in enumerate(labels):
+            self.index_by_label[label].append(index)
+        #只有至少两个问题的标准问能提供正样本对
+        self.anchor_labels = [label for label, indices in self.index_by_label.items() if len(indices) >= 2]
+        self.p = min(p, len(self.index_by_label))
+        self.k = k
+        self.batch_num = batch_num
+        self.miner = miner
+        self.refresh_steps = refresh_steps
+        self.hard_rate = hard_rate
+
+    def __len__(self):
+        return self.batch_num
+
+    def __iter__(self):
+        for step in range(self.batch_num):
+            #模型参数在不断变化，每隔refresh_steps个batch重新计算一次知识库向量
+            if self.miner is not None and step % self.refresh_steps == 0:
+                self.miner.refresh()
+            yield self.sample_batch()
+
+    def sample_batch(self):
+        hard_num = int(self.p * self.hard_rate) if self.miner is not None else 0
+        seed_num = max(1, min(self.p - hard_num, len(self.anchor_labels)))
+        labels = random.sample(self.anchor_labels, seed_num)
+        for seed in labels[:hard_num]:
+            if len(labels) >= self.p:
+                break
+            hard_label = self.miner.confusable_label(seed, exclude=set(labels))
+            if hard_label is not None:
+                labels.append(hard_label)
+        #难负样本不足时用随机标准问补齐
+        rest = [label for label in self.index_by_label if label not in set(labels)]
+        labels += random.sample(rest, min(self.p - len(labels), len(rest)))
+        batch = []
+        for label in labels:
+            indices = self.index_by_label[label]
+            batch += random.sample(indices, min(self.k, len(indices)))
+        return batch
+
+
+#用当前模型给知识库建立向量索引，查找与某个标准问最容易混淆的其他标准问
+class HardNegativeMiner:
+    def __init__(self, model, dataset, top_n=10, batch_size=256):
+        self.model = model
+        self.dataset = dataset
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.index = None
+        self.index_by_label = defaultdict(list)
+        for index, label in enumerate(dataset.labels):
+            self.index_by_label[label].append(index)
+
+    def refresh(self):
+        was_training = self.model.training
+        self.model.eval()
+        device = next(self.model.parameters()).device
+        vectors = []
+        with torch.no_grad():
+            for start in range(0, len(self.dataset), self.batch_size):
+                input_ids = [question_id for question_id, _ in self.dataset.data[start:start + self.batch_size]]
+                input_ids = pad_sequence(input_ids, batch_first=True).to(device)
+                vector = self.model(input_ids).view(len(input_ids), -1)
+                vectors.append(torch.nn.functional.normalize(vector, dim=-1).cpu().numpy())
+        self.index = FlatIndex().build(np.concatenate(vectors))
+        self.model.train(was_training)
+
+    #随机取该标准问下的一个问题，返回最近邻中第一个属于其他标准问的标签
+    def confusable_label(self, label, exclude=()):
+        labels = self.dataset.labels
+        question_index = random.choice(self.index_by_label[label])
+        _, ids = self.index.search(self.index.vectors[question_index], self.top_n)
+        for neighbor in ids[0].tolist():
+            if neighbor >= 0 and labels[neighbor] != label and labels[neighbor] not in exclude:
+                return labels[neighbor]
+        return None
+
+
+#加载知识库，按P个标准问 x K个问题组batch
+#传入model且配置hard_negative时，使用模型向量挖掘难负样本
+def load_pk_data(data_path, config, model=None):
+    dg = DataGenerator(data_path, config)
+    dataset = KnwbDataset(dg.knwb)
+    miner = None
+    if model is not None and config.get("hard_negative"):
+        miner = HardNegativeMiner(model, dataset)
+    #batch数与逐条采样三元组时相同，每个batch内的三元组数量远多于batch_size
+    batch_num = (config["epoch_data_size"] + config["batch_size"] - 1) // config["batch_size"]
+    sampler = PKBatchSampler(dataset.labels, config.get("pk_intents", 8), config.get("pk_questions", 4),
+                             batch_num, miner, config.get("hard_negative_refresh_steps", 100))
+    dl = DataLoader(dataset, batch_sampler=sampler, collate_fn=pad_collate((0, 0)))
+    return dl
+
+
 #加载字表或词表
 def load_vocab(vocab_path):
     token_dict = {}
@@ -116,7 +251,11 @@ def load_schema(schema_path):
 #用torch自带的DataLoader类封装数据
 def load_data(data_path, config, shuffle=True):
     dg = DataGenerator(data_path, config)
-    dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle)
+    if not config.get("dynamic_padding"):
+        dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle)
+        return dl
+    #训练样本是随机采样的三元组，无法预先分桶，只做batch内补齐；a/p/n三个字段各自补齐
+    dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle, collate_fn=pad_collate((0, 0, 0)))
     return dl
 
 
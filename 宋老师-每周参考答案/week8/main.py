@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import logging
+import numpy as np
+import torch
+from config import Config
+from model import SiameseNetwork, choose_optimizer
+from loader import load_data, load_pk_data
+from predict import Predictor
+
+logging.basicConfig(level = logging.INFO,format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""
+模型训练主程序
+每个batch为P个标准问 x K个问题，batch内构造三元组计算loss(model.batch_triplet_loss)，
+配置hard_negative时由HardNegativeMiner按当前模型向量挑选最易混淆的标准问放进同一batch
+三元组取法和margin见配置中的triplet_mining、triplet_margin
+"""
+
+
+#验证集每行为 [问题, 标准问]，统计top1准确率
+def evaluate(config, model, knwb_data, epoch):
+    predictor = Predictor(config, model, knwb_data)
+    with open(config["valid_data_path"], encoding="utf8") as f:
+        valid = [json.loads(line) for line in f if line.strip()]
+    results = predictor.predict_batch([question for question, _ in valid], k=1)
+    correct = sum(int(result[0][0] == label) for result, (_, label) in zip(results, valid))
+    logger.info("第%d轮 验证集条目总量：%d，top1准确率：%f" % (epoch, len(valid), correct / len(valid)))
+    return correct / len(valid)
+
+
+def main(config):
+    #创建保存模型的目录
+    if not os.path.isdir(config["model_path"]):
+        os.mkdir(config["model_path"])
+    #字表大小在加载数据时写入config，需要在建模型之前加载；知识库同时用于每轮的验证
+    knwb_data = load_data(config["train_data_path"], config)
+    model = SiameseNetwork(config)
+    cuda_flag = torch.cuda.is_available()
+    if cuda_flag:
+        logger.info("gpu可以使用，迁移模型至gpu")
+        model = model.cuda()
+    #传入模型，难负样本挖掘使用当前参数计算向量
+    train_data = load_pk_data(config["train_data_path"], config, model)
+    optimizer = choose_optimizer(config, model)
+    for epoch in range(1, config["epoch"] + 1):
+        model.train()
+        logger.info("epoch %d begin" % epoch)
+        train_loss = []
+        for input_ids, labels in train_data:
+            optimizer.zero_grad()
+            if cuda_flag:
+                input_ids, labels = input_ids.cuda(), labels.cuda()
+            loss = model(input_ids, labels=labels)
+            loss.backward()
+            optimizer.step()
+            train_loss.append(loss.item())
+        logger.info("epoch average loss: %f" % np.mean(train_loss))
+        if config.get("valid_data_path"):
+            evaluate(config, model, knwb_data, epoch)
+    model_path = os.path.join(config["model_path"], "epoch_%d.pth" % config["epoch"])
+    torch.save(model.state_dict(), model_path)
+    return model
+
+
+if __name__ == "__main__":
+    main(Config)
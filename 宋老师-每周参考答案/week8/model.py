@@ -18,15 +18,23 @@ class SentenceEncoder(nn.Module):
         # self.layer = nn.LSTM(hidden_size, hidden_size, batch_first=True, bidirectional=True)
         self.layer = nn.Linear(hidden_size, hidden_size)
         self.dropout = nn.Dropout(0.5)
+        #padding位置是否参与max pooling，动态padding时默认开启；固定padding保持原有结果
+        self.mask_pooling = config.get("mask_pooling", bool(config.get("dynamic_padding")))
 
     #输入为问题字符编码
-    def forward(self, x):
+    #mask为attention mask，传入或开启mask_pooling时padding位置不参与max pooling
+    def forward(self, x, mask=None):
+        if mask is None and self.mask_pooling:
+            mask = x.gt(0)
         sentence_length = torch.sum(x.gt(0), dim=-1)
         x = self.embedding(x)
         #使用lstm
         # x, _ = self.layer(x)
         #使用线性层
         x = self.layer(x)
+        #避免结果受batch内补齐长度影响
+        if mask is not None:
+            x = x.masked_fill(~mask.unsqueeze(-1), -1e4)
         x = nn.functional.max_pool1d(x.transpose(1, 2), x.shape[1]).squeeze()
         return x
 
@@ -36,6 +44,10 @@ class SiameseNetwork(nn.Module):
         super(SiameseNetwork, self).__init__()
         self.sentence_encoder = SentenceEncoder(config)
         self.loss = nn.CosineEmbeddingLoss()
+        #batch内三元组的取法："hard" 每个anchor取最难的正负样本，"all" 使用所有合法三元组
+        self.triplet_mining = config.get("triplet_mining", "hard")
+        assert self.triplet_mining in ("hard", "all"), self.triplet_mining
+        self.triplet_margin = config.get("triplet_margin", 0.1)
 
     # 计算余弦距离  1-cos(a,b)
     # cos=1时两个向量相同，余弦距离为0；cos=0时，两个向量正交，余弦距离为1
@@ -54,8 +66,35 @@ class SiameseNetwork(nn.Module):
             diff = ap - an + margin.squeeze()
         return torch.mean(diff[diff.gt(0)]) # greater than 0
 
+    #batch内的三元组loss，vectors: (batch_size, hidden_size)，labels: (batch_size,)
+    #标准问相同的为正样本对，不同的为负样本；hard=True时每个anchor只取最远的正样本和最近的负样本，否则使用所有合法三元组
+    def batch_triplet_loss(self, vectors, labels, margin=0.1, hard=True):
+        vectors = torch.nn.functional.normalize(vectors, dim=-1)
+        distance = 1 - torch.mm(vectors, vectors.T)
+        same = labels.unsqueeze(0) == labels.unsqueeze(1)
+        eye = torch.eye(len(labels), dtype=torch.bool, device=labels.device)
+        positive_mask = same & ~eye
+        negative_mask = ~same
+        if hard:
+            hardest_positive = distance.masked_fill(~positive_mask, float("-inf")).max(dim=1)[0]
+            hardest_negative = distance.masked_fill(~negative_mask, float("inf")).min(dim=1)[0]
+            valid = positive_mask.any(dim=1) & negative_mask.any(dim=1)
+            diff = (hardest_positive - hardest_negative + margin)[valid]
+        else:
+            #diff[a, p, n] = d(a, p) - d(a, n) + margin
+            diff = distance.unsqueeze(2) - distance.unsqueeze(1) + margin
+            diff = diff[positive_mask.unsqueeze(2) & negative_mask.unsqueeze(1)]
+        diff = diff[diff.gt(0)]
+        if len(diff) == 0:
+            return vectors.sum() * 0
+        return torch.mean(diff)
+
     #sentence : (batch_size, max_length)
-    def forward(self, sentence1, sentence2=None, sentence3=None):
+    #传入labels时，sentence1为P个标准问 x K个问题组成的batch，每个句子只编码一次
+    def forward(self, sentence1, sentence2=None, sentence3=None, labels=None):
+        if labels is not None:
+            vectors = self.sentence_encoder(sentence1).view(len(sentence1), -1)
+            return self.batch_triplet_loss(vectors, labels.view(-1), self.triplet_margin, self.triplet_mining == "hard")
         #同时传入3个句子,则做tripletloss的loss计算
         if sentence2 is not None and sentence3 is not None:
             vector1 = self.sentence_encoder(sentence1)
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 import torch
+from torch.nn.utils.rnn import pad_sequence
 from loader import load_data
 from config import Config
 from model import SiameseNetwork, choose_optimizer
+from vector_index import build_index
+from embedding_store import EmbeddingStore, model_fingerprint, dict_hash, question_key
 
 """
 模型效果测试
@@ -22,10 +25,13 @@ class Predictor:
 
     #将知识库中的问题向量化，为匹配做准备
     #每轮训练的模型参数不一样，生成的向量也不一样，所以需要每轮测试都重新进行向量化
+    #配置了embedding_store_dir时，按模型参数指纹保存向量，模型和知识库不变时直接读取
     def knwb_to_vector(self):
         self.question_index_to_standard_question_index = {}
         self.question_ids = []
         self.vocab = self.train_data.dataset.vocab
+        #与loader共用分词器，jieba词典在加载数据时已经初始化，线上请求走LRU缓存
+        self.segmenter = self.train_data.dataset.segmenter
         self.schema = self.train_data.dataset.schema
         self.index_to_standard_question = dict((y, x) for x, y in self.schema.items())
         for standard_question_index, question_ids in self.train_data.dataset.knwb.items():
@@ -33,19 +39,53 @@ class Predictor:
                 #记录问题编号到标准问题标号的映射，用来确认答案是否正确
                 self.question_index_to_standard_question_index[len(self.question_ids)] = standard_question_index
                 self.question_ids.append(question_id)
+        #问题编号到标准问编号的映射向量，用于批量预测时按意图合并分数
+        self.question_to_standard_question = torch.LongTensor(
+            [self.question_index_to_standard_question_index[i] for i in range(len(self.question_ids))])
+        if self.config.get("embedding_store_dir"):
+            self.knwb_vectors = self.load_knwb_vectors()
+        else:
+            self.knwb_vectors = self.encode_questions(self.question_ids)
+        self.build_index()
+        return
+
+    def encode_questions(self, question_ids, batch_size=1024):
+        vectors = []
         with torch.no_grad():
-            question_matrixs = torch.stack(self.question_ids, dim=0)
-            if torch.cuda.is_available():
-                question_matrixs = question_matrixs.cuda()
-            self.knwb_vectors = self.model(question_matrixs)
-            #将所有向量都作归一化 v / |v|
-            self.knwb_vectors = torch.nn.functional.normalize(self.knwb_vectors, dim=-1)
+            for start in range(0, len(question_ids), batch_size):
+                #动态padding时知识库问题长度不一，补齐到最长问题
+                question_matrixs = pad_sequence(question_ids[start:start + batch_size], batch_first=True)
+                if torch.cuda.is_available():
+                    question_matrixs = question_matrixs.cuda()
+                vector = self.model(question_matrixs).view(len(question_matrixs), -1)
+                #将所有向量都作归一化 v / |v|
+                vectors.append(torch.nn.functional.normalize(vector, dim=-1))
+        return torch.cat(vectors)
+
+    #从向量库读取知识库向量，只对库中没有的问题做向量化
+    def load_knwb_vectors(self):
+        store = EmbeddingStore(self.config["embedding_store_dir"], model_fingerprint(self.model),
+                               dict_hash(self.vocab), dict_hash(self.schema))
+        keys = [question_key(question_id.numpy()) for question_id in self.question_ids]
+        encode_fn = lambda positions: self.encode_questions([self.question_ids[i] for i in positions]).cpu().numpy()
+        vectors, encoded_num = store.sync(keys, self.question_to_standard_question.numpy(), encode_fn)
+        print("知识库共%d条问题，重新向量化%d条" % (len(keys), encoded_num))
+        knwb_vectors = torch.from_numpy(vectors)
+        if torch.cuda.is_available():
+            knwb_vectors = knwb_vectors.cuda()
+        return knwb_vectors
+
+    #知识库向量建立检索索引，index_type可选 flat(精确) / ivf / hnsw，默认flat与逐条内积结果相同
+    def build_index(self):
+        index_type = self.config.get("index_type", "flat")
+        index_params = self.config.get("index_params", {})
+        self.index = build_index(index_type, self.knwb_vectors.cpu().numpy(), **index_params)
         return
 
     def encode_sentence(self, text):
         input_id = []
         if self.config["vocab_path"] == "words.txt":
-            for word in jieba.cut(text):
+            for word in self.segmenter.cut(text):
                 input_id.append(self.vocab.get(word, self.vocab["[UNK]"]))
         else:
             for char in text:
@@ -59,11 +99,42 @@ class Predictor:
             input_id = input_id.cuda()
         with torch.no_grad():
             test_question_vector = self.model(input_id) #不输入labels，使用模型当前参数进行预测
-            res = torch.mm(test_question_vector.unsqueeze(0), self.knwb_vectors.T)
-            hit_index = int(torch.argmax(res.squeeze())) #命中问题标号
+            test_question_vector = torch.nn.functional.normalize(test_question_vector, dim=-1)
+            _, hit_ids = self.index.search(test_question_vector.cpu().numpy(), 1)
+            hit_index = int(hit_ids[0][0]) #命中问题标号
             hit_index = self.question_index_to_standard_question_index[hit_index] #转化成标准问编号 
         return  self.index_to_standard_question[hit_index]
 
+    #批量预测，每条问题返回得分最高的k个标准问及相似度
+    #同一标准问下的多个问法只保留相似度最高的一个
+    def predict_batch(self, sentences, k=1, batch_size=512):
+        knwb_vectors = self.knwb_vectors
+        question_to_standard_question = self.question_to_standard_question.to(knwb_vectors.device)
+        standard_question_num = len(self.index_to_standard_question)
+        k = min(k, standard_question_num)
+        results = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            input_ids = [torch.LongTensor(self.encode_sentence(sentence)[:self.config["max_length"]]) for sentence in batch]
+            #空句子至少保留一个位置，避免整行都是padding
+            input_ids = [input_id if len(input_id) else torch.LongTensor([0]) for input_id in input_ids]
+            input_ids = pad_sequence(input_ids, batch_first=True)
+            if torch.cuda.is_available():
+                input_ids = input_ids.cuda()
+            with torch.no_grad():
+                vectors = self.model(input_ids).view(len(batch), -1)
+                vectors = torch.nn.functional.normalize(vectors, dim=-1)
+                scores = torch.mm(vectors, knwb_vectors.T)
+                #按标准问取最大值：(batch, 问题数) -> (batch, 标准问数)
+                standard_scores = torch.full((len(batch), standard_question_num), float("-inf"), device=scores.device)
+                standard_scores = standard_scores.scatter_reduce(1, question_to_standard_question.expand(len(batch), -1),
+                                                                 scores, reduce="amax")
+                top_scores, top_index = torch.topk(standard_scores, k, dim=-1)
+            for row_scores, row_index in zip(top_scores.tolist(), top_index.tolist()):
+                results.append([(self.index_to_standard_question[index], score)
+                                for index, score in zip(row_index, row_scores)])
+        return results
+
 if __name__ == "__main__":
     knwb_data = load_data(Config["train_data_path"], Config)
     model = SiameseNetwork(Config)
@@ -72,4 +143,5 @@ if __name__ == "__main__":
     sentence = "固定宽带服务密码修改"
     res = pd.predict(sentence)
     print(res)
+    print(pd.predict_batch([sentence, "话费是否包月超了"], k=3))
 
@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import time
+import heapq
+import numpy as np
+
+"""
+知识库向量索引
+向量都经过归一化，用内积作为相似度(即余弦相似度)
+flat：精确检索，逐条计算内积
+ivf：先用k-means把向量聚成nlist个簇，检索时只计算离问题最近的nprobe个簇内的向量
+hnsw：分层可导航小世界图，从顶层入口点贪心地逐层向下搜索
+pq：乘积量化，向量切成m段，每段用256个中心的码本编码成1个字节，检索时查表计算内积，不保存原始向量
+各索引接口一致：build / add / search(queries, k) / save / load
+"""
+
+
+def as_matrix(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors
+
+
+#取每行分数最高的k个，按分数从高到低排列
+def topk(scores, k):
+    k = min(k, scores.shape[-1])
+    if k == 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.float32), np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+    index = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    part = np.take_along_axis(scores, index, axis=-1)
+    order = np.argsort(-part, axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1), np.take_along_axis(index, order, axis=-1)
+
+
+#结果不足k个时，分数补-inf，编号补-1
+def pad_result(scores, ids, k):
+    scores = np.concatenate([scores, np.full(k - len(scores), -np.inf, dtype=np.float32)])
+    ids = np.concatenate([ids, np.full(k - len(ids), -1, dtype=np.int64)])
+    return scores, ids
+
+
+class VectorIndex:
+    index_type = None
+
+    def __init__(self):
+        self.vectors = None
+
+    def __len__(self):
+        return 0 if self.vectors is None else len(self.vectors)
+
+    def build(self, vectors):
+        self.vectors = None
+        self.add(vectors)
+        return self
+
+    def add(self, vectors):
+        raise NotImplementedError
+
+    #queries: (query_num, dim)，返回 scores, ids，形状均为 (query_num, k)
+    def search(self, queries, k=1):
+        raise NotImplementedError
+
+    def params(self):
+        return {}
+
+    #索引占用的内存(字节)
+    def memory_bytes(self):
+        return sum(value.nbytes for value in self.arrays().values() if value is not None)
+
+    def arrays(self):
+        return {"vectors": self.vectors}
+
+    def restore(self, data):
+        self.vectors = data["vectors"]
+
+    def save(self, path):
+        meta = {"index_type": self.index_type, "params": self.params()}
+        arrays = dict((key, value) for key, value in self.arrays().items() if value is not None)
+        with open(path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            index = INDEX_TYPES[meta["index_type"]](**meta["params"])
+            index.restore(dict((key, data[key]) for key in data.files if key != "meta"))
+        return index
+
+
+class FlatIndex(VectorIndex):
+    index_type = "flat"
+
+    def __init__(self, chunk_size=1024):
+        super(FlatIndex, self).__init__()
+        self.chunk_size = chunk_size
+
+    def add(self, vectors):
+        vectors = as_matrix(vectors)
+        self.vectors = vectors if self.vectors is None else np.concatenate([self.vectors, vectors])
+
+    def search(self, queries, k=1):
+        queries = as_matrix(queries)
+        all_scores, all_ids = [], []
+        #按块计算，避免问题数量很多时分数矩阵过大
+        for start in range(0, len(queries), self.chunk_size):
+            scores, ids = topk(queries[start:start + self.chunk_size] @ self.vectors.T, k)
+            all_scores.append(scores)
+            all_ids.append(ids)
+        scores, ids = np.concatenate(all_scores), np.concatenate(all_ids)
+        if scores.shape[1] < k:
+            padded = [pad_result(s, i, k) for s, i in zip(scores, ids)]
+            scores, ids = np.stack([s for s, _ in padded]), np.stack([i for _, i in padded])
+        return scores, ids
+
+    def params(self):
+        return {"chunk_size": self.chunk_size}
+
+
+#球面k-means：向量和簇中心都是单位向量，按内积分配
+def spherical_kmeans(vectors, n_clusters, n_iter=20, seed=0, chunk_size=65536):
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = assign_clusters(vectors, centroids, chunk_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=n_clusters)
+        #空簇随机选一个向量重新初始化
+        empty = np.where(counts == 0)[0]
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+def assign_clusters(vectors, centroids, chunk_size=65536):
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        assign[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return assign
+
+
+class IVFIndex(VectorIndex):
+    index_type = "ivf"
+
+    def __init__(self, nlist=100, nprobe=8, n_iter=20, train_size=256, seed=0):
+        super(IVFIndex, self).__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.train_size = train_size  #每个簇平均使用多少个样本训练k-means
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+
+    #用采样的向量训练粗量化器，之后add的向量只分配到已有的簇
+    def train(self, vectors):
+        vectors = as_matrix(vectors)
+        nlist = min(self.nlist, len(vectors))
+        sample_num = min(len(vectors), nlist * self.train_size)
+        rng = np.random.RandomState(self.seed)
+        sample = vectors[rng.choice(len(vectors), sample_num, replace=False)]
+        self.centroids = spherical_kmeans(sample, nlist, self.n_iter, self.seed)
+        self.lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+
+    def build(self, vectors):
+        self.vectors = None
+        self.train(vectors)
+        self.add(vectors)
+        return self
+
+    def add(self, vectors):
+        vectors = as_matrix(vectors)
+        if self.centroids is None:
+            self.train(vectors)
+        start = len(self)
+        assign = assign_clusters(vectors, self.centroids)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1))
+        for list_id in range(len(self.centroids)):
+            new_ids = order[bounds[list_id]:bounds[list_id + 1]] + start
+            if len(new_ids):
+                self.lists[list_id] = np.concatenate([self.lists[list_id], new_ids])
+        self.vectors = vectors if self.vectors is None else np.concatenate([self.vectors, vectors])
+
+    def search(self, queries, k=1):
+        queries = as_matrix(queries)
+        nprobe = min(self.nprobe, len(self.centroids))
+        _, probes = topk(queries @ self.centroids.T, nprobe)
+        all_scores, all_ids = [], []
+        for query, probe in zip(queries, probes):
+            candidates = np.concatenate([self.lists[list_id] for list_id in probe])
+            scores, index = topk(self.vectors[candidates] @ query, k)
+            scores, ids = pad_result(scores, candidates[index], k)
+            all_scores.append(scores)
+            all_ids.append(ids)
+        return np.stack(all_scores), np.stack(all_ids)
+
+    def params(self):
+        return {"nlist": self.nlist, "nprobe": self.nprobe, "n_iter": self.n_iter,
+                "train_size": self.train_size, "seed": self.seed}
+
+    #倒排表拼接成一个数组，另存每个簇的起始位置
+    def arrays(self):
+        return {"vectors": self.vectors,
+                "centroids": self.centroids,
+                "list_ids": np.concatenate(self.lists) if self.lists else np.zeros(0, dtype=np.int64),
+                "list_offsets": np.cumsum([0] + [len(ids) for ids in self.lists])}
+
+    def restore(self, data):
+        self.vectors = data.get("vectors")
+        self.centroids = data.get("centroids")
+        if self.centroids is not None:
+            offsets, ids = data["list_offsets"], data["list_ids"]
+            self.lists = [ids[offsets[i]:offsets[i + 1]] for i in range(len(self.centroids))]
+
+
+class HNSWIndex(VectorIndex):
+    index_type = "hnsw"
+
+    def __init__(self, M=16, ef_construction=100, ef_search=50, seed=0):
+        super(HNSWIndex, self).__init__()
+        self.M = M                  #每个节点在上层的最大连接数，第0层为2M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self.level_mult = 1 / math.log(M)
+        self.reset()
+
+    def reset(self):
+        self.vectors = None
+        self.rng = np.random.RandomState(self.seed)
+        self.levels = []
+        self.graph = []             #graph[level][node] = 邻居列表
+        self.entry_point = None
+        self.max_level = -1
+
+    def build(self, vectors):
+        self.reset()
+        self.add(vectors)
+        return self
+
+    def add(self, vectors):
+        vectors = as_matrix(vectors)
+        start = len(self)
+        self.vectors = vectors if self.vectors is None else np.concatenate([self.vectors, vectors])
+        for node in range(start, len(self.vectors)):
+            self.insert(node)
+
+    def insert(self, node):
+        query = self.vectors[node]
+        level = int(-math.log(1 - self.rng.random_sample()) * self.level_mult)
+        self.levels.append(level)
+        while len(self.graph) <= level:
+            self.graph.append({})
+        for l in range(level + 1):
+            self.graph[l][node] = []
+        if self.entry_point is None:
+            self.entry_point, self.max_level = node, level
+            return
+        #高于新节点层数的部分只做贪心搜索，找到下一层的入口
+        entry = [self.entry_point]
+        for l in range(self.max_level, level, -1):
+            entry = [self.search_layer(query, entry, 1, l)[0][1]]
+        for l in range(min(level, self.max_level), -1, -1):
+            candidates = self.search_layer(query, entry, self.ef_construction, l)
+            neighbors = [n for _, n in candidates[:self.M]]
+            self.graph[l][node] = neighbors
+            max_links = 2 * self.M if l == 0 else self.M
+            for neighbor in neighbors:
+                links = self.graph[l][neighbor]
+                links.append(node)
+                #邻居的连接数超过上限时，只保留与它最相似的max_links个
+                if len(links) > max_links:
+                    scores = self.vectors[links] @ self.vectors[neighbor]
+                    keep = np.argsort(-scores, kind="stable")[:max_links]
+                    self.graph[l][neighbor] = [links[i] for i in keep]
+            entry = [n for _, n in candidates]
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    #在某一层上做best-first搜索，返回按相似度从高到低排列的 (score, node)
+    def search_layer(self, query, entry_points, ef, level):
+        graph = self.graph[level]
+        visited = set(entry_points)
+        scores = self.vectors[entry_points] @ query
+        candidates = [(-float(s), n) for s, n in zip(scores, entry_points)]
+        results = [(float(s), n) for s, n in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_score < results[0][0]:
+                break
+            new_nodes = [n for n in graph[node] if n not in visited]
+            if not new_nodes:
+                continue
+            visited.update(new_nodes)
+            for score, n in zip((self.vectors[new_nodes] @ query).tolist(), new_nodes):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, n))
+                    heapq.heappush(results, (score, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def search(self, queries, k=1):
+        queries = as_matrix(queries)
+        all_scores, all_ids = [], []
+        for query in queries:
+            if self.entry_point is None:
+                scores, ids = pad_result(np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64), k)
+            else:
+                entry = [self.entry_point]
+                for l in range(self.max_level, 0, -1):
+                    entry = [self.search_layer(query, entry, 1, l)[0][1]]
+                results = self.search_layer(query, entry, max(self.ef_search, k), 0)[:k]
+                scores, ids = pad_result(np.array([s for s, _ in results], dtype=np.float32),
+                                         np.array([n for _, n in results], dtype=np.int64), k)
+            all_scores.append(scores)
+            all_ids.append(ids)
+        return np.stack(all_scores), np.stack(all_ids)
+
+    def params(self):
+        return {"M": self.M, "ef_construction": self.ef_construction, "ef_search": self.ef_search, "seed": self.seed}
+
+    #每层的邻接表按csr格式保存：节点编号、邻居起始位置、拼接后的邻居
+    def arrays(self):
+        arrays = {"vectors": self.vectors,
+                  "levels": np.array(self.levels, dtype=np.int64),
+                  "entry": np.array([-1 if self.entry_point is None else self.entry_point, self.max_level])}
+        for l, graph in enumerate(self.graph):
+            nodes = sorted(graph)
+            arrays["level%d_nodes" % l] = np.array(nodes, dtype=np.int64)
+            arrays["level%d_offsets" % l] = np.cumsum([0] + [len(graph[n]) for n in nodes])
+            arrays["level%d_links" % l] = np.array([m for n in nodes for m in graph[n]], dtype=np.int64)
+        return arrays
+
+    def restore(self, data):
+        self.vectors = data.get("vectors")
+        self.levels = data["levels"].tolist()
+        entry_point, self.max_level = data["entry"].tolist()
+        self.entry_point = None if entry_point < 0 else entry_point
+        self.graph = []
+        for l in range(self.max_level + 1):
+            nodes, offsets, links = data["level%d_nodes" % l], data["level%d_offsets" % l], data["level%d_links" % l]
+            self.graph.append(dict((int(n), links[offsets[i]:offsets[i + 1]].tolist()) for i, n in enumerate(nodes)))
+        #继续add时随机层数不与已有节点重复
+        self.rng = np.random.RandomState(self.seed + len(self.levels))
+
+
+#欧氏距离k-means，用于训练pq的子空间码本
+def kmeans(vectors, n_clusters, n_iter=20, seed=0):
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        #|x - c|^2 = |x|^2 - 2xc + |c|^2，|x|^2对argmin没有影响
+        assign = np.argmin((centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        centroids = np.where(empty[:, None], vectors[rng.choice(len(vectors), n_clusters)],
+                             sums / np.maximum(counts, 1)[:, None])
+    return centroids.astype(np.float32)
+
+
+class PQIndex(VectorIndex):
+    index_type = "pq"
+
+    def __init__(self, m=16, n_centroids=256, n_iter=20, train_size=65536, seed=0, chunk_size=65536):
+        super(PQIndex, self).__init__()
+        assert n_centroids <= 256, "编码使用uint8，每段最多256个中心"
+        self.m = m
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.codebooks = None       #(m, n_centroids, dim // m)
+        self.codes = None           #(向量数, m) uint8
+
+    def __len__(self):
+        return 0 if self.codes is None else len(self.codes)
+
+    def train(self, vectors):
+        vectors = as_matrix(vectors)
+        assert vectors.shape[1] % self.m == 0, "向量维度需要能被m整除"
+        rng = np.random.RandomState(self.seed)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), self.train_size), replace=False)]
+        n_centroids = min(self.n_centroids, len(sample))
+        sub_dim = vectors.shape[1] // self.m
+        self.codebooks = np.stack([kmeans(sample[:, i * sub_dim:(i + 1) * sub_dim], n_centroids, self.n_iter, self.seed + i)
+                                   for i in range(self.m)])
+
+    def build(self, vectors):
+        self.codes = None
+        self.train(vectors)
+        self.add(vectors)
+        return self
+
+    #每段取最近的码本中心编号作为编码
+    def encode(self, vectors):
+        sub_dim = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for i, codebook in enumerate(self.codebooks):
+            sub_vectors = vectors[:, i * sub_dim:(i + 1) * sub_dim]
+            for start in range(0, len(vectors), self.chunk_size):
+                chunk = sub_vectors[start:start + self.chunk_size]
+                codes[start:start + self.chunk_size, i] = np.argmin(
+                    (codebook ** 2).sum(axis=1) - 2 * chunk @ codebook.T, axis=1)
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.codebooks[i][codes[:, i]] for i in range(self.m)], axis=1)
+
+    def add(self, vectors):
+        vectors = as_matrix(vectors)
+        if self.codebooks is None:
+            self.train(vectors)
+        codes = self.encode(vectors)
+        self.codes = codes if self.codes is None else np.concatenate([self.codes, codes])
+
+    #非对称距离：问题向量不量化，每段先算出与所有中心的内积表，库中向量的分数由查表相加得到
+    def search(self, queries, k=1):
+        queries = as_matrix(queries)
+        sub_dim = self.codebooks.shape[2]
+        subspace = np.arange(self.m)[None, :]
+        all_scores, all_ids = [], []
+        for query in queries:
+            table = np.einsum("mcd,md->mc", self.codebooks, query.reshape(self.m, sub_dim))
+            scores = np.empty(len(self.codes), dtype=np.float32)
+            for start in range(0, len(self.codes), self.chunk_size):
+                scores[start:start + self.chunk_size] = table[subspace, self.codes[start:start + self.chunk_size]].sum(axis=1)
+            top_scores, top_ids = topk(scores, k)
+            top_scores, top_ids = pad_result(top_scores, top_ids, k)
+            all_scores.append(top_scores)
+            all_ids.append(top_ids)
+        return np.stack(all_scores), np.stack(all_ids)
+
+    def params(self):
+        return {"m": self.m, "n_centroids": self.n_centroids, "n_iter": self.n_iter,
+                "train_size": self.train_size, "seed": self.seed, "chunk_size": self.chunk_size}
+
+    def arrays(self):
+        return {"codebooks": self.codebooks, "codes": self.codes}
+
+    def restore(self, data):
+        self.codebooks = data.get("codebooks")
+        self.codes = data.get("codes")
+
+
+INDEX_TYPES = {"flat": FlatIndex, "ivf": IVFIndex, "hnsw": HNSWIndex, "pq": PQIndex}
+
+
+def build_index(index_type, vectors, **params):
+    return INDEX_TYPES[index_type](**params).build(vectors)
+
+
+def load_index(path):
+    return VectorIndex.load(path)
+
+
+#以flat的精确结果为基准，统计各索引的recall@k、单条检索延迟和内存占用
+def benchmark(indexes, vectors, queries, k=10):
+    queries = as_matrix(queries)
+    exact = FlatIndex().build(vectors)
+    _, exact_ids = exact.search(queries, k)
+    report = {}
+    for name, index in [("flat", exact)] + list(indexes.items()):
+        costs, hit = [], 0
+        for query, truth in zip(queries, exact_ids):
+            start = time.perf_counter()
+            _, ids = index.search(query, k)
+            costs.append((time.perf_counter() - start) * 1000)
+            hit += len(set(ids[0].tolist()) & set(truth.tolist()))
+        report[name] = {"recall@%d" % k: hit / (len(queries) * k),
+                        "p50_ms": float(np.percentile(costs, 50)),
+                        "p99_ms": float(np.percentile(costs, 99)),
+                        "memory_mb": index.memory_bytes() / 1024 / 1024}
+    print("%-12s %10s %10s %10s %10s" % ("index", "recall@%d" % k, "p50_ms", "p99_ms", "memory_mb"))
+    for name, row in report.items():
+        print("%-12s %10.4f %10.3f %10.3f %10.2f" % (name, row["recall@%d" % k], row["p50_ms"], row["p99_ms"],
+                                                     row["memory_mb"]))
+    return report
+
+
+if __name__ == "__main__":
+    #用带簇结构的随机向量模拟同一意图下的多条问法
+    rng = np.random.RandomState(0)
+    dim, intent_num, vector_num = 128, 500, 20000
+    centers = rng.randn(intent_num, dim)
+    vectors = centers[rng.randint(intent_num, size=vector_num)] + 0.5 * rng.randn(vector_num, dim)
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    queries = vectors[rng.choice(vector_num, 200)] + 0.1 * rng.randn(200, dim).astype(np.float32)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    start = time.time()
+    ivf = build_index("ivf", vectors, nlist=200, nprobe=10)
+    print("ivf构建耗时：%.1fs" % (time.time() - start))
+    start = time.time()
+    hnsw = build_index("hnsw", vectors, M=16, ef_construction=100, ef_search=64)
+    print("hnsw构建耗时：%.1fs" % (time.time() - start))
+    #pq分段越多，每个向量占用字节越多，召回越高
+    pq = dict(("pq_m%d" % m, build_index("pq", vectors, m=m)) for m in [8, 16, 32])
+    benchmark(dict({"ivf": ivf, "hnsw": hnsw}, **pq), vectors, queries, k=10)
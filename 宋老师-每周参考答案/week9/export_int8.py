@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import argparse
+import logging
+#量化模型只能在cpu上运行，屏蔽gpu，保证evaluator也在cpu上测试
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+import torch
+from config import Config
+from model import TorchModel
+from evaluate import Evaluator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.quantize import quantize_linear, compare_models
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""
+导出int8动态量化模型
+对训练好的ner模型中的Linear层做动态量化，保存完整模型，加载时不需要再构建bert
+同时在验证集上对比fp32和int8的F1、延迟和大小
+"""
+
+
+def export(config, model_path, output_path):
+    #先建好输出目录，避免跑完两次完整评估后才在保存时报错
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    evaluator = Evaluator(config, None, logger)
+    model = TorchModel(config)
+    model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    model.eval()
+    int8_model = quantize_linear(model)
+    sample_input = next(iter(evaluator.valid_data))[0]
+    report = compare_models(model, int8_model, evaluator, sample_input, logger)
+    #保存完整模型，torch.load(output_path, weights_only=False)即可使用
+    torch.save(int8_model, output_path)
+    logger.info("int8模型已保存至%s" % output_path)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True)
+    parser.add_argument("--output_path", default="output/model_int8.pt")
+    args = parser.parse_args()
+    export(Config, args.model_path, args.output_path)
@@ -3,6 +3,7 @@
 import json
 import re
 import os
+import sys
 import torch
 import random
 import jieba
@@ -10,6 +11,8 @@ import numpy as np
 from torch.utils.data import Dataset, DataLoader
 from collections import defaultdict
 from transformers import BertTokenizer
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.batching import pad_collate, BucketBatchSampler
 """
 数据加载
 """
@@ -55,9 +58,15 @@ class DataGenerator:
     #补齐或截断输入的序列，使其可以在一个batch内运算
     def padding(self, input_id, pad_token=0):
         input_id = input_id[:self.config["max_length"]]
+        #动态padding时只截断，补齐留到组batch时进行
+        if self.config.get("dynamic_padding"):
+            return input_id
         input_id += [pad_token] * (self.config["max_length"] - len(input_id))
         return input_id
 
+    def pad_token_id(self):
+        return self.tokenizer.vocab["[PAD]"]
+
     def __len__(self):
         return len(self.data)
 
@@ -75,8 +84,17 @@ def load_vocab(vocab_path):
 #用torch自带的DataLoader类封装数据
 def load_data(data_path, config, shuffle=True):
     dg = DataGenerator(data_path, config)
-    dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle)
-    return dl
+    if not config.get("dynamic_padding"):
+        dl = DataLoader(dg, batch_size=config["batch_size"], shuffle=shuffle)
+        return dl
+    #输入用pad位补齐，标签用-1补齐，-1不参与loss计算
+    collate_fn = pad_collate((dg.pad_token_id(), -1))
+    if shuffle:
+        lengths = [len(input_ids) for input_ids, _ in dg.data]
+        batch_sampler = BucketBatchSampler(lengths, config["batch_size"])
+        return DataLoader(dg, batch_sampler=batch_sampler, collate_fn=collate_fn)
+    #不打乱时保持原顺序，evaluator依赖顺序对齐sentences
+    return DataLoader(dg, batch_size=config["batch_size"], shuffle=False, collate_fn=collate_fn)
 
 
 
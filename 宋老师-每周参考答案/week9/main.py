@@ -2,6 +2,7 @@
 
 import torch
 import os
+import sys
 import random
 import numpy as np
 import logging
@@ -9,6 +10,8 @@ from config import Config
 from model import TorchModel, choose_optimizer
 from evaluate import Evaluator
 from loader import load_data
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.trainer import Trainer
 
 logging.basicConfig(level = logging.INFO,format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -34,26 +37,10 @@ def main(config):
     optimizer = choose_optimizer(config, model)
     #加载效果测试类
     evaluator = Evaluator(config, model, logger)
-    #训练
-    for epoch in range(config["epoch"]):
-        epoch += 1
-        model.train()
-        logger.info("epoch %d begin" % epoch)
-        train_loss = []
-        for index, batch_data in enumerate(train_data):
-            optimizer.zero_grad()
-            if cuda_flag:
-                batch_data = [d.cuda() for d in batch_data]
-            input_id, labels = batch_data   #输入变化时这里需要修改，比如多输入，多输出的情况
-            loss = model(input_id, labels)
-            loss.backward()
-            optimizer.step()
-            train_loss.append(loss.item())
-            if index % int(len(train_data) / 2) == 0:
-                logger.info("batch loss %f" % loss)
-        logger.info("epoch average loss: %f" % np.mean(train_loss))
-        evaluator.eval(epoch)
-    model_path = os.path.join(config["model_path"], "epoch_%d.pth" % epoch)
+    #训练，梯度累积、autocast、断点续跑等见common/trainer.py
+    trainer = Trainer(config, model, optimizer, evaluator, logger)
+    trainer.train(train_data)
+    model_path = os.path.join(config["model_path"], "epoch_%d.pth" % config["epoch"])
     # torch.save(model.state_dict(), model_path)
     return model, train_data
 
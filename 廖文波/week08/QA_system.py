@@ -132,7 +132,7 @@ class QASystem:
                 results.append([target, score])
         elif self.algo == "bm25":
             words = jieba.lcut(user_query)
-            results = self.bm25_model.get_scores(words)
+            results = self.bm25_model.search(words, 3)
         elif self.algo == "word2vec":
             query_vector = self.sentence_to_vec(user_query)
             for target, vectors in self.target_to_vectors.items():
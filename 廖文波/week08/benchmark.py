@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import jieba
+import numpy as np
+import torch
+from config import Config
+from loader import load_data
+from model import SiameseNetwork
+from bm25 import BM25
+
+#flat / ivf / hnsw / pq 索引的实现在参考答案的week8目录中
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "宋老师-每周参考答案", "week8"))
+from vector_index import build_index
+
+logging.basicConfig(level = logging.INFO,format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""
+检索效果与性能测试
+valid：在data/valid.json上对比不同编码器 + 不同索引，以及bm25，按标准问计算recall@k和MRR
+synthetic：用随机生成的1万~1000万条向量模拟大规模知识库，以flat精确检索结果为基准计算recall@k和MRR
+每组结果同时记录QPS、p99延迟、构建耗时和内存，以jsonl格式追加写入结果文件，便于跟踪回归
+"""
+
+KS = (1, 5, 10)
+
+
+#predictions为按分数排列的预测结果，truths为标准答案列表(valid中只有一个标准问，synthetic中为精确检索的top-k)
+def rank_metrics(predictions, truths, ks=KS):
+    metrics = dict(("recall@%d" % k, 0.0) for k in ks)
+    mrr = 0.0
+    for prediction, truth in zip(predictions, truths):
+        for k in ks:
+            metrics["recall@%d" % k] += len(set(prediction[:k]) & set(truth[:k])) / min(k, len(truth))
+        if truth[0] in prediction:
+            mrr += 1 / (prediction.index(truth[0]) + 1)
+    metrics = dict((key, value / len(truths)) for key, value in metrics.items())
+    metrics["mrr"] = mrr / len(truths)
+    return metrics
+
+
+#search_fn(单条问题) -> 预测结果列表；batch_fn(全部问题) -> 预测结果列表，用来计算QPS
+def measure(search_fn, batch_fn, queries, latency_query_num=200):
+    start = time.perf_counter()
+    predictions = batch_fn(queries)
+    qps = len(queries) / max(time.perf_counter() - start, 1e-9)
+    costs = []
+    for query in queries[:latency_query_num]:
+        start = time.perf_counter()
+        search_fn(query)
+        costs.append((time.perf_counter() - start) * 1000)
+    return predictions, {"qps": qps, "p50_ms": float(np.percentile(costs, 50)), "p99_ms": float(np.percentile(costs, 99))}
+
+
+def index_params(index_type, size):
+    if index_type == "ivf":
+        return {"nlist": max(1, int(4 * np.sqrt(size))), "nprobe": 16}
+    if index_type == "hnsw":
+        return {"M": 16, "ef_construction": 100, "ef_search": 64}
+    if index_type == "pq":
+        return {"m": 16}
+    return {}
+
+
+def evaluate_index(index_type, vectors, queries, to_prediction, truths, search_k):
+    start = time.perf_counter()
+    index = build_index(index_type, vectors, **index_params(index_type, len(vectors)))
+    build_time = time.perf_counter() - start
+    search_fn = lambda query: index.search(query, search_k)
+    batch_fn = lambda batch: [to_prediction(ids) for ids in index.search(batch, search_k)[1]]
+    predictions, timing = measure(search_fn, batch_fn, queries)
+    result = dict(rank_metrics(predictions, truths), **timing)
+    result.update({"build_time_s": build_time, "memory_mb": index.memory_bytes() / 1024 / 1024})
+    return result
+
+
+def encode(model, input_ids, batch_size=256):
+    vectors = []
+    with torch.no_grad():
+        for start in range(0, len(input_ids), batch_size):
+            batch = torch.stack(input_ids[start:start + batch_size])
+            if torch.cuda.is_available():
+                batch = batch.cuda()
+            vector = model(batch).view(len(batch), -1)
+            vectors.append(torch.nn.functional.normalize(vector, dim=-1).cpu().numpy())
+    return np.concatenate(vectors)
+
+
+def read_json_lines(path):
+    with open(path, encoding="utf8") as f:
+        return [json.loads(line) for line in f]
+
+
+#知识库问题按loader中knwb的顺序展开，返回 (问题原文, 问题id, 标准问编号)
+def load_knwb(config):
+    knwb = load_data(config["train_data_path"], config).dataset.knwb
+    with open(config["schema_path"], encoding="utf8") as f:
+        schema = json.load(f)
+    texts = dict()
+    for line in read_json_lines(config["train_data_path"]):
+        texts.setdefault(schema[line["target"]], []).extend(line["questions"])
+    questions, input_ids, labels = [], [], []
+    for standard_question_index, question_ids in knwb.items():
+        questions += texts[standard_question_index]
+        input_ids += question_ids
+        labels += [standard_question_index] * len(question_ids)
+    return questions, input_ids, labels, schema
+
+
+#问题编号列表转换为去重后的标准问编号列表
+def to_standard_questions(ids, labels):
+    seen = []
+    for index in ids:
+        if index >= 0 and labels[index] not in seen:
+            seen.append(labels[index])
+    return seen
+
+
+def valid_suite(config, checkpoints, index_types):
+    results = []
+    valid = read_json_lines(config["valid_data_path"])
+    for model_type, checkpoint in checkpoints:
+        config = dict(config, model_type=model_type)
+        questions, knwb_ids, labels, schema = load_knwb(config)
+        truths = [[schema[label]] for _, label in valid]
+        model = SiameseNetwork(config)
+        model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+        model.eval()
+        if torch.cuda.is_available():
+            model = model.cuda()
+        valid_data = load_data(config["valid_data_path"], config, shuffle=False).dataset
+        knwb_vectors = encode(model, knwb_ids)
+        query_vectors = encode(model, [input_id for input_id, _ in valid_data.data])
+        #同一标准问可能命中多条问法，多取一些问题保证去重后仍有10个标准问
+        search_k = min(len(labels), max(KS) * 5)
+        for index_type in index_types:
+            result = evaluate_index(index_type, knwb_vectors, query_vectors,
+                                    lambda ids: to_standard_questions(ids, labels), truths, search_k)
+            results.append(dict(result, suite="valid", encoder=model_type, index=index_type, kb_size=len(labels)))
+    #bm25与编码器无关，只测一次
+    questions, _, labels, schema = load_knwb(config)
+    truths = [[schema[label]] for _, label in valid]
+    start = time.perf_counter()
+    bm25 = BM25(dict((index, jieba.lcut(question)) for index, question in enumerate(questions)))
+    build_time = time.perf_counter() - start
+    query_words = [jieba.lcut(question) for question, _ in valid]
+    search_k = min(len(labels), max(KS) * 5)
+    search_fn = lambda words: bm25.search(words, search_k)
+    batch_fn = lambda batch: [to_standard_questions([index for index, _ in bm25.search(words, search_k)], labels)
+                              for words in batch]
+    predictions, timing = measure(search_fn, batch_fn, query_words)
+    memory = sum(getattr(bm25, name).nbytes for name in ["indptr", "doc_ids", "tfs", "weights", "doc_len", "idf"])
+    results.append(dict(rank_metrics(predictions, truths), **timing, build_time_s=build_time,
+                        memory_mb=memory / 1024 / 1024, suite="valid", encoder="-", index="bm25", kb_size=len(labels)))
+    return results
+
+
+#带簇结构的随机单位向量，问题由库中向量加噪声得到
+def synthetic_vectors(size, dim, query_num, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(max(1, size // 40), dim).astype(np.float32)
+    vectors = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, 1000000):
+        end = min(size, start + 1000000)
+        chunk = centers[rng.randint(len(centers), size=end - start)] + 0.5 * rng.randn(end - start, dim).astype(np.float32)
+        vectors[start:end] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    queries = vectors[rng.choice(size, query_num)] + 0.1 * rng.randn(query_num, dim).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+
+def synthetic_suite(sizes, dim, query_num, index_types):
+    results = []
+    for size in sizes:
+        vectors, queries = synthetic_vectors(size, dim, query_num)
+        truths = [row.tolist() for row in build_index("flat", vectors).search(queries, max(KS))[1]]
+        for index_type in index_types:
+            result = evaluate_index(index_type, vectors, queries, lambda ids: ids.tolist(), truths, max(KS))
+            results.append(dict(result, suite="synthetic", encoder="-", index=index_type, kb_size=size))
+    return results
+
+
+def write_results(results, output_path):
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(output_path, "a", encoding="utf8") as f:
+        for result in results:
+            f.write(json.dumps(dict(result, timestamp=timestamp), ensure_ascii=False) + "\n")
+    logger.info("%-10s %-8s %-6s %10s %8s %8s %8s %8s %10s %8s %10s %10s" % (
+        "suite", "encoder", "index", "kb_size", "R@1", "R@5", "R@10", "MRR", "QPS", "p99_ms", "build_s", "memory_mb"))
+    for r in results:
+        logger.info("%-10s %-8s %-6s %10d %8.4f %8.4f %8.4f %8.4f %10.1f %8.3f %10.2f %10.2f" % (
+            r["suite"], r["encoder"], r["index"], r["kb_size"], r["recall@1"], r["recall@5"], r["recall@10"],
+            r["mrr"], r["qps"], r["p99_ms"], r["build_time_s"], r["memory_mb"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--suite", choices=["valid", "synthetic", "all"], default="all")
+    #格式 model_type=模型路径，可以传多个，如 --checkpoint bert=model_output/epoch_10.pth --checkpoint lstm=...
+    parser.add_argument("--checkpoint", action="append", default=[])
+    #hnsw为纯python实现，10万条向量的构建就要很久，默认不测，需要时用 --index_types flat,ivf,hnsw,pq 加上
+    parser.add_argument("--index_types", default="flat,ivf,pq")
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--query_num", type=int, default=1000)
+    parser.add_argument("--output", default="benchmark_results.jsonl")
+    args = parser.parse_args()
+    index_types = args.index_types.split(",")
+    results = []
+    if args.suite in ["valid", "all"]:
+        checkpoints = [item.split("=", 1) for item in args.checkpoint] or \
+                      [(Config["model_type"], os.path.join(Config["model_path"], "epoch_%d.pth" % Config["epoch"]))]
+        results += valid_suite(Config, checkpoints, index_types)
+    if args.suite in ["synthetic", "all"]:
+        results += synthetic_suite([int(size) for size in args.sizes.split(",")], args.dim, args.query_num, index_types)
+    write_results(results, args.output)
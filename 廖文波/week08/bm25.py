@@ -1,75 +1,106 @@
 import json
-import math
 import os
 import pickle
 import sys
 from typing import Dict, List
 
+import numpy as np
+
 
 class BM25:
     EPSILON = 0.25
     PARAM_K1 = 1.5  # BM25算法中超参数
     PARAM_B = 0.6  # BM25算法中超参数
 
-    def __init__(self, corpus: Dict):
+    def __init__(self, corpus: Dict = None):
         """
             初始化BM25模型
             :param corpus: 文档集, 文档集合应该是字典形式，key为文档的唯一标识，val对应其文本内容，文本内容需要分词成列表
         """
+        self.doc_keys = []  # 文档编号 -> 文档的唯一标识
+        self.word_to_id = {}  # 单词 -> 单词编号
+        # 倒排表按CSR格式存储：单词 i 的倒排表位于 [indptr[i], indptr[i+1]) 区间
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)  # 倒排表中的文档编号
+        self.tfs = np.zeros(0, dtype=np.float32)  # 单词在该文档中的词频
+        self.weights = np.zeros(0, dtype=np.float32)  # 预先计算好的 idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        self.doc_len = np.zeros(0, dtype=np.int32)  # 记录每篇文档的单词数
+        self.idf = np.zeros(0, dtype=np.float32)  # 记录每个单词的 IDF
+        if corpus:
+            self.add_documents(corpus)
 
-        self.corpus_size = 0  # 文档数量
-        self.wordNumsOfAllDoc = 0  # 用于计算文档集合中平均每篇文档的词数 -> wordNumsOfAllDoc / corpus_size
-        self.doc_freqs = {}  # 记录每篇文档中查询词的词频
-        self.idf = {}  # 记录查询词的 IDF
-        self.doc_len = {}  # 记录每篇文档的单词数
-        self.docContainedWord = {}  # 包含单词 word 的文档集合
-        self._initialize(corpus)
+    @property
+    def corpus_size(self):
+        return len(self.doc_keys)
 
+    @property
+    def avgdl(self):
+        return float(self.doc_len.sum()) / self.corpus_size
 
-    def _initialize(self, corpus: Dict):
+    def add_documents(self, corpus: Dict):
         """
-            根据语料库构建倒排索引
+            向倒排索引中追加文档，新旧倒排表合并后重新计算 idf 和文档权重
+            :param corpus: 格式与初始化时相同
         """
-        # nd = {} # word -> number of documents containing the word
+        terms, docs, tfs, doc_len = [], [], [], []
         for index, document in corpus.items():
-            self.corpus_size += 1
-            self.doc_len[index] = len(document)  # 文档的单词数
-            self.wordNumsOfAllDoc += len(document)
-
+            doc_id = len(self.doc_keys)
+            self.doc_keys.append(index)
+            doc_len.append(len(document))
             frequencies = {}  # 一篇文档中单词出现的频率
             for word in document:
-                if word not in frequencies:
-                    frequencies[word] = 0
-                frequencies[word] += 1
-            self.doc_freqs[index] = frequencies
-
-            # 构建词到文档的倒排索引，将包含单词的和文档和包含关系进行反向映射
-            for word in frequencies.keys():
-                if word not in self.docContainedWord:
-                    self.docContainedWord[word] = set()
-                self.docContainedWord[word].add(index)
-
-        # 计算 idf
-        idf_sum = 0  # collect idf sum to calculate an average idf for epsilon value
-        negative_idfs = []
-        for word in self.docContainedWord.keys():
-            doc_nums_contained_word = len(self.docContainedWord[word])
-            idf = math.log(self.corpus_size - doc_nums_contained_word +
-                           0.5) - math.log(doc_nums_contained_word + 0.5)
-            self.idf[word] = idf
-            idf_sum += idf
-            if idf < 0:
-                negative_idfs.append(word)
-
-        average_idf = float(idf_sum) / len(self.idf)
-        eps = BM25.EPSILON * average_idf
-        for word in negative_idfs:
-            self.idf[word] = eps
-
-    @property
-    def avgdl(self):
-        return float(self.wordNumsOfAllDoc) / self.corpus_size
+                frequencies[word] = frequencies.get(word, 0) + 1
+            for word, freq in frequencies.items():
+                if word not in self.word_to_id:
+                    self.word_to_id[word] = len(self.word_to_id)
+                terms.append(self.word_to_id[word])
+                docs.append(doc_id)
+                tfs.append(freq)
+        # 旧倒排表展开成 (单词, 文档, 词频) 三元组，与新文档的三元组一起按单词排序
+        old_terms = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        all_terms = np.concatenate([old_terms, np.array(terms, dtype=np.int64)])
+        all_docs = np.concatenate([self.doc_ids, np.array(docs, dtype=np.int32)])
+        all_tfs = np.concatenate([self.tfs, np.array(tfs, dtype=np.float32)])
+        order = np.argsort(all_terms, kind="stable")
+        self.doc_ids = all_docs[order]
+        self.tfs = all_tfs[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(all_terms, minlength=len(self.word_to_id)))])
+        self.doc_len = np.concatenate([self.doc_len, np.array(doc_len, dtype=np.int32)])
+        self._initialize()
+
+    def _initialize(self):
+        """
+            根据倒排表计算 idf，以及每个 (单词, 文档) 的BM25权重
+        """
+        doc_nums_contained_word = np.diff(self.indptr).astype(np.float64)
+        idf = np.log(self.corpus_size - doc_nums_contained_word + 0.5) - np.log(doc_nums_contained_word + 0.5)
+        # idf为负的单词用 EPSILON * 平均idf 代替
+        if len(idf):
+            idf[idf < 0] = BM25.EPSILON * idf.mean()
+        self.idf = idf.astype(np.float32)
+        k1 = BM25.PARAM_K1
+        b = BM25.PARAM_B
+        term_ids = np.repeat(np.arange(len(idf)), np.diff(self.indptr))
+        norm = k1 * (1 - b + b * self.doc_len[self.doc_ids] / self.avgdl)
+        self.weights = (self.idf[term_ids] * self.tfs * (k1 + 1) / (self.tfs + norm)).astype(np.float32)
 
+    def score_vector(self, query: List):
+        """
+            查询与所有文档的相关性分数，相当于查询词频向量与权重矩阵的一次稀疏乘法
+            :param query: 查询词列表
+            :return: 长度为文档数的分数数组
+        """
+        query_tf = {}
+        for word in query:
+            if word in self.word_to_id:
+                term_id = self.word_to_id[word]
+                query_tf[term_id] = query_tf.get(term_id, 0) + 1
+        if not query_tf:
+            return np.zeros(self.corpus_size, dtype=np.float32)
+        postings = [(self.indptr[term_id], self.indptr[term_id + 1], tf) for term_id, tf in query_tf.items()]
+        doc_ids = np.concatenate([self.doc_ids[start:end] for start, end, _ in postings])
+        weights = np.concatenate([self.weights[start:end] * tf for start, end, tf in postings])
+        return np.bincount(doc_ids, weights=weights, minlength=self.corpus_size).astype(np.float32)
 
     def get_score(self, query: List, doc_index):
         """
@@ -77,19 +108,63 @@ class BM25:
         :param query: 查询词列表
         :param doc_index: 为语料库中某篇文档对应的索引
         """
-        k1 = BM25.PARAM_K1
-        b = BM25.PARAM_B
-        score = 0
-        doc_freqs = self.doc_freqs[doc_index]
-        for word in query:
-            if word not in doc_freqs:
-                continue
-            score += self.idf[word] * doc_freqs[word] * (k1 + 1) / (
-                    doc_freqs[word] + k1 * (1 - b + b * self.doc_len[doc_index] / self.avgdl))
-        return [doc_index, score]
+        doc_id = self.doc_keys.index(doc_index)
+        return [doc_index, float(self.score_vector(query)[doc_id])]
 
     def get_scores(self, query):
-        scores = [self.get_score(query, index) for index in self.doc_len.keys()]
-        return scores
-
+        scores = self.score_vector(query)
+        return [[index, float(score)] for index, score in zip(self.doc_keys, scores)]
 
+    def search(self, query: List, k=10):
+        """
+        返回分数最高的k篇文档
+        :return: [[文档唯一标识, 分数], ...]，按分数从高到低排列
+        """
+        k = min(k, self.corpus_size)
+        if k == 0:
+            return []
+        scores = self.score_vector(query)
+        # 只在命中查询词的文档中选取，不足k个时用未命中的文档补齐
+        candidates = np.nonzero(scores)[0]
+        if len(candidates) < k:
+            rest = np.setdiff1d(np.arange(self.corpus_size), candidates)[:k - len(candidates)]
+            candidates = np.concatenate([candidates, rest])
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [[self.doc_keys[doc_id], float(scores[doc_id])] for doc_id in candidates]
+
+    def save(self, path):
+        """
+            保存索引，数组单独保存为npy文件，加载时使用mmap
+            :param path: 保存目录
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ["indptr", "doc_ids", "tfs", "weights", "doc_len", "idf"]:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+        words = [None] * len(self.word_to_id)
+        for word, term_id in self.word_to_id.items():
+            words[term_id] = word
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf8") as f:
+            json.dump({"doc_keys": self.doc_keys, "words": words,
+                       "k1": BM25.PARAM_K1, "b": BM25.PARAM_B}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf8") as f:
+            meta = json.load(f)
+        assert (meta["k1"], meta["b"]) == (BM25.PARAM_K1, BM25.PARAM_B), "保存索引时的超参数与当前不一致"
+        model = cls()
+        model.doc_keys = meta["doc_keys"]
+        model.word_to_id = dict((word, term_id) for term_id, word in enumerate(meta["words"]))
+        for name in ["indptr", "doc_ids", "tfs", "weights", "doc_len", "idf"]:
+            setattr(model, name, np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+        return model
+
+
+if __name__ == "__main__":
+    corpus = {"a": ["话费", "查询"], "b": ["流量", "查询", "查询"], "c": ["办理", "宽带"]}
+    bm25 = BM25(corpus)
+    print(bm25.get_scores(["查询", "流量"]))
+    bm25.add_documents({"d": ["流量", "套餐"]})
+    print(bm25.search(["查询", "流量"], 2))
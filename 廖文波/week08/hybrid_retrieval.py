@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import jieba
+import numpy as np
+import torch
+from bm25 import BM25
+from config import Config
+from loader import load_data
+from model import SiameseNetwork
+from predict import Predictor
+
+logging.basicConfig(level = logging.INFO,format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""
+bm25 + 向量检索的混合召回
+两路召回在两个线程中并行执行，结果用RRF(倒数排名)或加权分数融合，
+融合后的短列表用孪生网络的向量重新打分，按标准问取最高分作为结果
+"""
+
+
+class HybridRetriever:
+    def __init__(self, config, model, knwb_data, fusion="rrf", candidate_num=50, rerank_num=20,
+                 rrf_k=60, bm25_weight=0.3):
+        self.config = config
+        self.fusion = fusion                #"rrf" 或 "weighted"
+        self.candidate_num = candidate_num  #每一路召回的数量
+        self.rerank_num = rerank_num        #融合后进入重排的数量
+        self.rrf_k = rrf_k
+        self.bm25_weight = bm25_weight
+        self.predictor = Predictor(config, model, knwb_data)
+        self.dataset = knwb_data.dataset
+        self.load_questions(config["train_data_path"])
+        #知识库中每个问题作为一篇文档，文档标识为问题编号，与knwb_vectors的行号一致
+        self.bm25 = BM25(dict((index, jieba.lcut(question)) for index, question in enumerate(self.questions)))
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    #按与loader中knwb相同的顺序读取问题原文
+    def load_questions(self, data_path):
+        knwb_text = defaultdict(list)
+        with open(data_path, encoding="utf8") as f:
+            for line in f:
+                line = json.loads(line)
+                knwb_text[self.dataset.schema[line["target"]]] += line["questions"]
+        self.questions = []
+        for standard_question_index in self.dataset.knwb.keys():
+            self.questions += knwb_text[standard_question_index]
+        assert len(self.questions) == len(self.predictor.question_ids)
+        return
+
+    #与loader的编码方式保持一致
+    def encode_query(self, text):
+        if self.config["model_type"] == "bert":
+            input_id = self.dataset.tokenizer.encode(text, max_length=self.config["max_length"], pad_to_max_length=True)
+        else:
+            input_id = self.dataset.encode_sentence(text)
+        input_id = torch.LongTensor([input_id])
+        if torch.cuda.is_available():
+            input_id = input_id.cuda()
+        with torch.no_grad():
+            vector = self.predictor.model(input_id).view(-1)
+        return torch.nn.functional.normalize(vector, dim=-1)
+
+    def bm25_candidates(self, text):
+        start = time.perf_counter()
+        results = self.bm25.search(jieba.lcut(text), self.candidate_num)
+        return results, time.perf_counter() - start
+
+    def dense_candidates(self, text):
+        start = time.perf_counter()
+        query_vector = self.encode_query(text)
+        scores = torch.mv(self.predictor.knwb_vectors, query_vector)
+        top_scores, top_index = torch.topk(scores, min(self.candidate_num, len(scores)))
+        results = [[int(index), float(score)] for index, score in zip(top_index, top_scores)]
+        return (results, query_vector), time.perf_counter() - start
+
+    #输入两路召回结果 [[问题编号, 分数], ...]，返回融合后的问题编号列表
+    def fuse(self, bm25_results, dense_results):
+        fused = defaultdict(float)
+        if self.fusion == "rrf":
+            for results in [bm25_results, dense_results]:
+                for rank, (index, _) in enumerate(results):
+                    fused[index] += 1 / (self.rrf_k + rank + 1)
+        else:
+            #两路分数量纲不同，先各自做min-max归一化
+            for results, weight in [(bm25_results, self.bm25_weight), (dense_results, 1 - self.bm25_weight)]:
+                if not results:
+                    continue
+                scores = np.array([score for _, score in results])
+                scores = (scores - scores.min()) / max(scores.max() - scores.min(), 1e-9)
+                for (index, _), score in zip(results, scores):
+                    fused[index] += weight * score
+        return sorted(fused, key=lambda index: fused[index], reverse=True)[:self.rerank_num]
+
+    #用孪生网络向量对短列表重新打分，同一标准问下取最高分
+    def rerank(self, query_vector, candidates):
+        candidate_index = torch.LongTensor(candidates).to(query_vector.device)
+        scores = torch.mv(self.predictor.knwb_vectors[candidate_index], query_vector).tolist()
+        standard_scores = {}
+        for index, score in zip(candidates, scores):
+            standard_question_index = self.predictor.question_index_to_standard_question_index[index]
+            standard_scores[standard_question_index] = max(score, standard_scores.get(standard_question_index, -1))
+        results = sorted(standard_scores.items(), key=lambda x: x[1], reverse=True)
+        return [[self.predictor.index_to_standard_question[index], score] for index, score in results]
+
+    #返回 (按分数排序的[标准问, 分数], 召回结果, 各阶段耗时)
+    def query(self, text):
+        start = time.perf_counter()
+        bm25_future = self.executor.submit(self.bm25_candidates, text)
+        dense_future = self.executor.submit(self.dense_candidates, text)
+        bm25_results, bm25_cost = bm25_future.result()
+        (dense_results, query_vector), dense_cost = dense_future.result()
+        recall_cost = time.perf_counter() - start
+        fuse_start = time.perf_counter()
+        candidates = self.fuse(bm25_results, dense_results)
+        rerank_start = time.perf_counter()
+        results = self.rerank(query_vector, candidates)
+        end = time.perf_counter()
+        costs = {"bm25": bm25_cost, "dense": dense_cost, "recall": recall_cost,
+                 "fuse": rerank_start - fuse_start, "rerank": end - rerank_start, "total": end - start}
+        return results, {"bm25": bm25_results, "dense": dense_results}, costs
+
+
+#在验证集上对比 bm25 / 向量 / 混合检索的准确率，并统计各阶段的p50、p99延迟
+def benchmark(retriever, valid_data_path):
+    to_standard = lambda index: retriever.predictor.index_to_standard_question[
+        retriever.predictor.question_index_to_standard_question_index[index]]
+    correct = defaultdict(int)
+    costs = defaultdict(list)
+    total = 0
+    with open(valid_data_path, encoding="utf8") as f:
+        for line in f:
+            question, label = json.loads(line)
+            results, candidates, cost = retriever.query(question)
+            total += 1
+            correct["bm25"] += int(bool(candidates["bm25"]) and to_standard(candidates["bm25"][0][0]) == label)
+            correct["dense"] += int(to_standard(candidates["dense"][0][0]) == label)
+            correct["hybrid"] += int(results[0][0] == label)
+            for stage, value in cost.items():
+                costs[stage].append(value * 1000)
+    logger.info("验证集条目总量：%d，融合方式：%s" % (total, retriever.fusion))
+    for name in ["bm25", "dense", "hybrid"]:
+        logger.info("%-8s 准确率：%f" % (name, correct[name] / total))
+    for stage, values in costs.items():
+        logger.info("%-8s p50: %.3fms  p99: %.3fms" % (stage, np.percentile(values, 50), np.percentile(values, 99)))
+    return dict((name, correct[name] / total) for name in correct)
+
+
+if __name__ == "__main__":
+    knwb_data = load_data(Config["train_data_path"], Config)
+    model = SiameseNetwork(Config)
+    model.load_state_dict(torch.load(os.path.join(Config["model_path"], "epoch_%d.pth" % Config["epoch"]), map_location="cpu"))
+    for fusion in ["rrf", "weighted"]:
+        retriever = HybridRetriever(Config, model, knwb_data, fusion=fusion)
+        benchmark(retriever, Config["valid_data_path"])